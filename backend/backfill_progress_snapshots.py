@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Migrate topic completion from user_progress rows to per-user bitsets.
+
+Assigns numeric ids to every topic in the sections collection (in section
+order), then groups completed user_progress documents by user and writes one
+progress_snapshots bitset per user in batched bulk writes. Users that already
+have a bitset (migrated lazily by live traffic) are left untouched, so the
+command is safe to re-run.
+
+Usage:
+    python backfill_progress_snapshots.py --batch-size 500
+    python backfill_progress_snapshots.py --drop-legacy   # remove user_progress afterwards
+"""
+
+import argparse
+import asyncio
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_database, close_database, get_collection
+from progress_snapshots import progress_snapshots
+from topic_catalog import topic_catalog
+
+
+async def sync_topic_catalog() -> int:
+    """Give every section topic a stable id; returns the size of the catalog"""
+    sections_col = get_collection("sections")
+    docs = await sections_col.find({}, {"topics": 1}).to_list(length=None)
+    topics = []
+    for doc in docs:
+        topics.extend(doc.get("topics", []))
+    return len(await topic_catalog.ids_for(dict.fromkeys(topics)))
+
+
+async def backfill(args) -> dict:
+    await init_database()
+    try:
+        started = time.perf_counter()
+        total_topics = await sync_topic_catalog()
+        written = await progress_snapshots.backfill(batch_size=args.batch_size, user_ids=args.user)
+        stats = {
+            "total_topics": total_topics,
+            "users": written,
+            "elapsed_seconds": round(time.perf_counter() - started, 2),
+            "dropped_legacy": False,
+        }
+        if args.drop_legacy and not args.user:
+            await get_collection("progress").drop()
+            stats["dropped_legacy"] = True
+        return stats
+    finally:
+        await close_database()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate user_progress rows to progress bitsets")
+    parser.add_argument("--batch-size", type=int, default=500, help="Bitsets written per bulk_write")
+    parser.add_argument("--user", action="append", help="Only migrate this user id (repeatable)")
+    parser.add_argument("--drop-legacy", action="store_true", help="Drop user_progress after a full migration")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("📊 Progress Bitset Migration")
+    print("=" * 50)
+    stats = asyncio.run(backfill(args))
+    print(f"✅ Migrated {stats['users']} users; topic catalog holds {stats['total_topics']} section topics "
+          f"({stats['elapsed_seconds']}s)")
+    if stats["dropped_legacy"]:
+        print("🗑️  Dropped legacy user_progress collection")
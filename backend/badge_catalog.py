@@ -0,0 +1,80 @@
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from catalog_versions import VersionedCatalog
+from database import get_collection
+
+# How long a worker trusts its cached badges before re-checking the shared version (0 checks on every read)
+BADGE_CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("BADGE_CATALOG_VERSION_CHECK_SECONDS", "2"))
+
+# Criteria keys that are minimum thresholds on a per-user metric, all read from the user's user_stats document
+METRIC_CRITERIA = (
+    "streak_days",
+    "longest_streak",
+    "points_earned",
+    "level_reached",
+    "badges_earned",
+    "topics_completed",
+    "quizzes_taken",
+    "quizzes_passed",
+)
+
+
+class CompiledBadge:
+    """A badge document with its criteria reduced to an action filter and (metric, threshold) pairs"""
+
+    __slots__ = ("badge", "id", "action", "requirements")
+
+    def __init__(self, badge: Dict[str, Any]):
+        criteria = badge.get("criteria", {})
+        self.badge = badge
+        self.id = badge["id"]
+        self.action = criteria.get("action")
+        self.requirements = tuple((name, criteria[name]) for name in METRIC_CRITERIA if name in criteria)
+
+    def applies_to(self, action: str) -> bool:
+        return not self.action or self.action == action
+
+    def is_met(self, metric: Callable[[str], int]) -> bool:
+        """True when every threshold is reached; metric(name) returns the user's current value"""
+        for name, threshold in self.requirements:
+            if metric(name) < threshold:
+                return False
+        return True
+
+
+class BadgeCatalog(VersionedCatalog):
+    """In-process cache of the badges collection with pre-compiled criteria"""
+
+    version_id = "badges"
+    collection = "badges"
+
+    def __init__(self, check_interval: float = BADGE_CATALOG_VERSION_CHECK_SECONDS):
+        super().__init__(check_interval)
+        self._badges: List[CompiledBadge] = []
+        self._by_id: Dict[str, CompiledBadge] = {}
+
+    async def _load(self) -> None:
+        badges_col = get_collection("badges")
+        docs = await badges_col.find({}, {"_id": 0}).to_list(length=None)
+        self._badges = [CompiledBadge(doc) for doc in docs]
+        self._by_id = {badge.id: badge for badge in self._badges}
+
+    async def badges(self) -> List[CompiledBadge]:
+        await self._refresh()
+        return self._badges
+
+    async def get(self, badge_id: str) -> Optional[CompiledBadge]:
+        await self._refresh()
+        return self._by_id.get(badge_id)
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "badges": len(self._badges),
+            "reloads": self.reloads,
+        }
+
+
+# Global instance
+badge_catalog = BadgeCatalog()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark response serialization and compression for the largest payloads.
+
+Builds synthetic payloads shaped like /admin/users, /quiz/results and
+/gamification/stats, then compares the previous path (recursive ObjectId walk,
+jsonable_encoder and json.dumps as in FastAPI's JSONResponse) with orjson via
+fast_json.dumps, and reports gzip/brotli sizes and costs. No database needed.
+
+Usage:
+    python benchmark_serialization.py --users 5000 --results 2000 --repeat 50
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from compression import brotli, compress
+from fast_json import dumps
+from models import BadgeProgress, GamificationResponse, UserBadge, UserStats
+
+
+def legacy_serialize(doc: Any) -> Any:
+    """The recursive ObjectId walker the gamification router used before fast_json"""
+    if isinstance(doc, dict):
+        return {key: legacy_serialize(value) for key, value in doc.items()}
+    if isinstance(doc, list):
+        return [legacy_serialize(item) for item in doc]
+    if isinstance(doc, ObjectId):
+        return str(doc)
+    return doc
+
+
+def legacy_dumps(content: Any) -> bytes:
+    content = jsonable_encoder(legacy_serialize(content))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def admin_users(n: int) -> dict:
+    now = datetime.utcnow()
+    return {"users": [{
+        "id": ObjectId(),
+        "email": f"student{i}@example.com",
+        "username": f"student{i}",
+        "name": f"Student {i}",
+        "created_at": (now - timedelta(days=i % 365)).isoformat(),
+        "is_admin": i % 50 == 0,
+    } for i in range(n)]}
+
+
+def quiz_results(n: int) -> dict:
+    now = datetime.utcnow()
+    return {"results": [{
+        "_id": ObjectId(),
+        "user_id": "user-1",
+        "quiz_id": str(uuid.uuid4()),
+        "score": (i * 7) % 101,
+        "total_questions": 10,
+        "correct_answers": (i * 3) % 11,
+        "time_taken": 60 + i % 600,
+        "completed_at": (now - timedelta(minutes=i)).isoformat(),
+    } for i in range(n)]}
+
+
+def gamification_stats(badges: int) -> GamificationResponse:
+    earned = [UserBadge(
+        id=str(uuid.uuid4()), user_id="user-1", badge_id=f"badge_{i}", earned_at=datetime.utcnow().isoformat()
+    ) for i in range(badges)]
+    return GamificationResponse(
+        user_stats=UserStats(user_id="user-1", total_points=4200, level=9, badges_earned=badges, total_badges=badges * 2),
+        badges=earned,
+        badge_progress=[BadgeProgress(
+            badge_id=f"badge_{badges + i}", badge_name=f"Badge {badges + i}", progress=i / badges,
+            current_value=i, target_value=badges,
+        ) for i in range(badges)],
+        recent_achievements=earned[-5:],
+    )
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    """Median milliseconds per call"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def run(args) -> list:
+    payloads = {
+        "/admin/users": admin_users(args.users),
+        "/quiz/results": quiz_results(args.results),
+        "/gamification/stats": gamification_stats(args.badges),
+    }
+    rows = []
+    for name, payload in payloads.items():
+        body = dumps(payload)
+        row = {
+            "endpoint": name,
+            "bytes": len(body),
+            "legacy_ms": timed(lambda: legacy_dumps(payload), args.repeat),
+            "orjson_ms": timed(lambda: dumps(payload), args.repeat),
+            "gzip_bytes": len(compress(body, "gzip")),
+            "gzip_ms": timed(lambda: compress(body, "gzip"), args.repeat),
+        }
+        if brotli is not None:
+            row["br_bytes"] = len(compress(body, "br"))
+            row["br_ms"] = timed(lambda: compress(body, "br"), args.repeat)
+        rows.append(row)
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and response compression")
+    parser.add_argument("--users", type=int, default=5000, help="Users in the /admin/users payload")
+    parser.add_argument("--results", type=int, default=2000, help="Quiz results in the /quiz/results payload")
+    parser.add_argument("--badges", type=int, default=40, help="Earned badges in the /gamification/stats payload")
+    parser.add_argument("--repeat", type=int, default=30, help="Timed runs per measurement (median is reported)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("⏱️  Serialization Benchmark")
+    print("=" * 50)
+    for row in run(args):
+        print(f"{row['endpoint']}: {row['bytes']} bytes")
+        print(f"   legacy encoder {row['legacy_ms']:.2f} ms, orjson {row['orjson_ms']:.2f} ms "
+              f"({row['legacy_ms'] / max(row['orjson_ms'], 1e-6):.1f}x faster)")
+        print(f"   gzip {row['gzip_bytes']} bytes in {row['gzip_ms']:.2f} ms", end="")
+        if "br_bytes" in row:
+            print(f", brotli {row['br_bytes']} bytes in {row['br_ms']:.2f} ms", end="")
+        print()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+
+async def read_version(name: str) -> int:
+    """Current shared version of a cached catalog (0 if it was never bumped)"""
+    versions_col = get_collection("catalog_versions")
+    if versions_col is None:
+        return 0
+    doc = await versions_col.find_one({"_id": name})
+    return doc["version"] if doc else 0
+
+
+async def bump_version(name: str) -> int:
+    """Signal every worker that a cached catalog changed; returns the new version"""
+    versions_col = get_collection("catalog_versions")
+    if versions_col is None:
+        return 0
+    doc = await versions_col.find_one_and_update(
+        {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+
+class VersionedCatalog:
+    """In-process copy of a rarely changing collection, invalidated through a version counter in Mongo.
+
+    Admin writes bump the counter; every worker compares its cached version with the stored one
+    (at most once per check_interval seconds) and reloads only when it changed. Subclasses set
+    version_id and collection and implement _load.
+    """
+
+    version_id = ""
+    collection = ""
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._loaded = False
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self.reloads = 0
+
+    async def _load(self) -> None:
+        raise NotImplementedError
+
+    def _stale(self) -> bool:
+        return not self._loaded or time.monotonic() - self._checked_at >= self.check_interval
+
+    async def _refresh(self) -> None:
+        if not self._stale():
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another request may have refreshed while this one waited
+            if not self._stale():
+                return
+            if get_collection(self.collection) is None:
+                return
+            try:
+                version = await read_version(self.version_id)
+                if not self._loaded or version != self._version:
+                    await self._load()
+                    self._loaded = True
+                    self._version = version
+                    self.reloads += 1
+                    logger.info(f"Catalog {self.version_id} loaded at version {version}")
+            except Exception as e:
+                logger.error(f"Error refreshing catalog {self.version_id}: {e}")
+                if not self._loaded:
+                    raise
+            self._checked_at = time.monotonic()
+
+    async def invalidate(self) -> int:
+        """Bump the shared version after an admin write; this worker reloads on its next read"""
+        self._loaded = False
+        version = await bump_version(self.version_id)
+        logger.info(f"Catalog {self.version_id} invalidated, now at version {version}")
+        return version
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from llm_client import llm_client
+from models import ChatMessage
+from token_usage import estimate_tokens, reserve_llm_tokens, record_llm_usage, release_llm_tokens
+
+logger = logging.getLogger(__name__)
+
+# Context budget configuration
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+CHAT_CONTEXT_MIN_RECENT_MESSAGES = int(os.getenv("CHAT_CONTEXT_MIN_RECENT_MESSAGES", "4"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL") or None
+CHAT_SUMMARY_CACHE_SIZE = int(os.getenv("CHAT_SUMMARY_CACHE_SIZE", "1024"))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+class ChatContextManager:
+    """Keeps /chat payloads within a token budget by replacing older turns with a cached rolling summary"""
+
+    def __init__(
+        self,
+        token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+        min_recent_messages: int = CHAT_CONTEXT_MIN_RECENT_MESSAGES,
+        cache_size: int = CHAT_SUMMARY_CACHE_SIZE,
+    ):
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.cache_size = cache_size
+        # Maps a chained hash of a conversation prefix to the summary of that prefix
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+
+    @staticmethod
+    def _prefix_hashes(messages: List[ChatMessage]) -> List[str]:
+        """hashes[i] identifies messages[:i + 1]; chaining lets every prefix be looked up in one pass"""
+        hashes = []
+        digest = b""
+        for m in messages:
+            digest = hashlib.sha256(digest + f"{m.role}\x00{m.content}".encode("utf-8")).digest()
+            hashes.append(digest.hex())
+        return hashes
+
+    def _remember(self, key: str, summary: str) -> None:
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    async def _summarize(self, older: List[ChatMessage], model: Optional[str], user_key: Optional[str] = None) -> Optional[str]:
+        """Summarize dropped turns, extending the longest previously summarized prefix when there is one.
+
+        The summarization call counts against user_key's token quota when one is given.
+        """
+        hashes = self._prefix_hashes(older)
+        if hashes[-1] in self._summaries:
+            self._summaries.move_to_end(hashes[-1])
+            return self._summaries[hashes[-1]]
+
+        previous_summary, start = None, 0
+        for i in range(len(hashes) - 2, -1, -1):
+            if hashes[i] in self._summaries:
+                previous_summary, start = self._summaries[hashes[i]], i + 1
+                break
+
+        transcript = "\n".join(f"{m.role}: {m.content}" for m in older[start:])
+        if previous_summary:
+            transcript = f"Existing summary: {previous_summary}\n\nNew turns:\n{transcript}"
+        prompt = [
+            ChatMessage(
+                role="system",
+                content=(
+                    "Summarize this tutoring conversation for a tutor who will continue it. Keep the student's "
+                    "goals, the problems discussed, key numbers and formulas, and any open questions. "
+                    "Be concise and factual."
+                ),
+            ),
+            ChatMessage(role="user", content=transcript),
+        ]
+        reserved = 0
+        try:
+            reserved = reserve_llm_tokens(user_key, prompt) if user_key else 0
+            resp_json = await llm_client.complete(prompt, model=CHAT_SUMMARY_MODEL or model, max_tokens=CHAT_SUMMARY_MAX_TOKENS)
+        except Exception as e:
+            if reserved:
+                release_llm_tokens(user_key, reserved)
+            logger.warning(f"Failed to summarize chat context, dropping older turns instead: {e}")
+            return None
+        if user_key:
+            record_llm_usage(user_key, reserved, resp_json.get("usage"))
+        summary = llm_client.extract_content(resp_json)
+        self._remember(hashes[-1], summary)
+        return summary
+
+    async def fit(self, messages: List[ChatMessage], model: Optional[str] = None, user_key: Optional[str] = None) -> Tuple[List[ChatMessage], int]:
+        """Return messages that fit the token budget and the number of prompt tokens saved"""
+        original_tokens = estimate_tokens(messages)
+        if self.token_budget <= 0 or original_tokens <= self.token_budget:
+            return messages, 0
+
+        # Leading system prompts are always kept verbatim
+        split = 0
+        while split < len(messages) and messages[split].role == "system":
+            split += 1
+        system, conversation = messages[:split], messages[split:]
+
+        # Keep as many recent turns as fit, leaving room for the summary
+        remaining = self.token_budget - estimate_tokens(system) - CHAT_SUMMARY_MAX_TOKENS
+        keep = 0
+        for m in reversed(conversation):
+            cost = estimate_tokens([m])
+            if keep >= self.min_recent_messages and cost > remaining:
+                break
+            remaining -= cost
+            keep += 1
+        if keep >= len(conversation):
+            return messages, 0
+
+        older, recent = conversation[:-keep] if keep else conversation, conversation[-keep:] if keep else []
+        summary = await self._summarize(older, model, user_key)
+        fitted = list(system)
+        if summary:
+            fitted.append(ChatMessage(role="system", content=SUMMARY_PREFIX + summary))
+        fitted.extend(recent)
+
+        saved = max(0, original_tokens - estimate_tokens(fitted))
+        logger.info(f"Chat context trimmed: {len(older)} older messages summarized, ~{saved} prompt tokens saved")
+        return fitted, saved
+
+
+# Global instance
+chat_context = ChatContextManager()
@@ -0,0 +1,122 @@
+import gzip
+import os
+from typing import Optional, Set
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # Without brotli only gzip is offered
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_GZIP_LEVEL", "6"))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv("RESPONSE_COMPRESSION_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Appended to the ETag of a compressed representation, since a strong ETag names exact bytes
+ETAG_SUFFIXES = {"gzip": "gz", "br": "br"}
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    """Content codings listed in an Accept-Encoding header, minus those excluded with q=0"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0 exclusions"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag of the encoding-compressed representation of the entity tagged etag"""
+    suffix = f"-{ETAG_SUFFIXES[encoding]}"
+    if etag.endswith('"'):
+        return f'{etag[:-1]}{suffix}"'
+    return f"{etag}{suffix}"
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=RESPONSE_COMPRESSION_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """Compresses complete JSON/text responses with brotli or gzip, whichever the client prefers.
+
+    Only single-message bodies are compressed: streaming responses (SSE) pass through untouched
+    so events are not held back, and so do responses that already carry a Content-Encoding,
+    such as the pre-gzipped catalog responses. Every response that could have been compressed
+    carries Vary: Accept-Encoding, and a compressed one gets its own ETag.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = RESPONSE_COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start_message: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Hold the headers until the body shows whether compression applies
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            # Whether or not this client gets it compressed, another client would
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            if encoding is None:
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            if "etag" in headers:
+                headers["ETag"] = encoded_etag(headers["etag"], encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
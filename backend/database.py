@@ -23,10 +23,19 @@ quiz_questions_col = None
 badges_col = None
 user_badges_col = None
 user_stats_col = None
+gamification_events_col = None
+# LLM caching collections
+explanation_cache_col = None
+llm_usage_col = None
+# Materialized progress
+progress_snapshots_col = None
+topic_catalog_col = None
+# Cache invalidation versions (one document per cached catalog)
+catalog_versions_col = None
 
 async def init_database():
     """Initialize database connection and collections"""
-    global mongo_client, db, users_col, progress_col, quiz_col, quiz_results_col, bookmarks_col, notes_col, sections_col, quiz_questions_col, badges_col, user_badges_col, user_stats_col
+    global mongo_client, db, users_col, progress_col, quiz_col, quiz_results_col, bookmarks_col, notes_col, sections_col, quiz_questions_col, badges_col, user_badges_col, user_stats_col, gamification_events_col, explanation_cache_col, llm_usage_col, progress_snapshots_col, topic_catalog_col, catalog_versions_col
     
     mongo_client = AsyncIOMotorClient(MONGO_URI)
     db = mongo_client[MONGO_DB]
@@ -45,6 +54,17 @@ async def init_database():
     badges_col = db["badges"]
     user_badges_col = db["user_badges"]
     user_stats_col = db["user_stats"]
+    # Durable log of gamification events processed in the background
+    gamification_events_col = db["gamification_events"]
+    
+    # Initialize LLM caching collections
+    explanation_cache_col = db["explanation_cache"]
+    llm_usage_col = db["llm_usage"]
+    
+    # Initialize materialized progress (per-user completion bitsets keyed by user id, over numeric topic ids)
+    progress_snapshots_col = db["progress_snapshots"]
+    topic_catalog_col = db["topic_catalog"]
+    catalog_versions_col = db["catalog_versions"]
     
     # Create indexes with error handling
     try:
@@ -117,6 +137,57 @@ async def init_database():
         await user_stats_col.create_index("user_id", unique=True)
     except Exception:
         pass  # Index might already exist
+    
+    try:
+        # Leaderboard order; also serves rank counts
+        await user_stats_col.create_index([("total_points", -1), ("user_id", 1)])
+    except Exception:
+        pass  # Index might already exist
+    
+    try:
+        # Per-user event history, newest first, for polling and the event stream
+        await gamification_events_col.create_index([("user_id", 1), ("created_at", -1)])
+    except Exception:
+        pass  # Index might already exist
+    
+    try:
+        # Redelivery scan of events that were not processed yet
+        await gamification_events_col.create_index([("status", 1), ("created_at", 1)])
+    except Exception:
+        pass  # Index might already exist
+    
+    try:
+        # Processed events are dropped once their retention window has passed
+        await gamification_events_col.create_index("expires_at", expireAfterSeconds=0)
+    except Exception:
+        pass  # Index might already exist
+
+    # Create indexes for LLM caching collections
+    try:
+        await explanation_cache_col.create_index("expires_at", expireAfterSeconds=0)
+    except Exception:
+        pass  # Index might already exist
+    
+    try:
+        await explanation_cache_col.create_index("topic")
+    except Exception:
+        pass  # Index might already exist
+    
+    try:
+        await llm_usage_col.create_index([("user_id", 1), ("day", 1)], unique=True)
+    except Exception:
+        pass  # Index might already exist
+    
+    try:
+        await llm_usage_col.create_index("day")
+    except Exception:
+        pass  # Index might already exist
+
+    # Create indexes for materialized progress
+    try:
+        await topic_catalog_col.create_index("topic", unique=True)
+    except Exception:
+        pass  # Index might already exist
 
 async def close_database():
     """Close database connection"""
@@ -143,5 +214,13 @@ def get_collection(collection_name: str):
         "badges": badges_col,
         "user_badges": user_badges_col,
         "user_stats": user_stats_col,
+        "gamification_events": gamification_events_col,
+        # LLM caching collections
+        "explanation_cache": explanation_cache_col,
+        "llm_usage": llm_usage_col,
+        # Materialized progress
+        "progress_snapshots": progress_snapshots_col,
+        "topic_catalog": topic_catalog_col,
+        "catalog_versions": catalog_versions_col,
     }
     return collections.get(collection_name)
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from catalog_versions import bump_version, read_version
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+EXPLANATION_CACHE_MAX_ENTRIES = int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "256"))
+EXPLANATION_CACHE_TTL_SECONDS = int(os.getenv("EXPLANATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Seconds a worker trusts its in-process tier before re-checking the shared invalidation version
+EXPLANATION_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("EXPLANATION_CACHE_VERSION_CHECK_SECONDS", "2"))
+
+# catalog_versions document bumped on every invalidation
+VERSION_ID = "explanation_cache"
+
+
+class ExplanationCache:
+    """Two-tier cache for topic explanations: an in-process LRU in front of a Mongo collection with TTL.
+
+    Invalidation deletes from Mongo and bumps a shared version; every worker drops its in-process
+    tier when it sees the version change (checked at most once per check_interval seconds).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = EXPLANATION_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = EXPLANATION_CACHE_TTL_SECONDS,
+        check_interval: float = EXPLANATION_CACHE_VERSION_CHECK_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.check_interval = check_interval
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._entries: "OrderedDict[str, Tuple[str, str, datetime]]" = OrderedDict()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(topic: str, model: str, prompt_version: str) -> str:
+        raw = f"{prompt_version}\x00{model}\x00{topic.strip()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, topic: str, content: str, expires_at: datetime) -> None:
+        self._entries[key] = (topic, content, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _check_version(self) -> None:
+        """Drop the in-process tier if another worker invalidated since the last check"""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        try:
+            version = await read_version(VERSION_ID)
+        except Exception as e:
+            logger.warning(f"Explanation cache version check failed: {e}")
+            return
+        if version != self._version:
+            if self._version is not None:
+                self._entries.clear()
+            self._version = version
+        self._checked_at = time.monotonic()
+
+    async def get(self, topic: str, model: str, prompt_version: str) -> Optional[str]:
+        """Return a cached explanation, checking memory first and then Mongo"""
+        key = self.make_key(topic, model, prompt_version)
+        now = datetime.utcnow()
+        await self._check_version()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            _, content, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return content
+            del self._entries[key]
+
+        cache_col = get_collection("explanation_cache")
+        if cache_col is not None:
+            try:
+                doc = await cache_col.find_one({"_id": key, "expires_at": {"$gt": now}})
+                if doc:
+                    self._remember(key, topic.strip(), doc["content"], doc["expires_at"])
+                    self.persistent_hits += 1
+                    return doc["content"]
+            except Exception as e:
+                logger.warning(f"Explanation cache lookup failed for topic {topic}: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, topic: str, model: str, prompt_version: str, content: str) -> None:
+        """Store an explanation in both tiers"""
+        key = self.make_key(topic, model, prompt_version)
+        topic = topic.strip()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        self._remember(key, topic, content, expires_at)
+        self.stores += 1
+
+        cache_col = get_collection("explanation_cache")
+        if cache_col is not None:
+            try:
+                await cache_col.update_one(
+                    {"_id": key},
+                    {
+                        "$set": {
+                            "topic": topic,
+                            "model": model,
+                            "prompt_version": prompt_version,
+                            "content": content,
+                            "created_at": now,
+                            "expires_at": expires_at,
+                        }
+                    },
+                    upsert=True,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to persist cached explanation for topic {topic}: {e}")
+
+    async def invalidate(self, topic: Optional[str] = None) -> int:
+        """Drop cached explanations for one topic, or everything when no topic is given, in every worker"""
+        # Stored under the same normalized topic that make_key hashes
+        topic = topic.strip() if topic else None
+        if topic:
+            stale_keys = [key for key, entry in self._entries.items() if entry[0] == topic]
+        else:
+            stale_keys = list(self._entries.keys())
+        for key in stale_keys:
+            del self._entries[key]
+        removed = len(stale_keys)
+
+        cache_col = get_collection("explanation_cache")
+        if cache_col is not None:
+            result = await cache_col.delete_many({"topic": topic} if topic else {})
+            removed = max(removed, result.deleted_count)
+            # Other workers drop their in-process tier on their next version check
+            self._version = await bump_version(VERSION_ID)
+            self._checked_at = time.monotonic()
+        logger.info(f"Explanation cache invalidated (topic={topic or 'all'}, removed={removed})")
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        return {
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "version": self._version,
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.memory_hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Global instance
+explanation_cache = ExplanationCache()
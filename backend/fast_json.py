@@ -0,0 +1,34 @@
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(obj: Any) -> Any:
+    """Types orjson does not serialize natively (datetime, date, UUID and dataclasses are native)"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize Mongo documents and Pydantic models straight to compact JSON bytes"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, understanding ObjectId and Pydantic models.
+
+    Used as the app's default response class. FastAPI still runs jsonable_encoder over plain
+    return values, so hot endpoints return a FastJSONResponse directly to skip that walk and
+    hand raw Mongo documents to orjson.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from database import get_collection
+from gamification_service import gamification_service
+from leveling import level_update_pipeline
+from stats_counters import default_user_stats
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration: pending deltas are flushed every interval or after that many events,
+# whichever comes first, so user_stats lags the events by at most about one interval
+GAMIFICATION_WRITE_BEHIND_FLUSH_MS = float(os.getenv("GAMIFICATION_WRITE_BEHIND_FLUSH_MS", "250"))
+GAMIFICATION_WRITE_BEHIND_BATCH = int(os.getenv("GAMIFICATION_WRITE_BEHIND_BATCH", "500"))
+# Event types whose streak and points go through the buffer instead of direct writes
+GAMIFICATION_WRITE_BEHIND_ACTIONS = os.getenv("GAMIFICATION_WRITE_BEHIND_ACTIONS", "chat_message")
+
+# Recent flushes kept for the latency and batch size metrics
+FLUSH_HISTORY_SIZE = 1000
+# Event ids remembered on each user_stats document, so a redelivered event is not applied twice
+APPLIED_EVENTS_KEPT = 200
+
+
+def streak_update_pipeline(activity: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Update stages replaying update_study_streak once per day with activity (day -> latest timestamp)"""
+    stages: List[Dict[str, Any]] = []
+    last_day = {"$substrCP": [{"$ifNull": ["$last_activity", ""]}, 0, 10]}
+    current = {"$ifNull": ["$current_streak", 0]}
+    for day, at in sorted(activity.items()):
+        previous_day = (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+        stages.append({"$set": {
+            "current_streak": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": [last_day, day]}, "then": current},
+                    {"case": {"$eq": [last_day, previous_day]}, "then": {"$add": [current, 1]}},
+                ],
+                "default": 1,
+            }},
+            "last_activity": {"$max": [{"$ifNull": ["$last_activity", ""]}, at]},
+        }})
+        stages.append({"$set": {"longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$current_streak"]}}})
+    return stages
+
+
+def stats_update_pipeline(
+    user_id: str,
+    points: int = 0,
+    activity: Optional[Dict[str, str]] = None,
+    counters: Optional[Dict[str, int]] = None,
+    event_ids: Iterable[str] = (),
+    at: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """One user_stats update applying counters, streak days and points, and remembering the events applied"""
+    # Fill in the defaults initialize_user_gamification would have written, for new users
+    stages: List[Dict[str, Any]] = [
+        {"$replaceWith": {"$mergeObjects": [{"$literal": default_user_stats(user_id)}, "$$ROOT"]}}
+    ]
+    counters = {field: delta for field, delta in (counters or {}).items() if delta}
+    if counters:
+        stages.append({"$set": {
+            field: {"$add": [{"$ifNull": [f"${field}", 0]}, delta]} for field, delta in counters.items()
+        }})
+    stages += streak_update_pipeline(activity or {})
+    if points:
+        stages += level_update_pipeline(points, at or datetime.utcnow().isoformat())
+    event_ids = list(event_ids)
+    if event_ids:
+        stages.append({"$set": {"applied_events": {"$slice": [
+            {"$concatArrays": [{"$ifNull": ["$applied_events", []]}, {"$literal": event_ids}]},
+            -APPLIED_EVENTS_KEPT,
+        ]}}})
+    return stages
+
+
+def unapplied_filter(user_id: str, event_ids: Iterable[str]) -> Dict[str, Any]:
+    """Matches the user's stats only while none of the events were applied.
+
+    Used with upsert: when an event was applied already the upsert collides with the unique
+    user_id index, and the resulting DuplicateKeyError means "nothing to do".
+    """
+    event_ids = list(event_ids)
+    query: Dict[str, Any] = {"user_id": user_id}
+    if event_ids:
+        query["applied_events"] = {"$nin": event_ids}
+    return query
+
+
+class _PendingUser:
+    __slots__ = ("entries", "actions")
+
+    def __init__(self):
+        # (event id, points, counters, timestamp, whether it counts for the streak) per recorded action
+        self.entries: List[Tuple[Optional[str], int, Dict[str, int], str, bool]] = []
+        self.actions: set = set()
+
+    @property
+    def events(self) -> List[str]:
+        return [event_id for event_id, *_ in self.entries if event_id is not None]
+
+    def write(self, user_id: str, entries=None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Filter and update pipeline of the guarded user_stats write for all (or the given) entries"""
+        entries = self.entries if entries is None else entries
+        points = 0
+        counters: Dict[str, int] = {}
+        # Days with streak-relevant activity, mapped to the latest timestamp seen that day
+        activity: Dict[str, str] = {}
+        for _, entry_points, entry_counters, at, streak in entries:
+            points += entry_points
+            for field, delta in entry_counters.items():
+                counters[field] = counters.get(field, 0) + delta
+            if streak:
+                activity[at[:10]] = max(activity.get(at[:10], at), at)
+        event_ids = [entry[0] for entry in entries if entry[0] is not None]
+        last_at = max(entry[3] for entry in entries)
+        return (
+            unapplied_filter(user_id, event_ids),
+            stats_update_pipeline(user_id, points, activity, counters, event_ids, last_at),
+        )
+
+    def update(self, user_id: str) -> UpdateOne:
+        return UpdateOne(*self.write(user_id), upsert=True)
+
+
+class GamificationWriteBuffer:
+    """Accumulates per-user point and streak deltas in memory and writes them with one bulk_write.
+
+    Each flush applies every user's buffered counters, points (with the level recomputed server-side,
+    as in add_points) and streak days in a single pipeline update per user, then runs one badge check
+    per user and action and marks the buffered gamification events processed. Until then the events
+    stay claimed, so deltas lost in a crash are redelivered from the event log; each update records
+    the event ids it applied, so a redelivered event is skipped instead of counted twice.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: float = GAMIFICATION_WRITE_BEHIND_FLUSH_MS,
+        flush_batch: int = GAMIFICATION_WRITE_BEHIND_BATCH,
+        actions: str = GAMIFICATION_WRITE_BEHIND_ACTIONS,
+    ):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_batch = flush_batch
+        self.actions = {action.strip() for action in actions.split(",") if action.strip()}
+        self._pending: Dict[str, _PendingUser] = {}
+        self._events_since_flush = 0
+        self._oldest_pending: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._flushes: deque = deque(maxlen=FLUSH_HISTORY_SIZE)
+        self._totals = {"flushes": 0, "events": 0, "users": 0, "failures": 0, "duplicates": 0}
+
+    def handles(self, action: str) -> bool:
+        return self._task is not None and action in self.actions
+
+    def record(self, user_id: str, action: str, points: int = 0, update_streak: bool = False,
+               event_id: Optional[str] = None, counters: Optional[Dict[str, int]] = None) -> None:
+        """Add one action's deltas to the user's pending totals"""
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = self._pending[user_id] = _PendingUser()
+        elif event_id is not None and event_id in pending.events:
+            # Redelivered while its deltas are still buffered
+            return
+        pending.entries.append((event_id, points, dict(counters or {}), datetime.utcnow().isoformat(), update_streak))
+        pending.actions.add(action)
+        if self._oldest_pending is None:
+            self._oldest_pending = time.monotonic()
+        self._events_since_flush += 1
+        if self._events_since_flush >= self.flush_batch:
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> int:
+        """Write all pending deltas; returns the number of users flushed"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            events = self._events_since_flush
+            oldest = self._oldest_pending
+            self._events_since_flush = 0
+            self._oldest_pending = None
+            user_stats_col = get_collection("user_stats")
+            if user_stats_col is None:
+                return 0
+            started = time.monotonic()
+            user_ids = list(pending)
+            collided: List[str] = []
+            try:
+                await user_stats_col.bulk_write(
+                    [pending[user_id].update(user_id) for user_id in user_ids], ordered=False
+                )
+            except BulkWriteError as e:
+                failed = []
+                for error in e.details.get("writeErrors", []):
+                    user_id = user_ids[error["index"]]
+                    (collided if error.get("code") == 11000 else failed).append(user_id)
+                if failed:
+                    logger.error(f"Failed to flush gamification deltas for {len(failed)} users, re-queueing them")
+                    self._totals["failures"] += 1
+                    # Safe to retry: updates that did land recorded their event ids
+                    self._requeue({user_id: pending.pop(user_id) for user_id in failed}, oldest)
+            except Exception as e:
+                logger.error(f"Failed to flush gamification deltas, re-queueing {len(pending)} users: {e}")
+                self._totals["failures"] += 1
+                self._requeue(pending, oldest)
+                return 0
+            for user_id in collided:
+                await self._apply_one_by_one(user_stats_col, user_id, pending[user_id])
+            written = time.monotonic()
+            for user_id in pending:
+                gamification_service.invalidate_user_data(user_id)
+            await self._complete_events(pending)
+            self._flushes.append({
+                "users": len(pending),
+                "events": events,
+                "write_ms": (written - started) * 1000,
+                "flush_ms": (time.monotonic() - started) * 1000,
+                "staleness_ms": (started - oldest) * 1000 if oldest is not None else 0.0,
+            })
+            self._totals["flushes"] += 1
+            self._totals["events"] += events
+            self._totals["users"] += len(pending)
+            return len(pending)
+
+    async def _apply_one_by_one(self, user_stats_col, user_id: str, user: _PendingUser) -> None:
+        """Some of the user's events were applied before (redelivered); apply the rest individually"""
+        for entry in user.entries:
+            query, pipeline = user.write(user_id, [entry])
+            try:
+                await user_stats_col.update_one(query, pipeline, upsert=True)
+            except DuplicateKeyError:
+                self._totals["duplicates"] += 1
+
+    def _requeue(self, pending: Dict[str, _PendingUser], oldest: Optional[float]) -> None:
+        for user_id, user in pending.items():
+            merged = self._pending.get(user_id)
+            if merged is None:
+                self._pending[user_id] = user
+                continue
+            merged.entries = user.entries + merged.entries
+            merged.actions |= user.actions
+        self._events_since_flush += sum(len(user.entries) for user in pending.values())
+        if oldest is not None:
+            self._oldest_pending = min(oldest, self._oldest_pending or oldest)
+
+    async def _complete_events(self, pending: Dict[str, _PendingUser]) -> None:
+        """One badge check per user and action, then mark the buffered events processed"""
+        checks: List[Tuple[str, str]] = [(user_id, action) for user_id, user in pending.items() for action in sorted(user.actions)]
+        results = await asyncio.gather(
+            *[gamification_service.check_badges(user_id, action) for user_id, action in checks],
+            return_exceptions=True,
+        )
+        earned: Dict[str, List[dict]] = {}
+        for (user_id, _), badges in zip(checks, results):
+            if isinstance(badges, list):
+                earned.setdefault(user_id, []).extend(badges)
+
+        events_col = get_collection("gamification_events")
+        if events_col is None:
+            return
+        # Imported here because the event bus hands buffered events to this module
+        from gamification_events import gamification_event_bus
+        now = datetime.utcnow()
+        marked = {
+            "status": "processed",
+            "processed_at": now.isoformat(),
+            "expires_at": now + timedelta(seconds=gamification_event_bus.retention_seconds),
+        }
+        operations = []
+        for user_id, user in pending.items():
+            if not user.events:
+                continue
+            # Badges earned by the batch are reported on the user's latest event
+            *earlier, latest = user.events
+            if earlier:
+                operations.append(UpdateMany(
+                    {"_id": {"$in": earlier}, "status": "processing"},
+                    [{"$set": {**marked, "result": {"points_gained": "$points", "points_result": None, "newly_earned_badges": []}}}],
+                ))
+            operations.append(UpdateOne(
+                {"_id": latest, "status": "processing"},
+                [{"$set": {**marked, "result": {
+                    "points_gained": "$points",
+                    "points_result": None,
+                    "newly_earned_badges": {"$literal": earned.get(user_id, [])},
+                }}}],
+            ))
+        if operations:
+            try:
+                await events_col.bulk_write(operations, ordered=False)
+            except Exception as e:
+                # The events stay claimed and are redelivered; their recorded ids make the replay a no-op
+                logger.error(f"Failed to mark buffered gamification events processed: {e}")
+        for user_id in pending:
+            gamification_event_bus.notify(user_id)
+
+    def stats(self) -> dict:
+        """Flush latency and batch size metrics over the recent flushes"""
+        def summary(field: str) -> dict:
+            values = sorted(flush[field] for flush in self._flushes)
+            if not values:
+                return {"avg": 0, "p50": 0, "p95": 0, "max": 0}
+            return {
+                "avg": round(sum(values) / len(values), 2),
+                "p50": round(values[len(values) // 2], 2),
+                "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+                "max": round(values[-1], 2),
+            }
+
+        return {
+            "flush_interval_ms": self.flush_interval * 1000,
+            "flush_batch": self.flush_batch,
+            "actions": sorted(self.actions),
+            "pending_users": len(self._pending),
+            "pending_events": self._events_since_flush,
+            "oldest_pending_ms": round((time.monotonic() - self._oldest_pending) * 1000, 2) if self._oldest_pending else 0,
+            **self._totals,
+            "recent_flushes": len(self._flushes),
+            "flush_ms": summary("flush_ms"),
+            "write_ms": summary("write_ms"),
+            "staleness_ms": summary("staleness_ms"),
+            "batch_events": summary("events"),
+            "batch_users": summary("users"),
+        }
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing gamification deltas: {e}")
+
+    async def start(self) -> None:
+        if self._task is None and self.flush_interval > 0:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+# Global instance
+gamification_write_buffer = GamificationWriteBuffer()
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from database import get_collection
+from gamification_buffer import gamification_write_buffer, stats_update_pipeline, unapplied_filter
+from gamification_service import gamification_service
+from leveling import level_state
+
+logger = logging.getLogger(__name__)
+
+# Event pipeline configuration
+GAMIFICATION_EVENT_WORKERS = int(os.getenv("GAMIFICATION_EVENT_WORKERS", "4"))
+# Events left pending or claimed this long (e.g. by a worker process that died) are picked up again
+GAMIFICATION_EVENT_REDELIVERY_SECONDS = float(os.getenv("GAMIFICATION_EVENT_REDELIVERY_SECONDS", "60"))
+GAMIFICATION_EVENT_MAX_ATTEMPTS = int(os.getenv("GAMIFICATION_EVENT_MAX_ATTEMPTS", "3"))
+# How long processed events stay readable through the poll and stream endpoints
+GAMIFICATION_EVENT_RETENTION_SECONDS = int(os.getenv("GAMIFICATION_EVENT_RETENTION_SECONDS", "86400"))
+
+FINISHED_STATUSES = ("processed", "failed")
+
+
+def action_points(action: str, data: Dict[str, Any]) -> Tuple[int, str]:
+    """Points and reason that /gamification/action grants for an action"""
+    if action == "topic_completed":
+        return 10, "Topic completed"
+    if action == "quiz_completed":
+        score = data.get("score", 0)
+        total = data.get("total_questions", 1)
+        percentage = (score / total) * 100
+        if percentage >= 90:
+            return 25, "Excellent quiz performance"
+        if percentage >= 70:
+            return 15, "Good quiz performance"
+        return 5, "Quiz completed"
+    if action == "chat_message":
+        return 1, "Engaged with AI tutor"
+    return 0, ""
+
+
+def event_to_dict(event: dict) -> dict:
+    return {
+        "event_id": event["_id"],
+        "type": event["type"],
+        "status": event["status"],
+        "created_at": event["created_at"],
+        "processed_at": event.get("processed_at"),
+        "result": event.get("result"),
+        "error": event.get("error"),
+    }
+
+
+class GamificationEventBus:
+    """Durable in-process queue for the gamification side effects of user actions.
+
+    Request handlers publish an event (one insert) and respond; a pool of asyncio workers applies
+    streaks, points and badge checks afterwards. Events are sharded by user id so that each user's
+    events run in order on one worker. The gamification_events collection is the log: events that
+    were not processed before a restart or crash are redelivered, so delivery is at-least-once.
+    """
+
+    def __init__(
+        self,
+        workers: int = GAMIFICATION_EVENT_WORKERS,
+        redelivery_seconds: float = GAMIFICATION_EVENT_REDELIVERY_SECONDS,
+        max_attempts: int = GAMIFICATION_EVENT_MAX_ATTEMPTS,
+        retention_seconds: int = GAMIFICATION_EVENT_RETENTION_SECONDS,
+    ):
+        self.worker_count = max(workers, 1)
+        self.redelivery_seconds = redelivery_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._redelivery_task: Optional[asyncio.Task] = None
+        # Ids sitting in a local queue, so redelivery does not queue them twice
+        self._queued: Set[str] = set()
+        self._changed: Dict[str, asyncio.Event] = {}
+        # Long-polls currently waiting per user; the user's event is dropped when the last one leaves
+        self._waiters: Dict[str, int] = {}
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.worker_count)]
+        self._workers = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        # Pick up whatever the previous run left behind before serving new events
+        try:
+            await self._redeliver(min_age=0)
+        except Exception as e:
+            logger.error(f"Error redelivering gamification events: {e}")
+        self._redelivery_task = asyncio.create_task(self._redeliver_periodically())
+        logger.info(f"Gamification event workers started: {self.worker_count}")
+
+    async def stop(self) -> None:
+        tasks = self._workers + ([self._redelivery_task] if self._redelivery_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Anything still queued or claimed stays in the log and is redelivered on the next start
+        self._workers = []
+        self._queues = []
+        self._redelivery_task = None
+        self._queued.clear()
+        logger.info("Gamification event workers stopped")
+
+    async def publish(
+        self,
+        user_id: str,
+        event_type: str,
+        data: Optional[Dict[str, Any]] = None,
+        points: int = 0,
+        reason: str = "",
+        update_streak: bool = False,
+        counters: Optional[Dict[str, int]] = None,
+    ) -> Optional[str]:
+        """Persist an event and queue it for processing; returns the event id"""
+        events_col = get_collection("gamification_events")
+        if events_col is None:
+            logger.error("Database not initialized, gamification event dropped")
+            return None
+        await self.start()
+        event = {
+            "_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "type": event_type,
+            "data": data or {},
+            "points": points,
+            "reason": reason,
+            "update_streak": update_streak,
+            "counters": counters or {},
+            "status": "pending",
+            "attempts": 0,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        await events_col.insert_one(event)
+        self._enqueue(event)
+        return event["_id"]
+
+    async def get(self, user_id: str, event_id: str) -> Optional[dict]:
+        events_col = get_collection("gamification_events")
+        if events_col is None:
+            return None
+        return await events_col.find_one({"_id": event_id, "user_id": user_id})
+
+    async def processed_since(self, user_id: str, since: Optional[str], limit: int) -> List[dict]:
+        """The user's finished events with processed_at after since, oldest first"""
+        events_col = get_collection("gamification_events")
+        if events_col is None:
+            return []
+        query: Dict[str, Any] = {"user_id": user_id, "status": {"$in": list(FINISHED_STATUSES)}}
+        if since:
+            query["processed_at"] = {"$gt": since}
+        return await events_col.find(query).sort("processed_at", 1).to_list(length=limit)
+
+    async def wait_for_user(self, user_id: str, timeout: float) -> None:
+        """Block until one of the user's events finishes in this process, or the timeout passes"""
+        changed = self._changed.setdefault(user_id, asyncio.Event())
+        self._waiters[user_id] = self._waiters.get(user_id, 0) + 1
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters[user_id] -= 1
+            if not self._waiters[user_id]:
+                del self._waiters[user_id]
+                self._changed.pop(user_id, None)
+
+    def notify(self, user_id: str) -> None:
+        """Wake waiters on the user's events; called whenever one of them finishes"""
+        changed = self._changed.pop(user_id, None)
+        if changed is not None:
+            changed.set()
+
+    def _enqueue(self, event: dict) -> None:
+        if event["_id"] in self._queued or not self._queues:
+            return
+        self._queued.add(event["_id"])
+        shard = zlib.crc32(event["user_id"].encode()) % len(self._queues)
+        self._queues[shard].put_nowait(event)
+
+    async def _redeliver(self, min_age: float) -> None:
+        events_col = get_collection("gamification_events")
+        if events_col is None:
+            return
+        now = datetime.utcnow()
+        stale_before = (now - timedelta(seconds=self.redelivery_seconds)).isoformat()
+        # Claims held by a worker that never finished them go back to pending
+        await events_col.update_many(
+            {"status": "processing", "claimed_at": {"$lt": stale_before}},
+            {"$set": {"status": "pending"}},
+        )
+        created_before = (now - timedelta(seconds=min_age)).isoformat()
+        redelivered = 0
+        async for event in events_col.find(
+            {"status": "pending", "created_at": {"$lte": created_before}}
+        ).sort("created_at", 1):
+            if event["_id"] not in self._queued:
+                self._enqueue(event)
+                redelivered += 1
+        if redelivered:
+            logger.info(f"Redelivered {redelivered} gamification event(s)")
+
+    async def _redeliver_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.redelivery_seconds)
+            try:
+                await self._redeliver(min_age=self.redelivery_seconds)
+            except Exception as e:
+                logger.error(f"Error redelivering gamification events: {e}")
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            event = await queue.get()
+            try:
+                await self._process(event)
+            except Exception as e:
+                logger.error(f"Gamification event {event['_id']} failed: {e}")
+            finally:
+                self._queued.discard(event["_id"])
+                queue.task_done()
+
+    async def _process(self, event: dict) -> None:
+        events_col = get_collection("gamification_events")
+        # Claim first: another worker process may have redelivered the same event
+        claimed = await events_col.find_one_and_update(
+            {"_id": event["_id"], "status": "pending"},
+            {"$set": {"status": "processing", "claimed_at": datetime.utcnow().isoformat()}, "$inc": {"attempts": 1}},
+        )
+        if claimed is None:
+            return
+        try:
+            result = await self._apply(claimed)
+            if result is None:
+                # Buffered: the write-behind flush marks the event processed once its deltas are written
+                return
+            update = {"status": "processed", "result": result}
+        except Exception as e:
+            logger.error(f"Error applying gamification event {claimed['_id']}: {e}")
+            if claimed.get("attempts", 0) + 1 < self.max_attempts:
+                # Left for the redelivery sweep
+                await events_col.update_one({"_id": claimed["_id"]}, {"$set": {"status": "pending", "error": str(e)}})
+                return
+            update = {"status": "failed", "error": str(e)}
+        now = datetime.utcnow()
+        update["processed_at"] = now.isoformat()
+        update["expires_at"] = now + timedelta(seconds=self.retention_seconds)
+        await events_col.update_one({"_id": claimed["_id"]}, {"$set": update})
+        self.notify(claimed["user_id"])
+
+    async def _apply(self, event: dict) -> Optional[dict]:
+        """Run the event's side effects in the order the inline handlers used to.
+
+        Counters, streak and points land in one user_stats write that also records the event id,
+        so a redelivered event finds its id there and changes nothing.
+        """
+        user_id = event["user_id"]
+        points = event.get("points", 0)
+        if gamification_write_buffer.handles(event["type"]):
+            gamification_write_buffer.record(
+                user_id, event["type"], points, event.get("update_streak", False), event["_id"], event.get("counters")
+            )
+            return None
+        now = datetime.utcnow().isoformat()
+        activity = {now[:10]: now} if event.get("update_streak") else None
+        points_result = None
+        try:
+            before = await get_collection("user_stats").find_one_and_update(
+                unapplied_filter(user_id, [event["_id"]]),
+                stats_update_pipeline(user_id, max(points, 0), activity, event.get("counters"), [event["_id"]], now),
+                projection={"total_points": 1, "level": 1},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Applied by an earlier delivery; only the badge check below is repeated, and it is idempotent
+            before = None
+        else:
+            if points > 0:
+                before = before or {}
+                new_total = before.get("total_points", 0) + points
+                new_level = level_state(new_total)["level"]
+                points_result = {
+                    "points_gained": points,
+                    "new_total": new_total,
+                    "level_up": new_level > before.get("level", 1),
+                    "new_level": new_level,
+                }
+        gamification_service.invalidate_user_data(user_id)
+        newly_earned_badges = await gamification_service.check_badges(user_id, event["type"], event.get("data"))
+        return {
+            "points_gained": points,
+            "points_result": points_result,
+            "newly_earned_badges": newly_earned_badges,
+        }
+
+
+# Global instance
+gamification_event_bus = GamificationEventBus()
@@ -1,13 +1,79 @@
+import asyncio
+import base64
+import os
+import time
 import uuid
 import json
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from database import get_collection
+from leveling import level_state, level_update_pipeline
+from badge_catalog import badge_catalog
+from response_cache import response_cache
+from stats_counters import default_user_stats, stats_counters
 from models import *
 
+# Seconds one computed gamification summary is shared by a user's /stats, /badges and /progress calls
+GAMIFICATION_DATA_TTL_SECONDS = float(os.getenv("GAMIFICATION_DATA_TTL_SECONDS", "2"))
+GAMIFICATION_DATA_CACHE_SIZE = int(os.getenv("GAMIFICATION_DATA_CACHE_SIZE", "10000"))
+
+
+def encode_leaderboard_cursor(points: int, user_id: str, rank: int) -> str:
+    """Opaque cursor pointing just past a leaderboard row"""
+    raw = json.dumps({"points": points, "user_id": user_id, "rank": rank}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_leaderboard_cursor(cursor: str) -> Dict[str, Any]:
+    """Inverse of encode_leaderboard_cursor; raises ValueError for anything malformed"""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return {"points": int(after["points"]), "user_id": str(after["user_id"]), "rank": int(after["rank"])}
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid leaderboard cursor: {cursor}") from e
+
+
+# Criteria reported by badge progress, in order of precedence when a badge has several
+PROGRESS_METRICS = (
+    "topics_completed",
+    "quizzes_taken",
+    "quizzes_passed",
+    "streak_days",
+    "longest_streak",
+    "points_earned",
+    "level_reached",
+    "badges_earned",
+)
+
+
+class BadgeMetrics:
+    """User metrics that badge criteria compare against, read from the user_stats counters"""
+
+    def __init__(self, user_stats: Dict[str, Any], badges_earned: int):
+        self._values = {
+            "streak_days": user_stats.get("current_streak", 0),
+            "longest_streak": user_stats.get("longest_streak", 0),
+            "points_earned": user_stats.get("total_points", 0),
+            "level_reached": user_stats.get("level", 1),
+            "topics_completed": user_stats.get("topics_completed", 0),
+            "quizzes_taken": user_stats.get("quizzes_taken", 0),
+            "quizzes_passed": user_stats.get("quizzes_passed", 0),
+            # Exact count from the earned badges the caller already loaded
+            "badges_earned": badges_earned,
+        }
+
+    def get(self, name: str) -> int:
+        return self._values.get(name, 0)
+
+    def increment(self, name: str, amount: int = 1):
+        """Keep a metric current after this evaluation changed it"""
+        self._values[name] = self._values.get(name, 0) + amount
+
 class GamificationService:
-    def __init__(self):
-        pass
+    def __init__(self, data_ttl: float = GAMIFICATION_DATA_TTL_SECONDS):
+        self.data_ttl = data_ttl
+        # user_id -> (expires_at, task building the GamificationResponse)
+        self._data_cache: Dict[str, Tuple[float, asyncio.Future]] = {}
     
     def _get_collection(self, name: str):
         """Get collection dynamically to avoid initialization timing issues"""
@@ -28,10 +94,6 @@ class GamificationService:
     def user_stats_col(self):
         return self._get_collection("user_stats")
     
-    @property
-    def progress_col(self):
-        return self._get_collection("progress")
-    
     @property
     def quiz_results_col(self):
         return self._get_collection("quiz_results")
@@ -46,23 +108,7 @@ class GamificationService:
             # Initialize user stats
             await self.user_stats_col.update_one(
                 {"user_id": user_id},
-                {
-                    "$setOnInsert": {
-                        "user_id": user_id,
-                        "total_points": 0,
-                        "level": 1,
-                        "experience": 0,
-                        "experience_to_next_level": 100,
-                        "badges_earned": 0,
-                        "total_badges": 0,
-                        "current_streak": 0,
-                        "longest_streak": 0,
-                        "topics_completed": 0,
-                        "quizzes_taken": 0,
-                        "quizzes_passed": 0,
-                        "last_activity": datetime.utcnow().isoformat()
-                    }
-                },
+                {"$setOnInsert": default_user_stats(user_id)},
                 upsert=True
             )
             return True
@@ -71,51 +117,25 @@ class GamificationService:
             return False
 
     async def add_points(self, user_id: str, points: int, reason: str):
-        """Add points to user and check for level ups"""
+        """Atomically add points and recompute the level server-side"""
         try:
-            # Get current user stats
-            user_stats = await self.user_stats_col.find_one({"user_id": user_id})
-            if not user_stats:
+            # One write: the pipeline adds the points and derives level/experience from the new total,
+            # so concurrent awards cannot overwrite each other; the pre-image tells whether we levelled up
+            update = level_update_pipeline(points, datetime.utcnow().isoformat())
+            projection = {"total_points": 1, "level": 1}
+            before = await self.user_stats_col.find_one_and_update({"user_id": user_id}, update, projection=projection)
+            if before is None:
                 await self.initialize_user_gamification(user_id)
-                user_stats = await self.user_stats_col.find_one({"user_id": user_id})
+                before = await self.user_stats_col.find_one_and_update({"user_id": user_id}, update, projection=projection)
 
-            current_points = user_stats.get("total_points", 0)
-            current_level = user_stats.get("level", 1)
-            current_exp = user_stats.get("experience", 0)
-            exp_to_next = user_stats.get("experience_to_next_level", 100)
-
-            # Add points and experience
-            new_points = current_points + points
-            new_exp = current_exp + points
-            new_level = current_level
-            new_exp_to_next = exp_to_next
-            level_up = False
-
-            # Check for level up
-            while new_exp >= new_exp_to_next:
-                new_level += 1
-                new_exp -= new_exp_to_next
-                new_exp_to_next = int(new_exp_to_next * 1.5)  # Exponential level progression
-                level_up = True
-
-            # Update user stats
-            await self.user_stats_col.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
-                        "total_points": new_points,
-                        "level": new_level,
-                        "experience": new_exp,
-                        "experience_to_next_level": new_exp_to_next,
-                        "last_activity": datetime.utcnow().isoformat()
-                    }
-                }
-            )
+            self.invalidate_user_data(user_id)
+            new_points = before.get("total_points", 0) + points
+            new_level = level_state(new_points)["level"]
 
             return {
                 "points_gained": points,
                 "new_total": new_points,
-                "level_up": level_up,
+                "level_up": new_level > before.get("level", 1),
                 "new_level": new_level
             }
         except Exception as e:
@@ -165,6 +185,7 @@ class GamificationService:
                     }
                 }
             )
+            self.invalidate_user_data(user_id)
 
             return new_streak
         except Exception as e:
@@ -174,122 +195,93 @@ class GamificationService:
     async def check_badges(self, user_id: str, action: str, data: Dict[str, Any] = None):
         """Check and award badges based on user actions"""
         try:
-            # Get all available badges
-            all_badges = await self.badges_col.find({}).to_list(length=None)
+            # Get all available badges (cached, with compiled criteria)
+            all_badges = await badge_catalog.badges()
             if not all_badges:
                 return []  # No badges defined yet
 
             # Get user's current stats
-            user_stats = await self.user_stats_col.find_one({"user_id": user_id})
+            user_stats = await self.user_stats_col.find_one({"user_id": user_id}, {"applied_events": 0})
             if not user_stats:
                 await self.initialize_user_gamification(user_id)
-                user_stats = await self.user_stats_col.find_one({"user_id": user_id})
+                user_stats = await self.user_stats_col.find_one({"user_id": user_id}, {"applied_events": 0})
 
             # Get user's earned badges
-            user_badges = await self.user_badges_col.find({"user_id": user_id}).to_list(length=None)
+            user_badges = await self.user_badges_col.find({"user_id": user_id}, {"badge_id": 1}).to_list(length=None)
             earned_badge_ids = {ub["badge_id"] for ub in user_badges}
 
+            metrics = BadgeMetrics(user_stats, badges_earned=len(earned_badge_ids))
             newly_earned_badges = []
 
             for badge in all_badges:
-                if badge["id"] in earned_badge_ids:
-                    continue  # Already earned
+                if badge.id in earned_badge_ids or not badge.applies_to(action):
+                    continue  # Already earned or triggered by another action
 
                 # Check if badge criteria are met
-                if await self._check_badge_criteria(user_id, badge, action, data, user_stats):
+                if badge.is_met(metrics.get):
                     # Award the badge
                     user_badge = {
                         "id": str(uuid.uuid4()),
                         "user_id": user_id,
-                        "badge_id": badge["id"],
+                        "badge_id": badge.id,
                         "earned_at": datetime.utcnow().isoformat()
                     }
                     await self.user_badges_col.insert_one(user_badge)
+                    await stats_counters.increment(user_id, badges_earned=1)
+                    metrics.increment("badges_earned")
+                    self.invalidate_user_data(user_id)
                     
                     # Add points for the badge
-                    if badge.get("points", 0) > 0:
-                        await self.add_points(user_id, badge["points"], f"Badge earned: {badge['name']}")
+                    if badge.badge.get("points", 0) > 0:
+                        await self.add_points(user_id, badge.badge["points"], f"Badge earned: {badge.badge['name']}")
                     
-                    newly_earned_badges.append(badge)
+                    newly_earned_badges.append(badge.badge)
 
             return newly_earned_badges
         except Exception as e:
             print(f"Error checking badges: {e}")
             return []
 
-    async def _check_badge_criteria(self, user_id: str, badge: Dict, action: str, data: Dict[str, Any], user_stats: Dict):
-        """Check if badge criteria are met"""
-        criteria = badge.get("criteria", {})
-        
-        # Check action-based criteria
-        if criteria.get("action") and criteria["action"] != action:
-            return False
-
-        # Check different types of criteria
-        if "topics_completed" in criteria:
-            completed_topics = await self.progress_col.count_documents({
-                "user_id": user_id,
-                "completed": True
-            })
-            if completed_topics < criteria["topics_completed"]:
-                return False
-
-        if "quizzes_taken" in criteria:
-            quizzes_taken = await self.quiz_results_col.count_documents({"user_id": user_id})
-            if quizzes_taken < criteria["quizzes_taken"]:
-                return False
-
-        if "quizzes_passed" in criteria:
-            quizzes_passed = await self.quiz_results_col.count_documents({
-                "user_id": user_id,
-                "score": {"$gte": 70}  # 70% or higher to pass
-            })
-            if quizzes_passed < criteria["quizzes_passed"]:
-                return False
-
-        if "streak_days" in criteria:
-            current_streak = user_stats.get("current_streak", 0)
-            if current_streak < criteria["streak_days"]:
-                return False
-
-        if "longest_streak" in criteria:
-            longest_streak = user_stats.get("longest_streak", 0)
-            if longest_streak < criteria["longest_streak"]:
-                return False
-
-        if "points_earned" in criteria:
-            total_points = user_stats.get("total_points", 0)
-            if total_points < criteria["points_earned"]:
-                return False
-
-        if "level_reached" in criteria:
-            level = user_stats.get("level", 1)
-            if level < criteria["level_reached"]:
-                return False
-
-        if "badges_earned" in criteria:
-            badges_earned = await self.user_badges_col.count_documents({"user_id": user_id})
-            if badges_earned < criteria["badges_earned"]:
-                return False
-
-        return True
-
     async def get_user_gamification_data(self, user_id: str) -> GamificationResponse:
-        """Get comprehensive gamification data for a user"""
+        """Get comprehensive gamification data for a user.
+
+        /stats, /badges and /progress are requested together on every page load, so one computed
+        result per user is shared by concurrent and closely following calls for data_ttl seconds.
+        """
+        now = time.monotonic()
+        cached = self._data_cache.get(user_id)
+        if cached is None or cached[0] <= now:
+            if len(self._data_cache) >= GAMIFICATION_DATA_CACHE_SIZE:
+                self._data_cache = {uid: entry for uid, entry in self._data_cache.items() if entry[0] > now}
+            cached = (now + self.data_ttl, asyncio.ensure_future(self._build_gamification_data(user_id)))
+            self._data_cache[user_id] = cached
+        # Shielded so a cancelled request does not cancel the build other callers are waiting on
+        data = await asyncio.shield(cached[1])
+        if data is None and self._data_cache.get(user_id) is cached:
+            self._data_cache.pop(user_id)
+        return data
+
+    def invalidate_user_data(self, user_id: str):
+        """Drop the shared gamification result after a write that changes it"""
+        self._data_cache.pop(user_id, None)
+
+    async def _build_gamification_data(self, user_id: str) -> Optional[GamificationResponse]:
         try:
             # Get user stats
-            user_stats = await self.user_stats_col.find_one({"user_id": user_id})
+            user_stats = await self.user_stats_col.find_one({"user_id": user_id}, {"applied_events": 0})
             if not user_stats:
                 await self.initialize_user_gamification(user_id)
-                user_stats = await self.user_stats_col.find_one({"user_id": user_id})
+                user_stats = await self.user_stats_col.find_one({"user_id": user_id}, {"applied_events": 0})
 
             # Get user's badges
-            user_badges = await self.user_badges_col.find({"user_id": user_id}).to_list(length=None)
+            user_badges = await self.user_badges_col.find({"user_id": user_id}, {"_id": 0}).to_list(length=None)
             
-            # Get badge details
+            # Badge details come from the cached catalog instead of one lookup per earned badge
+            all_badges = await badge_catalog.badges()
+            catalog = {badge.id: badge.badge for badge in all_badges}
             badges_with_details = []
             for user_badge in user_badges:
-                badge = await self.badges_col.find_one({"id": user_badge["badge_id"]})
+                badge = catalog.get(user_badge["badge_id"])
                 if badge:
                     badges_with_details.append({
                         **user_badge,
@@ -300,14 +292,14 @@ class GamificationService:
                         "badge_rarity": badge["rarity"]
                     })
 
-            # Get badge progress for unearned badges
-            all_badges = await self.badges_col.find({}).to_list(length=None)
+            # Get badge progress for unearned badges, all from one set of metrics
             earned_badge_ids = {ub["badge_id"] for ub in user_badges}
+            metrics = BadgeMetrics(user_stats, badges_earned=len(earned_badge_ids))
             badge_progress = []
 
             for badge in all_badges:
-                if badge["id"] not in earned_badge_ids:
-                    progress = await self._calculate_badge_progress(user_id, badge, user_stats)
+                if badge.id not in earned_badge_ids:
+                    progress = self._calculate_badge_progress(badge.badge, metrics)
                     if progress:
                         badge_progress.append(progress)
 
@@ -324,45 +316,16 @@ class GamificationService:
             print(f"Error getting gamification data: {e}")
             return None
 
-    async def _calculate_badge_progress(self, user_id: str, badge: Dict, user_stats: Dict) -> Optional[BadgeProgress]:
+    def _calculate_badge_progress(self, badge: Dict, metrics: BadgeMetrics) -> Optional[BadgeProgress]:
         """Calculate progress towards a specific badge"""
         try:
             criteria = badge.get("criteria", {})
-            current_value = 0
-            target_value = 0
-
-            if "topics_completed" in criteria:
-                current_value = await self.progress_col.count_documents({
-                    "user_id": user_id,
-                    "completed": True
-                })
-                target_value = criteria["topics_completed"]
-            elif "quizzes_taken" in criteria:
-                current_value = await self.quiz_results_col.count_documents({"user_id": user_id})
-                target_value = criteria["quizzes_taken"]
-            elif "quizzes_passed" in criteria:
-                current_value = await self.quiz_results_col.count_documents({
-                    "user_id": user_id,
-                    "score": {"$gte": 70}
-                })
-                target_value = criteria["quizzes_passed"]
-            elif "streak_days" in criteria:
-                current_value = user_stats.get("current_streak", 0)
-                target_value = criteria["streak_days"]
-            elif "longest_streak" in criteria:
-                current_value = user_stats.get("longest_streak", 0)
-                target_value = criteria["longest_streak"]
-            elif "points_earned" in criteria:
-                current_value = user_stats.get("total_points", 0)
-                target_value = criteria["points_earned"]
-            elif "level_reached" in criteria:
-                current_value = user_stats.get("level", 1)
-                target_value = criteria["level_reached"]
-            elif "badges_earned" in criteria:
-                current_value = await self.user_badges_col.count_documents({"user_id": user_id})
-                target_value = criteria["badges_earned"]
-            else:
+            # The first criterion present, in this order, is the one progress is reported for
+            metric = next((name for name in PROGRESS_METRICS if name in criteria), None)
+            if metric is None:
                 return None
+            current_value = metrics.get(metric)
+            target_value = criteria[metric]
 
             progress = min(current_value / target_value, 1.0) if target_value > 0 else 0.0
 
@@ -545,47 +508,104 @@ class GamificationService:
                     upsert=True
                 )
 
+            await badge_catalog.invalidate()
+            # Shares the "badges" version with the catalog, so other workers reload it as well
+            response_cache.forget("badges")
             return len(default_badges)
         except Exception as e:
             print(f"Error seeding default badges: {e}")
             return 0
 
+    async def get_leaderboard_page(self, limit: int = 10, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of the leaderboard with a single aggregation over the total_points index"""
+        match = {}
+        rank = 0
+        if cursor:
+            after = decode_leaderboard_cursor(cursor)
+            # Keyset pagination on (total_points desc, user_id asc) so deep pages cost the same as the first
+            match = {"$or": [
+                {"total_points": {"$lt": after["points"]}},
+                {"total_points": after["points"], "user_id": {"$gt": after["user_id"]}},
+            ]}
+            rank = after["rank"]
+
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"total_points": -1, "user_id": 1}},
+            {"$limit": limit},
+            {"$lookup": {
+                "from": "users",
+                "let": {"user_id": "$user_id"},
+                "pipeline": [
+                    # user_id holds the users _id as a string; fall back to a string _id if it is not an ObjectId
+                    {"$match": {"$expr": {"$eq": ["$_id", {"$convert": {
+                        "input": "$$user_id", "to": "objectId", "onError": "$$user_id", "onNull": "$$user_id"
+                    }}]}}},
+                    {"$project": {"_id": 0, "username": 1}},
+                ],
+                "as": "user",
+            }},
+            {"$project": {
+                "_id": 0,
+                "user_id": 1,
+                "total_points": 1,
+                "level": 1,
+                "badges_earned": 1,
+                "current_streak": 1,
+                "user": {"$first": "$user"},
+            }},
+        ]
+        rows = await self.user_stats_col.aggregate(pipeline).to_list(length=None)
+
+        leaderboard = []
+        for row in rows:
+            rank += 1
+            # Stats of deleted accounts keep their position but are not listed
+            if row.get("user") is None:
+                continue
+            leaderboard.append({
+                "user_id": row["user_id"],
+                "username": row["user"].get("username", "Unknown"),
+                "total_points": row.get("total_points", 0),
+                "level": row.get("level", 1),
+                "badges_count": row.get("badges_earned", 0),
+                "streak": row.get("current_streak", 0),
+                "rank": rank
+            })
+
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = encode_leaderboard_cursor(last.get("total_points", 0), last["user_id"], rank)
+        return {"leaderboard": leaderboard, "next_cursor": next_cursor}
+
     async def get_leaderboard(self, limit: int = 10):
         """Get leaderboard of top users"""
         try:
-            # Get top users by points
-            top_users = await self.user_stats_col.find().sort("total_points", -1).limit(limit).to_list(length=None)
-            
-            leaderboard = []
-            for i, user_stats in enumerate(top_users):
-                # Get user info - use ObjectId for proper lookup
-                from bson import ObjectId
-                try:
-                    user = await self.users_col.find_one({"_id": ObjectId(user_stats["user_id"])})
-                except:
-                    # If ObjectId conversion fails, try direct string match
-                    user = await self.users_col.find_one({"_id": user_stats["user_id"]})
-                
-                if user:
-                    # Get badges count
-                    badges_count = await self.user_badges_col.count_documents({
-                        "user_id": user_stats["user_id"]
-                    })
-
-                    leaderboard.append({
-                        "user_id": user_stats["user_id"],
-                        "username": user.get("username", "Unknown"),
-                        "total_points": user_stats.get("total_points", 0),
-                        "level": user_stats.get("level", 1),
-                        "badges_count": badges_count,
-                        "streak": user_stats.get("current_streak", 0),
-                        "rank": i + 1
-                    })
-
-            return leaderboard
+            return (await self.get_leaderboard_page(limit))["leaderboard"]
         except Exception as e:
             print(f"Error getting leaderboard: {e}")
             return []
 
+    async def get_user_rank(self, user_id: str) -> Dict[str, Any]:
+        """A user's leaderboard position, counted on the total_points index instead of scanning"""
+        user_stats = await self.user_stats_col.find_one({"user_id": user_id}, {"total_points": 1, "level": 1})
+        if not user_stats:
+            await self.initialize_user_gamification(user_id)
+            user_stats = {}
+        points = user_stats.get("total_points", 0)
+        # Same ordering as the leaderboard: more points first, ties broken by user_id
+        ahead = await self.user_stats_col.count_documents({"$or": [
+            {"total_points": {"$gt": points}},
+            {"total_points": points, "user_id": {"$lt": user_id}},
+        ]})
+        return {
+            "user_id": user_id,
+            "rank": ahead + 1,
+            "total_points": points,
+            "level": user_stats.get("level", 1),
+            "total_users": await self.user_stats_col.estimated_document_count(),
+        }
+
 # Global instance
 gamification_service = GamificationService()
@@ -0,0 +1,81 @@
+import math
+from typing import Any, Dict, List
+
+# Level 1 -> 2 needs 100 experience; every further level needs int(previous * 1.5)
+LEVEL_BASE_EXPERIENCE = 100
+LEVEL_GROWTH = 1.5
+
+
+def _cumulative_thresholds() -> List[int]:
+    """thresholds[n] = total points needed to have gained n levels, while it fits a Mongo Int64"""
+    thresholds = [0]
+    step = LEVEL_BASE_EXPERIENCE
+    while thresholds[-1] + step < 2 ** 62:
+        thresholds.append(thresholds[-1] + step)
+        step = int(step * LEVEL_GROWTH)
+    return thresholds
+
+
+LEVEL_THRESHOLDS = _cumulative_thresholds()
+MAX_LEVELS_GAINED = len(LEVEL_THRESHOLDS) - 2
+
+# Without truncation the thresholds are a geometric series, 200 * (1.5 ** n - 1), which inverts
+# to the estimate below; int() truncation and float rounding move it by at most one level
+_GEOMETRIC_SCALE = LEVEL_BASE_EXPERIENCE / (LEVEL_GROWTH - 1)
+_LN_GROWTH = math.log(LEVEL_GROWTH)
+
+
+def levels_gained(total_points: int) -> int:
+    """Closed-form number of level-ups reached with total_points"""
+    estimate = math.floor(math.log(max(total_points, 0) / _GEOMETRIC_SCALE + 1) / _LN_GROWTH)
+    n = min(max(estimate, 0), MAX_LEVELS_GAINED)
+    if LEVEL_THRESHOLDS[n] > total_points:
+        n -= 1
+    elif LEVEL_THRESHOLDS[n + 1] <= total_points:
+        n += 1
+    return min(max(n, 0), MAX_LEVELS_GAINED)
+
+
+def level_state(total_points: int) -> Dict[str, int]:
+    """Level fields of user_stats as a pure function of the points total"""
+    n = levels_gained(total_points)
+    return {
+        "level": n + 1,
+        "experience": total_points - LEVEL_THRESHOLDS[n],
+        "experience_to_next_level": LEVEL_THRESHOLDS[n + 1] - LEVEL_THRESHOLDS[n],
+    }
+
+
+def level_update_pipeline(points: int, now: str) -> List[Dict[str, Any]]:
+    """Update pipeline that adds points and recomputes the level fields server-side in one write"""
+    total = "$total_points"
+    estimate = {"$floor": {"$divide": [
+        {"$ln": {"$add": [{"$divide": [{"$max": [total, 0]}, _GEOMETRIC_SCALE]}, 1]}},
+        _LN_GROWTH,
+    ]}}
+    clamped = {"$toInt": {"$min": [{"$max": [estimate, 0]}, MAX_LEVELS_GAINED]}}
+    corrected = {"$let": {
+        "vars": {"n": clamped},
+        "in": {"$min": [MAX_LEVELS_GAINED, {"$max": [0, {"$switch": {
+            "branches": [
+                {"case": {"$gt": [{"$arrayElemAt": [LEVEL_THRESHOLDS, "$$n"]}, total]},
+                 "then": {"$subtract": ["$$n", 1]}},
+                {"case": {"$lte": [{"$arrayElemAt": [LEVEL_THRESHOLDS, {"$add": ["$$n", 1]}]}, total]},
+                 "then": {"$add": ["$$n", 1]}},
+            ],
+            "default": "$$n",
+        }}]}]},
+    }}
+    return [
+        {"$set": {"total_points": {"$add": [{"$ifNull": [total, 0]}, points]}, "last_activity": now}},
+        {"$set": {"_levels_gained": corrected}},
+        {"$set": {
+            "level": {"$add": ["$_levels_gained", 1]},
+            "experience": {"$subtract": [total, {"$arrayElemAt": [LEVEL_THRESHOLDS, "$_levels_gained"]}]},
+            "experience_to_next_level": {"$subtract": [
+                {"$arrayElemAt": [LEVEL_THRESHOLDS, {"$add": ["$_levels_gained", 1]}]},
+                {"$arrayElemAt": [LEVEL_THRESHOLDS, "$_levels_gained"]},
+            ]},
+        }},
+        {"$unset": "_levels_gained"},
+    ]
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Transport selection: "live" talks to OpenRouter, "record" also captures every exchange,
+# "replay" serves captured exchanges without any network access
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "live").lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+# Synthetic latency for replay: a number of milliseconds, or "recorded" to reuse the captured latency
+LLM_REPLAY_LATENCY_MS = os.getenv("LLM_REPLAY_LATENCY_MS", "0")
+# Delay between streamed SSE events during replay, to mimic token-by-token generation
+LLM_REPLAY_CHUNK_DELAY_MS = float(os.getenv("LLM_REPLAY_CHUNK_DELAY_MS", "0"))
+
+
+def request_key(request: httpx.Request) -> str:
+    """Identify a request by its canonical JSON body (model, messages and parameters)"""
+    try:
+        canonical = json.dumps(json.loads(request.content), sort_keys=True)
+    except ValueError:
+        canonical = request.content.decode("utf-8", errors="replace")
+    return hashlib.sha256(f"{request.method} {request.url.path}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Forwards requests to the real transport and appends each exchange to the cassette file"""
+
+    def __init__(self, path: str, inner: httpx.AsyncBaseTransport):
+        self.path = path
+        self.inner = inner
+        self._lock = threading.Lock()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        # Cassettes store plain text, so ask for an uncompressed body
+        request.headers["Accept-Encoding"] = "identity"
+        raw = await self.inner.handle_async_request(request)
+        # Wrapping the raw stream lets httpx undo any Content-Encoding the server applied anyway
+        response = httpx.Response(raw.status_code, headers=raw.headers, stream=raw.stream, request=request)
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        record = {
+            "key": request_key(request),
+            "request": json.loads(request.content or b"null"),
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type", "application/json"),
+            "body": body.decode("utf-8", errors="replace"),
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        await asyncio.to_thread(self._append, json.dumps(record) + "\n")
+        # The body is decoded, so the rebuilt response carries no Content-Encoding
+        return httpx.Response(
+            response.status_code,
+            headers={"content-type": record["content_type"]},
+            content=body,
+            request=request,
+        )
+
+    def _append(self, line: str) -> None:
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Serves recorded exchanges from the cassette, indexed by request key, with synthetic latency"""
+
+    def __init__(self, path: str, latency_ms: str = LLM_REPLAY_LATENCY_MS, chunk_delay_ms: float = LLM_REPLAY_CHUNK_DELAY_MS):
+        self.path = path
+        self.latency_ms = latency_ms
+        self.chunk_delay_ms = chunk_delay_ms
+        self._index: Dict[str, List[dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            logger.warning(f"LLM cassette not found at {self.path}; every replayed request will miss")
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._index.setdefault(record["key"], []).append(record)
+        logger.info(f"Loaded LLM cassette {self.path} with {len(self._index)} distinct requests")
+
+    def _latency_seconds(self, record: dict) -> float:
+        if self.latency_ms == "recorded":
+            return record.get("latency_ms", 0) / 1000.0
+        return float(self.latency_ms or 0) / 1000.0
+
+    async def _stream_events(self, body: str) -> AsyncIterator[bytes]:
+        for event in body.split("\n\n"):
+            if event:
+                yield (event + "\n\n").encode("utf-8")
+                await asyncio.sleep(self.chunk_delay_ms / 1000.0)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        records = self._index.get(key)
+        if not records:
+            self.misses += 1
+            logger.warning(f"No recorded LLM response for request {key[:12]}")
+            return httpx.Response(
+                404,
+                json={"error": {"message": "No recorded response for this request in the LLM cassette"}},
+                request=request,
+            )
+        self.hits += 1
+        # Identical requests recorded several times are replayed in rotation
+        position = self._cursor.get(key, 0)
+        self._cursor[key] = position + 1
+        record = records[position % len(records)]
+
+        await asyncio.sleep(self._latency_seconds(record))
+        headers = {"content-type": record["content_type"]}
+        if record["content_type"].startswith("text/event-stream") and self.chunk_delay_ms:
+            return httpx.Response(
+                record["status"],
+                headers=headers,
+                stream=_AsyncByteStream(self._stream_events(record["body"])),
+                request=request,
+            )
+        return httpx.Response(record["status"], headers=headers, content=record["body"].encode("utf-8"), request=request)
+
+
+class _AsyncByteStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._chunks:
+            yield chunk
+
+
+def build_transport(limits: httpx.Limits, mode: str = LLM_TRANSPORT, path: str = LLM_CASSETTE_PATH) -> Optional[httpx.AsyncBaseTransport]:
+    """Return the transport for the configured mode, or None to use httpx's default pooled transport"""
+    if mode == "record":
+        logger.info(f"Recording LLM traffic to {path}")
+        return RecordingTransport(path, httpx.AsyncHTTPTransport(limits=limits))
+    if mode == "replay":
+        logger.info(f"Replaying LLM traffic from {path}")
+        return ReplayTransport(path)
+    return None
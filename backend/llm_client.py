@@ -0,0 +1,456 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from llm_cassette import LLM_CASSETTE_PATH, LLM_TRANSPORT, build_transport
+from llm_resilience import CircuitBreaker, LatencyTracker, RetryBudget, LLM_BREAKER_COOLDOWN
+
+logger = logging.getLogger(__name__)
+
+# OpenRouter configuration
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+DEFAULT_MODEL = os.getenv("OPENROUTER_DEFAULT_MODEL", "deepseek/deepseek-chat")
+
+# Connection pool configuration
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+# Share one upstream call between concurrent identical requests
+LLM_COALESCE_REQUESTS = os.getenv("LLM_COALESCE_REQUESTS", "true").lower() == "true"
+
+# Resilience configuration
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_RETRY_MAX_BACKOFF = float(os.getenv("LLM_RETRY_MAX_BACKOFF", "8"))
+# Percentile of recent latency after which a duplicate request is raced against the slow one (0 disables)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0"))
+
+
+def _is_retryable(e: Exception) -> bool:
+    """Timeouts, connection failures, throttling and 5xx are transient; other 4xx are not"""
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        return status in (408, 429) or status >= 500
+    return isinstance(e, (httpx.TransportError, ValueError))
+
+
+def _message_to_dict(message: Any) -> Dict[str, Any]:
+    """Accept pydantic ChatMessage objects as well as plain dicts"""
+    if hasattr(message, "model_dump"):
+        return message.model_dump()
+    return dict(message)
+
+
+class LLMClient:
+    """Async OpenRouter client backed by a shared keep-alive connection pool"""
+
+    def __init__(
+        self,
+        api_url: str = OPENROUTER_API_URL,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_MAX_KEEPALIVE_CONNECTIONS,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        timeout: float = LLM_REQUEST_TIMEOUT,
+        coalesce: bool = LLM_COALESCE_REQUESTS,
+        fallback_models: Optional[List[str]] = None,
+        max_retries: int = LLM_MAX_RETRIES,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+        breaker_cooldown: float = LLM_BREAKER_COOLDOWN,
+        transport_mode: str = LLM_TRANSPORT,
+        cassette_path: str = LLM_CASSETTE_PATH,
+    ):
+        self.api_url = api_url
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.coalesce = coalesce
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.fallback_models = LLM_FALLBACK_MODELS if fallback_models is None else fallback_models
+        self.max_retries = max_retries
+        self.hedge_percentile = hedge_percentile
+        self.breaker_cooldown = breaker_cooldown
+        self.transport_mode = transport_mode
+        self.cassette_path = cassette_path
+        self.retry_budget = RetryBudget()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self.retries = 0
+        self.hedged_calls = 0
+        self.fallback_calls = 0
+        self._observers: List[Callable[[str, float, bool], None]] = []
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP client lazily so it binds to the running event loop"""
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            )
+            self._client = httpx.AsyncClient(
+                limits=limits,
+                transport=build_transport(limits, self.transport_mode, self.cassette_path),
+                timeout=httpx.Timeout(self.timeout, connect=LLM_CONNECT_TIMEOUT),
+            )
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    def _headers(self) -> Dict[str, str]:
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        if not api_key and self.transport_mode == "replay":
+            # Replayed responses never leave the process, so no real key is needed
+            api_key = "replay"
+        if not api_key:
+            logger.error("Missing OPENROUTER_API_KEY in environment")
+            raise HTTPException(status_code=500, detail="Missing OPENROUTER_API_KEY in environment")
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": "https://quantitative-chatbot.com",
+            "X-Title": "Quantitative Chatbot",
+        }
+
+    async def close(self) -> None:
+        """Close pooled connections (called on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _build_payload(self, messages: List[Any], model: Optional[str], params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "model": model or DEFAULT_MODEL,
+            "messages": [_message_to_dict(m) for m in messages],
+            **params,
+        }
+
+    @staticmethod
+    def _coalesce_key(payload: Dict[str, Any]) -> str:
+        """Identical requests are those with the same model, parameters and whitespace-normalized messages"""
+        normalized = {
+            **payload,
+            "messages": [
+                {"role": m.get("role"), "content": " ".join(str(m.get("content", "")).split())}
+                for m in payload["messages"]
+            ],
+        }
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(cooldown=self.breaker_cooldown)
+        return self._breakers[model]
+
+    def _latency(self, model: str) -> LatencyTracker:
+        if model not in self._latencies:
+            self._latencies[model] = LatencyTracker()
+        return self._latencies[model]
+
+    def _model_chain(self, model: str) -> List[str]:
+        """The requested model followed by the configured fallbacks, without duplicates"""
+        return list(dict.fromkeys([model, *self.fallback_models]))
+
+    def breaker_state(self, model: str) -> str:
+        """Current circuit breaker state for a model ("closed" if it has not been called yet)"""
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            return "closed"
+        # An open breaker only turns half_open in allow_request(), which is not called for a model nobody selects
+        if breaker.state == "open" and not breaker.is_open():
+            return "half_open"
+        return breaker.state
+
+    def breaker_open(self, model: str) -> bool:
+        """Whether the model's breaker still refuses requests (False once its cooldown has passed)"""
+        breaker = self._breakers.get(model)
+        return breaker is not None and breaker.is_open()
+
+    def add_observer(self, observer: Callable[[str, float, bool], None]) -> None:
+        """Register a callback receiving (model, seconds, ok) for every upstream attempt"""
+        self._observers.append(observer)
+
+    def _notify(self, model: str, seconds: float, ok: bool) -> None:
+        for observer in self._observers:
+            try:
+                observer(model, seconds, ok)
+            except Exception as e:
+                logger.warning(f"LLM observer failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "retries": self.retries,
+            "hedged_calls": self.hedged_calls,
+            "fallback_calls": self.fallback_calls,
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+            "in_flight": len(self._in_flight),
+            "max_in_flight": self.max_in_flight,
+            "max_connections": self.max_connections,
+            "fallback_models": self.fallback_models,
+            "transport": self.transport_mode,
+            "circuit_breakers": {model: breaker.stats() for model, breaker in self._breakers.items()},
+        }
+
+    def _translate_error(self, e: Exception) -> HTTPException:
+        """Map transport errors onto the HTTPExceptions the API layer returns"""
+        if isinstance(e, httpx.HTTPStatusError):
+            try:
+                detail = e.response.json().get("error", {}).get("message") or e.response.text
+            except Exception:
+                detail = str(e)
+            logger.error(f"OpenRouter HTTP error: {e.response.status_code} - {detail}")
+            return HTTPException(status_code=e.response.status_code or 500, detail=detail)
+        if isinstance(e, httpx.TimeoutException):
+            logger.error(f"OpenRouter request timed out: {e}")
+            return HTTPException(status_code=504, detail="Timed out contacting OpenRouter")
+        if isinstance(e, httpx.RequestError):
+            logger.error(f"OpenRouter network error: {e}")
+            return HTTPException(status_code=502, detail=f"Network error contacting OpenRouter: {e}")
+        logger.error(f"Invalid response from OpenRouter: {e}")
+        return HTTPException(status_code=502, detail="Invalid response from OpenRouter")
+
+    def _exhausted_error(self, last_error: Optional[Exception]) -> HTTPException:
+        if last_error is None:
+            logger.error("All OpenRouter models have an open circuit breaker; failing fast")
+            return HTTPException(status_code=503, detail="AI service temporarily unavailable, please retry shortly")
+        return self._translate_error(last_error)
+
+    async def complete(
+        self,
+        messages: List[Any],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **params: Any,
+    ) -> Dict[str, Any]:
+        """Send a chat completion request and return the decoded OpenRouter response.
+
+        Concurrent identical requests share a single upstream call, so callers must treat
+        the returned dict as read-only.
+        """
+        payload = self._build_payload(messages, model, params)
+        headers = self._headers()
+        if not self.coalesce:
+            return await self._send(payload, headers, timeout)
+
+        key = self._coalesce_key(payload)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send(payload, headers, timeout))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced_calls += 1
+            logger.info(f"Coalesced OpenRouter request with an in-flight call (model: {payload['model']})")
+        # Shield the shared call so one disconnecting client does not cancel it for the other waiters
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        # Retrieve the outcome so an error is not reported as unhandled when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    async def _send(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: Optional[float]) -> Dict[str, Any]:
+        """Try the requested model, then each fallback, skipping models whose circuit breaker is open"""
+        last_error: Optional[Exception] = None
+        for model in self._model_chain(payload["model"]):
+            breaker = self._breaker(model)
+            if not breaker.allow_request():
+                continue
+            if model != payload["model"]:
+                self.fallback_calls += 1
+                logger.warning(f"Falling back to model {model} after {payload['model']} failed")
+            try:
+                result = await self._send_with_retries({**payload, "model": model}, headers, timeout)
+            except (httpx.HTTPError, ValueError) as e:
+                if not _is_retryable(e):
+                    breaker.record_success()
+                    raise self._translate_error(e)
+                breaker.record_failure()
+                last_error = e
+                continue
+            breaker.record_success()
+            return result
+        raise self._exhausted_error(last_error)
+
+    async def _send_with_retries(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: Optional[float]) -> Dict[str, Any]:
+        """Retry transient failures with full-jitter exponential backoff while the retry budget allows"""
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return await self._send_hedged(payload, headers, timeout)
+            except (httpx.HTTPError, ValueError) as e:
+                if not _is_retryable(e) or attempt >= self.max_retries or not self.retry_budget.try_spend():
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = random.uniform(0, min(LLM_RETRY_MAX_BACKOFF, LLM_RETRY_BACKOFF * 2 ** attempt))
+                logger.warning(f"Retrying OpenRouter call ({attempt}/{self.max_retries}) in {delay:.2f}s after: {e}")
+                await asyncio.sleep(delay)
+
+    async def _send_hedged(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: Optional[float]) -> Dict[str, Any]:
+        """Race a second request once the first is slower than the configured latency percentile"""
+        hedge_after = self._latency(payload["model"]).percentile(self.hedge_percentile) if self.hedge_percentile else None
+        if hedge_after is None:
+            return await self._post(payload, headers, timeout)
+
+        primary = asyncio.ensure_future(self._post(payload, headers, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self.hedged_calls += 1
+        logger.info(f"Hedging OpenRouter call to {payload['model']} after {hedge_after:.2f}s")
+        pending = {primary, asyncio.ensure_future(self._post(payload, headers, timeout))}
+        try:
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _post(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: Optional[float]) -> Dict[str, Any]:
+        logger.info(f"Calling OpenRouter API with model: {payload['model']}")
+        self.upstream_calls += 1
+        request_timeout = httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT) if timeout else httpx.USE_CLIENT_DEFAULT
+        async with self._get_semaphore():
+            started = time.monotonic()
+            try:
+                resp = await self._get_client().post(
+                    self.api_url, json=payload, headers=headers, timeout=request_timeout
+                )
+                resp.raise_for_status()
+                data = resp.json()
+            except (httpx.HTTPError, ValueError) as e:
+                # Client errors say nothing about the model's health
+                if _is_retryable(e):
+                    self._notify(payload["model"], time.monotonic() - started, False)
+                raise
+        elapsed = time.monotonic() - started
+        self._latency(payload["model"]).record(elapsed)
+        self._notify(payload["model"], elapsed, True)
+        return data
+
+    async def stream(
+        self,
+        messages: List[Any],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **params: Any,
+    ) -> AsyncIterator[str]:
+        """Stream a chat completion, yielding content deltas as OpenRouter emits them.
+
+        Fallback models are only tried while no content has been sent; once deltas
+        are flowing, errors propagate to the caller. on_usage receives the token
+        usage OpenRouter reports in the final chunk.
+        """
+        payload = self._build_payload(messages, model, {**params, "stream": True})
+        headers = self._headers()
+        request_timeout = httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT) if timeout else httpx.USE_CLIENT_DEFAULT
+        last_error: Optional[Exception] = None
+
+        for candidate in self._model_chain(payload["model"]):
+            breaker = self._breaker(candidate)
+            if not breaker.allow_request():
+                continue
+            if candidate != payload["model"]:
+                self.fallback_calls += 1
+            logger.info(f"Streaming from OpenRouter API with model: {candidate}")
+            self.upstream_calls += 1
+            started = False
+            began_at = time.monotonic()
+            async with self._get_semaphore():
+                try:
+                    async with self._get_client().stream(
+                        "POST", self.api_url, json={**payload, "model": candidate}, headers=headers, timeout=request_timeout
+                    ) as resp:
+                        if resp.is_error:
+                            await resp.aread()
+                            resp.raise_for_status()
+                        breaker.record_success()
+                        started = True
+                        async for line in resp.aiter_lines():
+                            # SSE comments (": OPENROUTER PROCESSING") and blank separators carry no data
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            if chunk.get("error"):
+                                raise HTTPException(status_code=502, detail=chunk["error"].get("message", "Upstream stream error"))
+                            if chunk.get("usage") and on_usage is not None:
+                                on_usage(chunk["usage"])
+                            choices = chunk.get("choices") or [{}]
+                            delta = choices[0].get("delta", {}).get("content")
+                            if delta:
+                                yield delta
+                    logger.info("OpenRouter stream completed")
+                    self._notify(candidate, time.monotonic() - began_at, True)
+                    return
+                except (httpx.HTTPError, ValueError) as e:
+                    if _is_retryable(e):
+                        self._notify(candidate, time.monotonic() - began_at, False)
+                    if started or not _is_retryable(e):
+                        raise self._translate_error(e)
+                    breaker.record_failure()
+                    last_error = e
+        raise self._exhausted_error(last_error)
+
+    async def chat(
+        self,
+        messages: List[Any],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **params: Any,
+    ) -> str:
+        """Send a chat completion request and return the assistant message content"""
+        resp_json = await self.complete(messages, model=model, timeout=timeout, **params)
+        return self.extract_content(resp_json)
+
+    @staticmethod
+    def extract_content(resp_json: Dict[str, Any]) -> str:
+        """Pull the assistant message out of a completion response"""
+        choices = resp_json.get("choices", [])
+        if not choices:
+            logger.error("No choices returned from OpenRouter")
+            raise HTTPException(status_code=502, detail="No choices returned from OpenRouter")
+        content = choices[0].get("message", {}).get("content")
+        if not content:
+            logger.error("Empty content from OpenRouter")
+            raise HTTPException(status_code=502, detail="Empty content from OpenRouter")
+        logger.info("OpenRouter API call successful")
+        return content
+
+
+# Global instance
+llm_client = LLMClient()
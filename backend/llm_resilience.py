@@ -0,0 +1,119 @@
+import os
+import time
+from collections import deque
+from typing import Optional
+
+# Circuit breaker configuration
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_REQUESTS = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Retry budget configuration
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+LLM_RETRY_BUDGET_MIN_TOKENS = float(os.getenv("LLM_RETRY_BUDGET_MIN_TOKENS", "3"))
+
+# Hedging needs enough samples for the percentile to mean something
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+
+class CircuitBreaker:
+    """Rolling error-rate circuit breaker: closed -> open on high error rate -> half-open probe after cooldown"""
+
+    def __init__(
+        self,
+        window: int = LLM_BREAKER_WINDOW,
+        min_requests: int = LLM_BREAKER_MIN_REQUESTS,
+        error_rate: float = LLM_BREAKER_ERROR_RATE,
+        cooldown: float = LLM_BREAKER_COOLDOWN,
+    ):
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._outcomes = deque(maxlen=window)
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            # Let exactly one probe through; its outcome decides whether to close again
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def is_open(self) -> bool:
+        """Whether requests are still refused; a breaker past its cooldown admits a probe, so it no longer counts"""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.cooldown
+
+    def record_success(self) -> None:
+        if self.state == "half_open":
+            self.state = "closed"
+            self._outcomes.clear()
+        self._probe_in_flight = False
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        self._outcomes.append(False)
+        if self.state == "half_open":
+            self._open()
+            return
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_requests and failures / len(self._outcomes) >= self.error_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        total = len(self._outcomes)
+        return {
+            "state": self.state,
+            "error_rate": round(self._outcomes.count(False) / total, 4) if total else 0.0,
+            "window_requests": total,
+            "times_opened": self.times_opened,
+        }
+
+
+class RetryBudget:
+    """Token bucket that caps retries to a fraction of recent requests, so retries cannot amplify an outage"""
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET_RATIO, min_tokens: float = LLM_RETRY_BUDGET_MIN_TOKENS):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 10.0)
+        self.tokens = min_tokens
+
+    def record_request(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class LatencyTracker:
+    """Keeps recent request latencies for percentile-based hedging"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(pct * len(ordered)))
+        return ordered[index]
@@ -0,0 +1,167 @@
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from llm_client import DEFAULT_MODEL, llm_client
+
+logger = logging.getLogger(__name__)
+
+# Routing configuration
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.2"))
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+# Share of requests sent to a random healthy model of the tier so stale latencies get refreshed
+LLM_ROUTER_EXPLORE_RATE = float(os.getenv("LLM_ROUTER_EXPLORE_RATE", "0.05"))
+# An unhealthy model gets traffic again once it has not been tried for this long
+LLM_ROUTER_RECOVERY_SECONDS = float(os.getenv("LLM_ROUTER_RECOVERY_SECONDS", "30"))
+LLM_ROUTER_DECISION_LOG_SIZE = int(os.getenv("LLM_ROUTER_DECISION_LOG_SIZE", "100"))
+
+REQUEST_CLASSES = ("chat", "explain", "quiz")
+
+# The request class of the call in progress, so upstream outcomes are attributed to the right route
+current_request_class: ContextVar[str] = ContextVar("llm_request_class", default="default")
+
+
+def parse_route(spec: Optional[str]) -> List[List[str]]:
+    """Parse "a,b;c" into quality tiers [["a", "b"], ["c"]], best tier first"""
+    tiers = []
+    for tier in (spec or "").split(";"):
+        models = [m.strip() for m in tier.split(",") if m.strip()]
+        if models:
+            tiers.append(models)
+    return tiers or [[DEFAULT_MODEL]]
+
+
+def _load_routes() -> Dict[str, List[List[str]]]:
+    return {name: parse_route(os.getenv(f"LLM_ROUTE_{name.upper()}_MODELS")) for name in REQUEST_CLASSES}
+
+
+class ModelStats:
+    """Exponentially weighted latency and error rate for one model serving one request class"""
+
+    def __init__(self, alpha: float = LLM_ROUTER_EWMA_ALPHA):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_seen: Optional[float] = None
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.requests += 1
+        self.last_seen = time.time()
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha * (0.0 if ok else 1.0)
+        if ok:
+            self.latency = seconds if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * seconds
+        else:
+            self.failures += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "ewma_latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "ewma_error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ModelRouter:
+    """Chooses a model per request class: the fastest healthy model of the best tier that has one"""
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, List[List[str]]]] = None,
+        max_error_rate: float = LLM_ROUTER_MAX_ERROR_RATE,
+        explore_rate: float = LLM_ROUTER_EXPLORE_RATE,
+        decision_log_size: int = LLM_ROUTER_DECISION_LOG_SIZE,
+    ):
+        self.routes = routes if routes is not None else _load_routes()
+        self.max_error_rate = max_error_rate
+        self.explore_rate = explore_rate
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._decisions = deque(maxlen=decision_log_size)
+        self._decision_counts: Counter = Counter()
+
+    def _model_stats(self, request_class: str, model: str) -> ModelStats:
+        key = (request_class, model)
+        if key not in self._stats:
+            self._stats[key] = ModelStats()
+        return self._stats[key]
+
+    def is_healthy(self, request_class: str, model: str) -> bool:
+        if llm_client.breaker_open(model):
+            return False
+        model_stats = self._model_stats(request_class, model)
+        if model_stats.error_rate < self.max_error_rate:
+            return True
+        # Error rates only move on new samples, so periodically let a failing model prove itself again
+        return model_stats.last_seen is None or time.time() - model_stats.last_seen >= LLM_ROUTER_RECOVERY_SECONDS
+
+    def _choose(self, request_class: str) -> Tuple[str, int, str]:
+        tiers = self.routes.get(request_class) or [[DEFAULT_MODEL]]
+        for tier_index, tier in enumerate(tiers):
+            healthy = [m for m in tier if self.is_healthy(request_class, m)]
+            if not healthy:
+                continue
+            unsampled = [m for m in healthy if self._model_stats(request_class, m).requests == 0]
+            if unsampled:
+                return unsampled[0], tier_index, "unsampled"
+            if len(healthy) > 1 and random.random() < self.explore_rate:
+                return random.choice(healthy), tier_index, "explore"
+            # Models that have only failed so far have no latency and rank last
+            fastest = min(healthy, key=lambda m: self._model_stats(request_class, m).latency or float("inf"))
+            return fastest, tier_index, "fastest"
+        # Nothing looks healthy: use the least failing model and let the client's fallbacks take over
+        candidates = [(i, m) for i, tier in enumerate(tiers) for m in tier]
+        tier_index, model = min(candidates, key=lambda c: self._model_stats(request_class, c[1]).error_rate)
+        return model, tier_index, "degraded"
+
+    def select(self, request_class: str, requested_model: Optional[str] = None) -> str:
+        """Pick the model for a call and tag the current context with its request class"""
+        current_request_class.set(request_class)
+        if requested_model:
+            model, tier_index, reason = requested_model, None, "requested"
+        else:
+            model, tier_index, reason = self._choose(request_class)
+        latency = self._model_stats(request_class, model).latency
+        self._decision_counts[(request_class, model)] += 1
+        self._decisions.append({
+            "at": time.time(),
+            "request_class": request_class,
+            "model": model,
+            "tier": tier_index,
+            "reason": reason,
+            "ewma_latency_ms": round(latency * 1000, 1) if latency is not None else None,
+        })
+        if reason != "fastest":
+            logger.info(f"Routed {request_class} request to {model} ({reason})")
+        return model
+
+    def observe(self, model: str, seconds: float, ok: bool) -> None:
+        """LLM client observer: fold one upstream attempt into the model's EWMAs"""
+        self._model_stats(current_request_class.get(), model).record(seconds, ok)
+
+    def stats(self) -> dict:
+        classes: Dict[str, dict] = {}
+        for (request_class, model), model_stats in self._stats.items():
+            classes.setdefault(request_class, {})[model] = {
+                **model_stats.to_dict(),
+                "healthy": self.is_healthy(request_class, model),
+                "circuit_breaker": llm_client.breaker_state(model),
+                "routed_requests": self._decision_counts[(request_class, model)],
+            }
+        return {
+            "routes": self.routes,
+            "max_error_rate": self.max_error_rate,
+            "explore_rate": self.explore_rate,
+            "models": classes,
+            "recent_decisions": list(self._decisions)[::-1],
+        }
+
+
+# Global instance
+model_router = ModelRouter()
+llm_client.add_observer(model_router.observe)
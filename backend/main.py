@@ -1,15 +1,14 @@
 import json
 import os
 import logging
-from typing import Any, List, Literal, Optional
+from typing import Any, AsyncIterator, List, Literal, Optional
 from datetime import datetime, timedelta
 
 from fastapi import FastAPI, HTTPException, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import urllib.request
-import urllib.error
 
 # Import our modular components
 from database import init_database, close_database
@@ -20,6 +19,21 @@ from routers import admin as admin_router
 from routers import gamification
 from routers import learning
 from database import get_collection
+from llm_client import llm_client, DEFAULT_MODEL
+from explanation_cache import explanation_cache
+from llm_router import model_router
+from progress_snapshots import progress_snapshots
+from topic_catalog import topic_catalog
+from section_catalog import section_catalog
+from response_cache import response_cache
+from fast_json import FastJSONResponse
+from compression import CompressionMiddleware
+from chat_context import chat_context
+from quiz_jobs import quiz_job_manager
+from stats_counters import stats_counters
+from gamification_events import gamification_event_bus
+from gamification_buffer import gamification_write_buffer
+from token_usage import usage_recorder, llm_user_key, reserve_llm_tokens, record_llm_usage, release_llm_tokens
 
 load_dotenv()
 
@@ -37,10 +51,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-DEFAULT_MODEL = "deepseek/deepseek-chat"
+app = FastAPI(title="Quantitative Chatbot API", default_response_class=FastJSONResponse)
 
-app = FastAPI(title="Quantitative Chatbot API")
+# Upper bound on topics accepted by /progress/update/batch
+PROGRESS_BATCH_MAX_UPDATES = int(os.getenv("PROGRESS_BATCH_MAX_UPDATES", "500"))
 
 # Environment-based CORS configuration
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
@@ -74,6 +88,9 @@ app.add_middleware(
     allow_headers=allow_headers,
 )
 
+# Negotiated brotli/gzip for complete JSON responses above RESPONSE_COMPRESSION_MIN_BYTES
+app.add_middleware(CompressionMiddleware)
+
 # Request logging using FastAPI events
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -112,6 +129,12 @@ async def on_startup() -> None:
         await init_database()
         logger.info("Database initialized successfully")
         
+        await quiz_job_manager.start()
+        await usage_recorder.start()
+        await stats_counters.start()
+        await gamification_write_buffer.start()
+        await gamification_event_bus.start()
+        
         # Seed default admin if not present (dev convenience)
         try:
             users_col = get_collection("users")
@@ -139,6 +162,33 @@ async def on_startup() -> None:
 async def on_shutdown() -> None:
     """Close database connection on shutdown"""
     logger.info("Shutting down application...")
+    try:
+        await quiz_job_manager.stop()
+    except Exception as e:
+        logger.error(f"Error stopping quiz generation workers: {e}")
+    try:
+        await usage_recorder.stop()
+        logger.info("LLM usage flushed")
+    except Exception as e:
+        logger.error(f"Error flushing LLM usage: {e}")
+    try:
+        await stats_counters.stop()
+    except Exception as e:
+        logger.error(f"Error stopping user stats reconciliation: {e}")
+    try:
+        await gamification_event_bus.stop()
+    except Exception as e:
+        logger.error(f"Error stopping gamification event workers: {e}")
+    try:
+        await gamification_write_buffer.stop()
+        logger.info("Gamification deltas flushed")
+    except Exception as e:
+        logger.error(f"Error flushing gamification deltas: {e}")
+    try:
+        await llm_client.close()
+        logger.info("LLM client connections closed")
+    except Exception as e:
+        logger.error(f"Error closing LLM client: {e}")
     try:
         await close_database()
         logger.info("Database connection closed successfully")
@@ -150,54 +200,19 @@ def root() -> dict:
     logger.info("Health check endpoint accessed")
     return {"status": "ok", "environment": ENVIRONMENT, "timestamp": datetime.utcnow().isoformat()}
 
-def call_openrouter(messages: List[ChatMessage], model: Optional[str] = None) -> str:
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        logger.error("Missing OPENROUTER_API_KEY in environment")
-        raise HTTPException(status_code=500, detail="Missing OPENROUTER_API_KEY in environment")
-
-    payload = {
-        "model": model or DEFAULT_MODEL,
-        "messages": [m.model_dump() for m in messages],
-    }
-
-    logger.info(f"Calling OpenRouter API with model: {model or DEFAULT_MODEL}")
-
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(OPENROUTER_API_URL, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Authorization", f"Bearer {api_key}")
-    req.add_header("X-Title", "Quantitative Chatbot")
-
+async def call_openrouter(messages: List[ChatMessage], model: Optional[str] = None, user_key: Optional[str] = None) -> str:
+    """Call the LLM, enforcing and recording token usage when a user key is given"""
+    reserved = reserve_llm_tokens(user_key, messages) if user_key else 0
     try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            resp_data = resp.read()
-            resp_json = json.loads(resp_data.decode("utf-8"))
-            choices = resp_json.get("choices", [])
-            if not choices:
-                logger.error("No choices returned from OpenRouter")
-                raise HTTPException(status_code=502, detail="No choices returned from OpenRouter")
-            content = choices[0].get("message", {}).get("content")
-            if not content:
-                logger.error("Empty content from OpenRouter")
-                raise HTTPException(status_code=502, detail="Empty content from OpenRouter")
-            logger.info("OpenRouter API call successful")
-            return content
-    except urllib.error.HTTPError as e:
-        try:
-            error_body = e.read().decode("utf-8")
-            return_json = json.loads(error_body)
-            detail = return_json.get("error", {}).get("message") or error_body
-        except Exception:
-            detail = str(e)
-        logger.error(f"OpenRouter HTTP error: {e.code} - {detail}")
-        raise HTTPException(status_code=e.code or 500, detail=detail)
-    except urllib.error.URLError as e:
-        logger.error(f"OpenRouter network error: {e.reason}")
-        raise HTTPException(status_code=502, detail=f"Network error contacting OpenRouter: {e.reason}")
-    except Exception as e:
-        logger.error(f"Unexpected error calling OpenRouter: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+        resp_json = await llm_client.complete(messages, model=model)
+    except Exception:
+        if user_key:
+            release_llm_tokens(user_key, reserved)
+        raise
+    if user_key:
+        record_llm_usage(user_key, reserved, resp_json.get("usage"))
+    return llm_client.extract_content(resp_json)
+
 
 @app.post("/auth/register")
 async def register(req: RegisterRequest) -> dict:
@@ -292,8 +307,12 @@ async def logout() -> dict:
     return {"message": "logged out"}
 
 @app.get("/topics")
-def get_topics() -> dict:
+async def get_topics(request: Request) -> Response:
     # Flattened topics for backward compatibility; now superseded by /sections
+    logger.info("Topics endpoint accessed")
+    return await response_cache.respond(request, "topics", _load_topics, cache_control="public, max-age=3600")
+
+async def _load_topics() -> dict:
     section_one = [
         "1. Number System",
         "2. H.C.F. and L.C.M. of Numbers",
@@ -337,34 +356,40 @@ def get_topics() -> dict:
         "38. Pie Chart",
         "39. Line Graphs",
     ]
-    logger.info("Topics endpoint accessed")
     return {"topics": section_one + section_two}
 
 @app.get("/sections")
-async def get_sections() -> dict:
+async def get_sections(request: Request) -> Response:
+    """Sections as cached, pre-serialized bytes with an ETag so unchanged catalogs return 304"""
+    try:
+        return await response_cache.respond(request, "sections", _load_sections, shared=True)
+    except Exception as e:
+        logger.error(f"Error retrieving sections from database: {e}")
+        return FastJSONResponse({"sections": []})
+
+async def _load_sections() -> dict:
+    # Read straight from Mongo: the response cache already checked the shared "sections" version
     sections_col = get_collection("sections")
-    if sections_col is not None:
-        try:
-            docs = await sections_col.find({}).to_list(length=None)
-            if docs:
-                for d in docs:
-                    d.pop("_id", None)
-                logger.info("Sections retrieved successfully")
-                return {"sections": docs}
-        except Exception as e:
-            logger.error(f"Error retrieving sections from database: {e}")
-            # fall back to static
-            pass
-    # No fallback: return empty
-    logger.warning("Sections endpoint accessed, but no sections found in database. Returning empty.")
-    return {"sections": []}
+    docs = await sections_col.find({}, {"_id": 0}).to_list(length=None) if sections_col is not None else []
+    if docs:
+        logger.info("Sections retrieved successfully")
+    else:
+        # No fallback: return empty
+        logger.warning("Sections endpoint accessed, but no sections found in database. Returning empty.")
+    return {"sections": docs}
+
+async def _all_topics() -> List[str]:
+    """Flattened, deduplicated topic catalog across sections (served from the section catalog cache)"""
+    try:
+        return await section_catalog.topics()
+    except Exception as e:
+        logger.error(f"Error retrieving sections from database: {e}")
+        return []
 
-@app.post("/explain-topic", response_model=ChatResponse)
-async def explain_topic(
-    req: TopicRequest, 
-    authorization: Optional[str] = Header(None, alias="Authorization")
-) -> ChatResponse:
-    logger.info(f"Explain topic request for user: {get_current_user(authorization).get('email') if authorization else 'anonymous'}")
+# Bump whenever the explanation prompt changes so stale cached explanations are not served
+EXPLAIN_PROMPT_VERSION = "v1"
+
+def _explain_topic_messages(topic: str) -> List[ChatMessage]:
     system = ChatMessage(
         role="system",
         content=(
@@ -372,58 +397,179 @@ async def explain_topic(
             "bullet points, a simple example, and a short summary. Keep it under 200 words unless asked."
         ),
     )
-    user = ChatMessage(role="user", content=f"Explain the topic: {req.topic}")
-    content = call_openrouter([system, user], model=req.model)
-    
-    # Mark topic as completed if user is authenticated
+    user = ChatMessage(role="user", content=f"Explain the topic: {topic}")
+    return [system, user]
+
+async def _mark_topic_explained(authorization: Optional[str], topic: str) -> None:
+    """Mark topic as completed if user is authenticated"""
+    if not authorization:
+        return
+    try:
+        claims = get_current_user(authorization)
+        user_id = claims.get("sub")
+        if user_id:
+            await progress_snapshots.set_topic(user_id, topic, True)
+            logger.info(f"Progress updated for user {user_id}: topic {topic} completed")
+    except Exception as e:
+        logger.warning(f"Failed to update progress for topic {topic}: {e}")
+        # Don't fail the main request if progress tracking fails
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def _relay_stream(deltas: AsyncIterator[str], on_complete=None) -> AsyncIterator[str]:
+    """Relay upstream deltas as Server-Sent Events, running on_complete once the stream finishes"""
+    try:
+        async for delta in deltas:
+            yield _sse_event({"content": delta})
+    except HTTPException as e:
+        yield _sse_event({"status_code": e.status_code, "detail": e.detail}, event="error")
+        return
+    finally:
+        # Also on client disconnect, so the upstream stream and its token reservation are settled now
+        await deltas.aclose()
+    if on_complete is not None:
+        await on_complete()
+    yield "data: [DONE]\n\n"
+
+async def _single_delta(content: str) -> AsyncIterator[str]:
+    yield content
+
+async def _metered_stream(messages: List[Any], model: str, user_key: str, reserved: int) -> AsyncIterator[str]:
+    """llm_client.stream charged to user_key; the reservation is settled however the stream ends"""
+    usage_state = {"recorded": False, "received": False}
+
+    def on_usage(usage: dict) -> None:
+        usage_state["recorded"] = True
+        record_llm_usage(user_key, reserved, usage)
+
+    deltas = llm_client.stream(messages, model=model, on_usage=on_usage)
+    try:
+        async for delta in deltas:
+            usage_state["received"] = True
+            yield delta
+    finally:
+        await deltas.aclose()
+        if not usage_state["recorded"]:
+            # No usage report (upstream error, disconnect, or none sent): charge the reservation only if output was received
+            if usage_state["received"]:
+                record_llm_usage(user_key, reserved, None)
+            else:
+                release_llm_tokens(user_key, reserved)
+
+async def _cache_explanation_stream(deltas: AsyncIterator[str], topic: str, model: str) -> AsyncIterator[str]:
+    """Pass deltas through and cache the full explanation once the stream ends cleanly"""
+    parts = []
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            yield delta
+    finally:
+        await deltas.aclose()
+    if parts:
+        await explanation_cache.set(topic, model, EXPLAIN_PROMPT_VERSION, "".join(parts))
+
+def _streaming_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _chat_user_email(authorization: Optional[str]) -> Optional[str]:
+    # If auth header present, log the user; otherwise allow anonymous chat.
     if authorization:
         try:
             claims = get_current_user(authorization)
-            user_id = claims.get("sub")
-            from database import get_collection
-            progress_col = get_collection("progress")
-            if progress_col is not None and user_id:
-                await progress_col.update_one(
-                    {"user_id": user_id, "topic": req.topic},
-                    {
-                        "$set": {
-                            "user_id": user_id,
-                            "topic": req.topic,
-                            "completed": True,
-                            "completed_at": datetime.utcnow().isoformat(),
-                            "updated_at": datetime.utcnow().isoformat()
-                        }
-                    },
-                    upsert=True
-                )
-                logger.info(f"Progress updated for user {user_id}: topic {req.topic} completed")
-        except Exception as e:
-            logger.warning(f"Failed to update progress for topic {req.topic}: {e}")
-            # Don't fail the main request if progress tracking fails
-            pass
-    
+            return claims.get("email")
+        except Exception:
+            # If token invalid, still allow but log as anonymous
+            return None
+    return None
+
+@app.post("/explain-topic", response_model=ChatResponse)
+async def explain_topic(
+    req: TopicRequest, 
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+) -> ChatResponse:
+    logger.info(f"Explain topic request for user: {get_current_user(authorization).get('email') if authorization else 'anonymous'}")
+    # Explanations are cached under the requested model; any model of the route's tier may produce them
+    model = req.model or DEFAULT_MODEL
+    content = await explanation_cache.get(req.topic, model, EXPLAIN_PROMPT_VERSION)
+    if content is None:
+        content = await call_openrouter(
+            _explain_topic_messages(req.topic),
+            model=model_router.select("explain", req.model),
+            user_key=llm_user_key(authorization, request),
+        )
+        await explanation_cache.set(req.topic, model, EXPLAIN_PROMPT_VERSION, content)
+    await _mark_topic_explained(authorization, req.topic)
     logger.info(f"Explain topic request completed for user: {get_current_user(authorization).get('email') if authorization else 'anonymous'}")
     return ChatResponse(content=content)
 
+@app.post("/explain-topic/stream")
+async def explain_topic_stream(
+    req: TopicRequest,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+) -> StreamingResponse:
+    """Stream a topic explanation as Server-Sent Events; progress is recorded once the stream completes"""
+    logger.info(f"Streaming explain topic request for user: {get_current_user(authorization).get('email') if authorization else 'anonymous'}")
+    model = req.model or DEFAULT_MODEL
+    cached = await explanation_cache.get(req.topic, model, EXPLAIN_PROMPT_VERSION)
+    if cached is not None:
+        deltas = _single_delta(cached)
+    else:
+        messages = _explain_topic_messages(req.topic)
+        user_key = llm_user_key(authorization, request)
+        reserved = reserve_llm_tokens(user_key, messages)
+        deltas = _cache_explanation_stream(
+            _metered_stream(messages, model_router.select("explain", req.model), user_key, reserved),
+            req.topic,
+            model,
+        )
+    return _streaming_response(
+        _relay_stream(deltas, on_complete=lambda: _mark_topic_explained(authorization, req.topic))
+    )
+
 @app.post("/chat", response_model=ChatResponse)
-def chat(
+async def chat(
     req: ChatRequest,
+    request: Request,
+    response: Response,
     authorization: Optional[str] = Header(None, alias="Authorization")
 ) -> ChatResponse:
-    # Forward the conversation to OpenRouter. If auth header present, log the user; otherwise allow anonymous chat.
-    user_email = None
-    if authorization:
-        try:
-            claims = get_current_user(authorization)
-            user_email = claims.get("email")
-        except Exception:
-            # If token invalid, still allow but log as anonymous
-            user_email = None
+    # Forward the conversation to OpenRouter.
+    user_email = _chat_user_email(authorization)
     logger.info(f"Chat request for user: {user_email or 'anonymous'}")
-    content = call_openrouter(req.messages, model=req.model)
+    model = model_router.select("chat", req.model)
+    user_key = llm_user_key(authorization, request)
+    messages, tokens_saved = await chat_context.fit(req.messages, model=model, user_key=user_key)
+    response.headers["X-Context-Tokens-Saved"] = str(tokens_saved)
+    content = await call_openrouter(messages, model=model, user_key=user_key)
     logger.info(f"Chat request completed for user: {user_email or 'anonymous'}")
     return ChatResponse(content=content)
 
+@app.post("/chat/stream")
+async def chat_stream(
+    req: ChatRequest,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+) -> StreamingResponse:
+    """Stream the assistant reply as Server-Sent Events"""
+    user_email = _chat_user_email(authorization)
+    logger.info(f"Streaming chat request for user: {user_email or 'anonymous'}")
+    model = model_router.select("chat", req.model)
+    user_key = llm_user_key(authorization, request)
+    messages, tokens_saved = await chat_context.fit(req.messages, model=model, user_key=user_key)
+    reserved = reserve_llm_tokens(user_key, messages)
+    deltas = _metered_stream(messages, model, user_key, reserved)
+    streaming_response = _streaming_response(_relay_stream(deltas))
+    streaming_response.headers["X-Context-Tokens-Saved"] = str(tokens_saved)
+    return streaming_response
+
 @app.get("/progress")
 async def get_user_progress(authorization: Optional[str] = Header(None, alias="Authorization")) -> dict:
     """Get progress for all topics for the current user"""
@@ -432,31 +578,25 @@ async def get_user_progress(authorization: Optional[str] = Header(None, alias="A
     logger.info(f"Get user progress request for user: {claims.get('email')}")
     
     from database import get_collection
-    progress_col = get_collection("progress")
-    if progress_col is None:
+    if get_collection("progress_snapshots") is None:
         logger.error("Database not initialized during get_user_progress")
         raise HTTPException(status_code=500, detail="Database not initialized")
     
-    # Get all topics from sections (DB-backed)
-    sections_resp = await get_sections()
-    all_topics = []
-    for section in sections_resp["sections"]:
-        all_topics.extend(section["topics"])
-    # Deduplicate topics to avoid overcount if duplicates exist across sections
-    all_topics = list(dict.fromkeys(all_topics))
+    all_topics = await _all_topics()
+    topic_ids = await topic_catalog.ids_for(all_topics)
     
-    # Get user's completed topics
-    user_progress = await progress_col.find({"user_id": user_id, "completed": True}).to_list(length=None)
-    completed_topics = [p["topic"] for p in user_progress]
+    # Completion is one bit per topic id in the user's progress bitset (one _id lookup)
+    snapshot = await progress_snapshots.get(user_id)
     
     # Create progress response for each topic
     progress_data = []
     for topic in all_topics:
-        completed = topic in completed_topics
+        topic_id = topic_ids[topic]
+        completed = progress_snapshots.is_completed(snapshot, topic_id)
         progress_data.append({
             "topic": topic,
             "completed": completed,
-            "completed_at": None
+            "completed_at": progress_snapshots.completed_at(snapshot, topic_id) if completed else None
         })
     
     logger.info(f"Get user progress request completed for user: {claims.get('email')}")
@@ -473,46 +613,82 @@ async def update_progress(
     logger.info(f"Update progress request for user: {claims.get('email')}")
     
     from database import get_collection
-    progress_col = get_collection("progress")
-    if progress_col is None:
+    if get_collection("progress_snapshots") is None:
         logger.error("Database not initialized during update_progress")
         raise HTTPException(status_code=500, detail="Database not initialized")
     
     completed_at = datetime.utcnow().isoformat() if req.completed else None
     
-    # Upsert progress record
-    await progress_col.update_one(
-        {"user_id": user_id, "topic": req.topic},
-        {
-            "$set": {
-                "user_id": user_id,
-                "topic": req.topic,
-                "completed": req.completed,
-                "completed_at": completed_at,
-                "updated_at": datetime.utcnow().isoformat()
-            }
-        },
-        upsert=True
-    )
+    # Set or clear the topic's bit in the user's progress bitset
+    changed = await progress_snapshots.set_topic(user_id, req.topic, req.completed, at=completed_at, update_counters=False)
     
-    # Trigger gamification for topic completion
-    if req.completed:
-        from gamification_service import gamification_service
-        gamification_data = {"topic": req.topic}
-        newly_earned_badges = await gamification_service.check_badges(
-            user_id, "topic_completed", gamification_data
+    # The topics_completed counter, points and badges are applied in the background; clients follow the event id
+    # Re-marking a completed topic changes nothing, so it earns no points either
+    counters = {"topics_completed": 1 if req.completed else -1} if changed else None
+    event_id = None
+    if req.completed and changed:
+        event_id = await gamification_event_bus.publish(
+            user_id, "topic_completed", {"topic": req.topic},
+            points=10, reason=f"Topic completed: {req.topic}", counters=counters
         )
-        # Add points for topic completion
-        points_result = await gamification_service.add_points(
-            user_id, 10, f"Topic completed: {req.topic}"
+    elif changed:
+        event_id = await gamification_event_bus.publish(
+            user_id, "topic_uncompleted", {"topic": req.topic}, counters=counters
         )
-        logger.info(f"Gamification triggered for topic completion: {req.topic}")
     
     logger.info(f"Update progress request completed for user: {claims.get('email')}")
     return ProgressResponse(
         topic=req.topic,
         completed=req.completed,
-        completed_at=completed_at
+        completed_at=completed_at,
+        event_id=event_id
+    )
+
+@app.post("/progress/update/batch")
+async def update_progress_batch(
+    req: ProgressBatchRequest,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+) -> ProgressBatchResponse:
+    """Update progress for many topics at once (imports, offline sync, bulk completion)"""
+    claims = get_current_user(authorization)
+    user_id = claims.get("sub")
+    logger.info(f"Batch progress update request for user: {claims.get('email')} ({len(req.updates)} topics)")
+    
+    if len(req.updates) > PROGRESS_BATCH_MAX_UPDATES:
+        raise HTTPException(status_code=400, detail=f"At most {PROGRESS_BATCH_MAX_UPDATES} updates per batch")
+    
+    from database import get_collection
+    if get_collection("progress_snapshots") is None:
+        logger.error("Database not initialized during update_progress_batch")
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    
+    # A later entry for the same topic wins, as if the updates were sent one by one
+    updates = {u.topic: u.completed for u in req.updates}
+    completed_at = datetime.utcnow().isoformat()
+    
+    # All bit changes for the user go out in at most two writes
+    newly_completed, completion_times = await progress_snapshots.set_topics(user_id, updates, at=completed_at)
+    
+    # One event, so one badge evaluation and one points increment, for the whole batch; only
+    # topics that were not already completed earn points, so re-syncing is idempotent
+    event_id = None
+    points_awarded = 0
+    if newly_completed:
+        points_awarded = 10 * len(newly_completed)
+        event_id = await gamification_event_bus.publish(
+            user_id, "topic_completed", {"topics": newly_completed},
+            points=points_awarded, reason=f"Topics completed: {len(newly_completed)}"
+        )
+    
+    logger.info(f"Batch progress update request completed for user: {claims.get('email')}")
+    return ProgressBatchResponse(
+        updates=[
+            ProgressResponse(topic=topic, completed=completed, completed_at=completion_times.get(topic))
+            for topic, completed in updates.items()
+        ],
+        newly_completed=newly_completed,
+        points_awarded=points_awarded,
+        event_id=event_id
     )
 
 @app.get("/progress/summary")
@@ -523,28 +699,20 @@ async def get_progress_summary(authorization: Optional[str] = Header(None, alias
     logger.info(f"Get progress summary request for user: {claims.get('email')}")
     
     from database import get_collection
-    progress_col = get_collection("progress")
-    if progress_col is None:
+    if get_collection("progress_snapshots") is None:
         logger.error("Database not initialized during get_progress_summary")
         raise HTTPException(status_code=500, detail="Database not initialized")
     
-    # Get all topics from sections (DB-backed)
-    sections_resp = await get_sections()
-    all_topics = []
-    for section in sections_resp["sections"]:
-        all_topics.extend(section["topics"])
-    # Deduplicate topics to avoid overcount if duplicates exist across sections
-    all_topics = list(dict.fromkeys(all_topics))
-    
-    # Get user's completed topics
-    user_progress = await progress_col.find({"user_id": user_id, "completed": True}).to_list(length=None)
-    completed_topics = [p["topic"] for p in user_progress]
+    all_topics = await _all_topics()
+    topic_ids = await topic_catalog.ids_for(all_topics)
+    snapshot = await progress_snapshots.get(user_id)
     
     total_topics = len(all_topics)
-    completed_count = len(completed_topics)
+    completed_count = progress_snapshots.count(snapshot)
     progress_percentage = round((completed_count / total_topics) * 100, 2) if total_topics > 0 else 0
     
-    remaining_topics = [topic for topic in all_topics if topic not in completed_topics]
+    completed_topics = await topic_catalog.topics_for(progress_snapshots.completed_ids(snapshot))
+    remaining_topics = [topic for topic in all_topics if not progress_snapshots.is_completed(snapshot, topic_ids[topic])]
     
     logger.info(f"Get progress summary request completed for user: {claims.get('email')}")
     return UserProgressSummary(
@@ -558,5 +726,3 @@ async def get_progress_summary(authorization: Optional[str] = Header(None, alias
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
-
-
@@ -27,6 +27,17 @@ class ProgressResponse(BaseModel):
     topic: str
     completed: bool
     completed_at: Optional[str] = None
+    # Gamification event applying the completion's points and badges, see /gamification/events
+    event_id: Optional[str] = None
+
+class ProgressBatchRequest(BaseModel):
+    updates: List[ProgressRequest]
+
+class ProgressBatchResponse(BaseModel):
+    updates: List[ProgressResponse]
+    newly_completed: List[str]
+    points_awarded: int
+    event_id: Optional[str] = None
 
 class UserProgress(BaseModel):
     user_id: str
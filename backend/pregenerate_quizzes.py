@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Offline pre-generation of quiz question pools.
+
+Walks every topic in the sections collection (falling back to the default
+sections), tops each topic/difficulty up to the target size with AI-generated
+questions and bulk-upserts them into quiz_questions. Re-running the command
+only generates what is still missing.
+
+Usage:
+    python pregenerate_quizzes.py --per-difficulty 20 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from pymongo import UpdateOne
+
+from database import init_database, close_database, get_collection
+from llm_client import llm_client
+from quiz_service import generate_quiz_questions_ai, is_valid_generated_question
+from response_cache import response_cache
+from routers.admin import _default_sections
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+POOL_EXPLANATION = (
+    "Standard aptitude-exam coverage of this topic: key definitions, formulas, "
+    "shortcut methods and the typical problem patterns asked in placement tests."
+)
+
+
+async def load_sections() -> list:
+    sections_col = get_collection("sections")
+    docs = await sections_col.find({}).to_list(length=None)
+    return docs or _default_sections()
+
+
+async def fill_topic(topic: str, section_id: str, difficulty: str, args, semaphore: asyncio.Semaphore, stats: dict):
+    """Generate and upsert questions until topic/difficulty reaches the target pool size"""
+    questions_col = get_collection("quiz_questions")
+    existing = await questions_col.count_documents({"topic": topic, "difficulty": difficulty})
+    missing = args.per_difficulty - existing
+    if missing <= 0:
+        stats["skipped"] += 1
+        print(f"⏭️  {topic} [{difficulty}]: {existing} questions, already at target")
+        return
+
+    attempts = 0
+    while missing > 0 and attempts < args.max_attempts:
+        attempts += 1
+        batch = min(missing, args.batch_size)
+        if args.dry_run:
+            print(f"📝 {topic} [{difficulty}]: would generate {batch} questions")
+            missing -= batch
+            continue
+
+        async with semaphore:
+            try:
+                stats["upstream_calls"] += 1
+                generated = await generate_quiz_questions_ai(topic, POOL_EXPLANATION, batch, difficulty=difficulty)
+            except Exception as e:
+                stats["failed_calls"] += 1
+                print(f"❌ {topic} [{difficulty}]: {e}")
+                continue
+
+        valid = [q for q in generated if is_valid_generated_question(q)]
+        stats["rejected"] += len(generated) - len(valid)
+        if not valid:
+            continue
+
+        now = datetime.utcnow().isoformat()
+        operations = [
+            UpdateOne(
+                {"topic": topic, "question": q["question"]},
+                {
+                    "$setOnInsert": {
+                        **q,
+                        "_id": str(uuid.uuid4()),
+                        "section": section_id,
+                        "source": "pregenerated",
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            for q in valid
+        ]
+        result = await questions_col.bulk_write(operations, ordered=False)
+        stats["inserted"] += result.upserted_count
+        missing -= result.upserted_count
+        print(f"✅ {topic} [{difficulty}]: +{result.upserted_count} questions ({max(missing, 0)} still missing)")
+
+    if missing > 0 and not args.dry_run:
+        stats["incomplete"] += 1
+
+
+async def pregenerate(args) -> dict:
+    await init_database()
+    stats = {"skipped": 0, "upstream_calls": 0, "failed_calls": 0, "rejected": 0, "inserted": 0, "incomplete": 0}
+    try:
+        sections = await load_sections()
+        semaphore = asyncio.Semaphore(args.concurrency)
+        tasks = []
+        for section in sections:
+            for topic in dict.fromkeys(section.get("topics", [])):
+                if args.topic and topic not in args.topic:
+                    continue
+                for difficulty in args.difficulties:
+                    tasks.append(fill_topic(topic, section.get("id"), difficulty, args, semaphore, stats))
+
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        if stats["inserted"]:
+            # Let running API workers pick up newly covered topics in /quiz/topics
+            await response_cache.invalidate("quiz_topics")
+        stats["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+        stats["questions_per_second"] = (
+            round(stats["inserted"] / stats["elapsed_seconds"], 2) if stats["elapsed_seconds"] else 0.0
+        )
+        return stats
+    finally:
+        await llm_client.close()
+        await close_database()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate quiz question pools for every topic")
+    parser.add_argument("--per-difficulty", type=int, default=10, help="Target questions per topic and difficulty")
+    parser.add_argument("--difficulties", nargs="+", choices=DIFFICULTIES, default=DIFFICULTIES)
+    parser.add_argument("--topic", action="append", help="Only fill this topic (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum parallel OpenRouter calls")
+    parser.add_argument("--batch-size", type=int, default=5, help="Questions requested per OpenRouter call")
+    parser.add_argument("--max-attempts", type=int, default=5, help="Generation attempts per topic/difficulty")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be generated without calling the API")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("🧠 Quiz Pool Pre-generation")
+    print("=" * 50)
+    stats = asyncio.run(pregenerate(args))
+    print("\n" + "=" * 50)
+    print(f"Inserted {stats['inserted']} questions in {stats['elapsed_seconds']}s "
+          f"({stats['questions_per_second']} questions/s)")
+    print(f"Upstream calls: {stats['upstream_calls']} (failed: {stats['failed_calls']}), "
+          f"rejected questions: {stats['rejected']}, topics already full: {stats['skipped']}")
+    if stats["incomplete"]:
+        print(f"⚠️  {stats['incomplete']} topic/difficulty pools are still below target; re-run to resume")
+        sys.exit(1)
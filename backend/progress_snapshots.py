@@ -0,0 +1,250 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from bson.int64 import Int64
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from database import get_collection
+from stats_counters import stats_counters
+from topic_catalog import topic_catalog
+
+logger = logging.getLogger(__name__)
+
+# Completion bits are packed into 63-bit words ("bits.w0", "bits.w1", ...) so every word stays a positive Int64
+WORD_BITS = 63
+
+
+def _word(topic_id: int) -> str:
+    return f"w{topic_id // WORD_BITS}"
+
+
+def _bit(topic_id: int) -> int:
+    return 1 << (topic_id % WORD_BITS)
+
+
+def is_completed(snapshot: dict, topic_id: int) -> bool:
+    return bool(snapshot.get("bits", {}).get(_word(topic_id), 0) & _bit(topic_id))
+
+
+def completed_ids(snapshot: dict) -> Set[int]:
+    ids = set()
+    for word, value in snapshot.get("bits", {}).items():
+        base = int(word[1:]) * WORD_BITS
+        while value:
+            low = value & -value
+            ids.add(base + low.bit_length() - 1)
+            value ^= low
+    return ids
+
+
+def completed_count(snapshot: dict) -> int:
+    return sum(bin(value).count("1") for value in snapshot.get("bits", {}).values())
+
+
+def completed_at(snapshot: dict, topic_id: int) -> Optional[str]:
+    """Completion time from the per-topic side map, keyed by the topic id as a string"""
+    return snapshot.get("completed_at", {}).get(str(topic_id))
+
+
+def build_snapshot(topic_times: Dict[int, Optional[str]]) -> dict:
+    """Bitset fields for a set of completed topic ids and their completion times"""
+    bits: Dict[str, int] = {}
+    for topic_id in topic_times:
+        bits[_word(topic_id)] = bits.get(_word(topic_id), 0) | _bit(topic_id)
+    return {
+        "bits": {word: Int64(value) for word, value in bits.items()},
+        "completed_at": {str(topic_id): at for topic_id, at in topic_times.items() if at},
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+
+
+# Snapshots written before topic completion became a bitset have no "bits" field
+_MIGRATED = {"bits": {"$exists": True}}
+_SUPERSEDED_FIELDS = {"completed_topics": "", "completed_count": "", "total_topics": "", "progress_percentage": ""}
+
+
+class ProgressSnapshotStore:
+    """Per-user topic completion stored as a bitmask over topic_catalog ids, one document per user"""
+
+    # Bitset helpers, exposed here so callers only need the store
+    is_completed = staticmethod(is_completed)
+    completed_at = staticmethod(completed_at)
+    completed_ids = staticmethod(completed_ids)
+    count = staticmethod(completed_count)
+
+    async def set_topic(
+        self, user_id: str, topic: str, completed: bool, at: Optional[str] = None, update_counters: bool = True
+    ) -> bool:
+        """Atomically set or clear one topic's completion bit; returns whether the bit changed.
+
+        With update_counters=False the caller carries the topics_completed change itself (e.g. in a
+        gamification event's counters) instead of this method incrementing it inline.
+        """
+        snapshots_col = get_collection("progress_snapshots")
+        if snapshots_col is None:
+            return False
+        topic_id = await topic_catalog.id_for(topic)
+        field = f"bits.{_word(topic_id)}"
+        now = datetime.utcnow().isoformat()
+        if completed:
+            update = {
+                "$bit": {field: {"or": Int64(_bit(topic_id))}},
+                "$set": {f"completed_at.{topic_id}": at or now, "updated_at": now},
+            }
+        else:
+            update = {
+                "$bit": {field: {"and": Int64(~_bit(topic_id) & (2 ** WORD_BITS - 1))}},
+                "$unset": {f"completed_at.{topic_id}": ""},
+                "$set": {"updated_at": now},
+            }
+        # The pre-image of the touched word tells whether this write changed the bit
+        before = await snapshots_col.find_one_and_update({"_id": user_id, **_MIGRATED}, update, projection={field: 1})
+        if before is None:
+            # First write for this user: carry over legacy user_progress rows before applying the change
+            await self.rebuild(user_id)
+            before = await snapshots_col.find_one_and_update({"_id": user_id}, update, projection={field: 1})
+        changed = is_completed(before or {}, topic_id) != completed
+        if changed and update_counters:
+            await stats_counters.increment(user_id, topics_completed=1 if completed else -1)
+        return changed
+
+    async def set_topics(
+        self, user_id: str, updates: Dict[str, bool], at: Optional[str] = None
+    ) -> Tuple[List[str], Dict[str, str]]:
+        """Apply many completion changes with at most two writes.
+
+        Returns the topics that were not completed before, and the stored completion time of every
+        topic marked completed. Both come from the pre-images of the writes themselves, so a
+        concurrent update between reading and writing cannot make them wrong.
+        """
+        snapshots_col = get_collection("progress_snapshots")
+        if snapshots_col is None or not updates:
+            return [], {}
+        ids = await topic_catalog.ids_for(updates)
+        now = datetime.utcnow().isoformat()
+        completed_topics = [topic for topic, completed in updates.items() if completed]
+        cleared_topics = [topic for topic, completed in updates.items() if not completed]
+
+        async def write(topics: List[str], operator: str, update: dict, fields: List[str]) -> dict:
+            masks: Dict[str, int] = {}
+            for topic in topics:
+                masks[_word(ids[topic])] = masks.get(_word(ids[topic]), 0) | _bit(ids[topic])
+            update["$bit"] = {
+                f"bits.{word}": {operator: Int64(mask if operator == "or" else ~mask & (2 ** WORD_BITS - 1))}
+                for word, mask in masks.items()
+            }
+            projection = {**{f"bits.{word}": 1 for word in masks}, **{field: 1 for field in fields}}
+            before = await snapshots_col.find_one_and_update({"_id": user_id, **_MIGRATED}, update, projection=projection)
+            if before is None:
+                # First write for this user: carry over legacy user_progress rows before applying the change
+                await self.rebuild(user_id)
+                before = await snapshots_col.find_one_and_update({"_id": user_id}, update, projection=projection)
+            return before or {}
+
+        newly_completed: List[str] = []
+        completion_times: Dict[str, str] = {}
+        if completed_topics:
+            at = at or now
+            before = await write(completed_topics, "or", {
+                # $min keeps the original completion time of topics that were already completed
+                "$min": {f"completed_at.{ids[topic]}": at for topic in completed_topics},
+                "$set": {"updated_at": now},
+            }, [f"completed_at.{ids[topic]}" for topic in completed_topics])
+            for topic in completed_topics:
+                if is_completed(before, ids[topic]):
+                    completion_times[topic] = completed_at(before, ids[topic]) or at
+                else:
+                    newly_completed.append(topic)
+                    completion_times[topic] = at
+        newly_cleared = 0
+        if cleared_topics:
+            before = await write(cleared_topics, "and", {
+                "$unset": {f"completed_at.{ids[topic]}": "" for topic in cleared_topics},
+                "$set": {"updated_at": now},
+            }, [])
+            newly_cleared = sum(1 for topic in cleared_topics if is_completed(before, ids[topic]))
+        await stats_counters.increment(user_id, topics_completed=len(newly_completed) - newly_cleared)
+        return newly_completed, completion_times
+
+    async def rebuild(self, user_id: str) -> dict:
+        """Build a user's bitset from legacy per-topic user_progress documents, unless one already exists"""
+        progress_col = get_collection("progress")
+        snapshots_col = get_collection("progress_snapshots")
+        docs = []
+        if progress_col is not None:
+            docs = await progress_col.find(
+                {"user_id": user_id, "completed": True}, {"topic": 1, "completed_at": 1}
+            ).to_list(length=None)
+        ids = await topic_catalog.ids_for(d["topic"] for d in docs)
+        snapshot = build_snapshot({ids[d["topic"]]: d.get("completed_at") for d in docs})
+        if snapshots_col is not None:
+            try:
+                await snapshots_col.update_one(
+                    {"_id": user_id, "bits": {"$exists": False}},
+                    {"$set": snapshot, "$unset": _SUPERSEDED_FIELDS},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # Another request migrated this user first
+                return await snapshots_col.find_one({"_id": user_id})
+        return {"_id": user_id, **snapshot}
+
+    async def get(self, user_id: str) -> dict:
+        """Read a user's bitset, migrating it from user_progress on first access"""
+        snapshots_col = get_collection("progress_snapshots")
+        snapshot = await snapshots_col.find_one({"_id": user_id}) if snapshots_col is not None else None
+        if snapshot is None or "bits" not in snapshot:
+            snapshot = await self.rebuild(user_id)
+        return snapshot
+
+    async def completed_count(self, user_id: str) -> int:
+        return completed_count(await self.get(user_id))
+
+    async def completed_topics(self, user_id: str) -> List[str]:
+        return await topic_catalog.topics_for(completed_ids(await self.get(user_id)))
+
+    async def backfill(self, batch_size: int = 500, user_ids: Optional[Iterable[str]] = None) -> int:
+        """Migrate every user with legacy progress rows that has no bitset yet; returns users written"""
+        progress_col = get_collection("progress")
+        snapshots_col = get_collection("progress_snapshots")
+        match = {"completed": True}
+        if user_ids:
+            match["user_id"] = {"$in": list(user_ids)}
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": "$user_id", "topics": {"$push": {"topic": "$topic", "completed_at": "$completed_at"}}}},
+        ]
+        written = 0
+        operations = []
+
+        async def flush() -> int:
+            try:
+                result = await snapshots_col.bulk_write(operations, ordered=False)
+                return result.upserted_count + result.modified_count
+            except BulkWriteError as e:
+                # Duplicate keys only mean those users were migrated concurrently by live traffic
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+                return e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+
+        async for group in progress_col.aggregate(pipeline):
+            ids = await topic_catalog.ids_for(t["topic"] for t in group["topics"])
+            snapshot = build_snapshot({ids[t["topic"]]: t.get("completed_at") for t in group["topics"]})
+            operations.append(UpdateOne(
+                {"_id": group["_id"], "bits": {"$exists": False}},
+                {"$set": snapshot, "$unset": _SUPERSEDED_FIELDS},
+                upsert=True,
+            ))
+            if len(operations) >= batch_size:
+                written += await flush()
+                operations = []
+        if operations:
+            written += await flush()
+        logger.info(f"Migrated progress bitsets for {written} users")
+        return written
+
+
+# Global instance
+progress_snapshots = ProgressSnapshotStore()
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from quiz_service import generate_quiz_questions_ai, store_generated_questions
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration
+QUIZ_JOB_WORKERS = int(os.getenv("QUIZ_JOB_WORKERS", "4"))
+QUIZ_JOB_RETENTION_SECONDS = int(os.getenv("QUIZ_JOB_RETENTION_SECONDS", "3600"))
+QUIZ_JOB_MAX_ITEMS = int(os.getenv("QUIZ_JOB_MAX_ITEMS", "20"))
+
+FINISHED_STATUSES = ("completed", "partial", "failed")
+
+
+class QuizGenerationJob:
+    """A batch of AI quiz generation requests tracked under a single job id"""
+
+    def __init__(self, items: List[dict], user_key: str):
+        self.id = str(uuid.uuid4())
+        # The submitter: charged for every item's tokens and the only caller allowed to read the job
+        self.user_key = user_key
+        self.status = "queued"
+        self.created_at = datetime.utcnow()
+        self.updated_at = self.created_at
+        self.items = [
+            {
+                "topic": item["topic"],
+                "explanation": item["explanation"],
+                "question_count": item.get("question_count", 5),
+                "status": "queued",
+                "questions": [],
+                "error": None,
+            }
+            for item in items
+        ]
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def touch(self) -> None:
+        """Recompute the overall status and wake anyone waiting for an update"""
+        statuses = {item["status"] for item in self.items}
+        if statuses <= {"completed"}:
+            self.status = "completed"
+        elif statuses <= {"failed"}:
+            self.status = "failed"
+        elif statuses <= {"completed", "failed"}:
+            self.status = "partial"
+        elif statuses == {"queued"}:
+            self.status = "queued"
+        else:
+            self.status = "running"
+        self.updated_at = datetime.utcnow()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_update(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self, include_questions: bool = True) -> dict:
+        items = []
+        for item in self.items:
+            entry = {
+                "topic": item["topic"],
+                "question_count": item["question_count"],
+                "status": item["status"],
+                "generated": len(item["questions"]),
+                "error": item["error"],
+            }
+            if include_questions:
+                entry["questions"] = [q.model_dump() for q in item["questions"]]
+            items.append(entry)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "items": items,
+        }
+
+
+class QuizJobManager:
+    """Runs quiz generation jobs on a bounded pool of asyncio workers"""
+
+    def __init__(self, workers: int = QUIZ_JOB_WORKERS, retention_seconds: int = QUIZ_JOB_RETENTION_SECONDS):
+        self.worker_count = workers
+        self.retention_seconds = retention_seconds
+        self.jobs: Dict[str, QuizGenerationJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"Quiz generation workers started: {self.worker_count}")
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        logger.info("Quiz generation workers stopped")
+
+    async def submit(self, items: List[dict], user_key: str) -> QuizGenerationJob:
+        """Queue one work unit per topic and return the job immediately"""
+        await self.start()
+        self._prune()
+        job = QuizGenerationJob(items, user_key)
+        self.jobs[job.id] = job
+        for index in range(len(job.items)):
+            self._queue.put_nowait((job, index))
+        logger.info(f"Quiz generation job {job.id} queued with {len(job.items)} topic(s)")
+        return job
+
+    def get(self, job_id: str, user_key: str) -> Optional[QuizGenerationJob]:
+        """The job, if it exists and was submitted by user_key"""
+        job = self.jobs.get(job_id)
+        if job is None or job.user_key != user_key:
+            return None
+        return job
+
+    def _prune(self) -> None:
+        """Forget finished jobs once they are older than the retention window"""
+        now = datetime.utcnow()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished and (now - job.updated_at).total_seconds() > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job, index = await self._queue.get()
+            try:
+                await self._run_item(job, index)
+            finally:
+                self._queue.task_done()
+
+    async def _run_item(self, job: QuizGenerationJob, index: int) -> None:
+        item = job.items[index]
+        item["status"] = "running"
+        job.touch()
+        try:
+            questions = await generate_quiz_questions_ai(
+                item["topic"], item["explanation"], item["question_count"], user_key=job.user_key
+            )
+            item["questions"] = await store_generated_questions(questions)
+            item["status"] = "completed"
+        except asyncio.CancelledError:
+            item["status"] = "failed"
+            item["error"] = "Job cancelled during shutdown"
+            job.touch()
+            raise
+        except Exception as e:
+            logger.error(f"Quiz generation job {job.id} failed for topic {item['topic']}: {e}")
+            item["status"] = "failed"
+            item["error"] = str(e)
+        job.touch()
+
+
+# Global instance
+quiz_job_manager = QuizJobManager()
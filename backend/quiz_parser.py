@@ -0,0 +1,71 @@
+import json
+import re
+from typing import List, Optional
+
+# Trailing commas before a closing brace/bracket are the most common defect in model-written JSON
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def loads_tolerant(text: str) -> Optional[dict]:
+    """Parse one JSON object, repairing trailing commas; returns None if it cannot be salvaged"""
+    for candidate in (text, _TRAILING_COMMA.sub(r"\1", text)):
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        return value if isinstance(value, dict) else None
+    return None
+
+
+class QuizStreamParser:
+    """Incrementally extracts top-level JSON objects from streamed model output.
+
+    Text outside objects (prose, code fences, the enclosing array, commas) is ignored, so each
+    question is available as soon as its closing brace arrives and one malformed question does
+    not affect the others.
+    """
+
+    def __init__(self):
+        self._chars: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.parsed = 0
+        self.malformed = 0
+
+    def feed(self, text: str) -> List[dict]:
+        """Consume the next chunk of output and return the objects completed by it"""
+        completed = []
+        for ch in text:
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._chars = [ch]
+                continue
+            self._chars.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = loads_tolerant("".join(self._chars))
+                    if obj is None:
+                        self.malformed += 1
+                    else:
+                        self.parsed += 1
+                        completed.append(obj)
+        return completed
+
+
+def parse_quiz_objects(content: str) -> List[dict]:
+    """Extract every salvageable question object from a complete response"""
+    return QuizStreamParser().feed(content)
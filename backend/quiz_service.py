@@ -1,10 +1,23 @@
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
+from fastapi import HTTPException
 from models import QuizQuestion, QuizRequest, QuizResponse
 from database import get_collection
+from llm_client import llm_client
+from llm_router import model_router
+from quiz_parser import QuizStreamParser
+from response_cache import response_cache
+from token_usage import reserve_llm_tokens, record_llm_usage, release_llm_tokens
 import logging
+import os
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Upstream calls allowed per generation request (the first plus replacements for dropped questions)
+QUIZ_GENERATION_MAX_ROUNDS = int(os.getenv("QUIZ_GENERATION_MAX_ROUNDS", "3"))
+# Upper bound on questions requested per topic from the generation endpoints
+QUIZ_GENERATION_MAX_QUESTIONS = int(os.getenv("QUIZ_GENERATION_MAX_QUESTIONS", "20"))
+
 async def get_quiz_questions(req: QuizRequest) -> QuizResponse:
 	"""Get quiz questions for a specific topic from the quiz_questions collection"""
 	logger.info(f"Getting quiz questions for topic: {req.topic}")
@@ -109,4 +122,222 @@ async def get_quiz_statistics(topic: str) -> dict:
 	}
 	
 	logger.info(f"Quiz statistics for {topic}: {stats}")
-	return stats
\ No newline at end of file
+	return stats
+
+def _quiz_prompt(topic: str, explanation: str, question_count: int, difficulty: Optional[str], avoid: List[str]) -> str:
+	if difficulty:
+		difficulty_requirement = f"All questions should be of {difficulty} difficulty"
+	else:
+		difficulty_requirement = "Questions should vary in difficulty (easy, medium, hard)"
+	
+	avoid_requirement = ""
+	if avoid:
+		listed = "\n".join(f"  - {question}" for question in avoid)
+		avoid_requirement = f"\n- Do not repeat any of these existing questions:\n{listed}"
+	
+	return f"""
+Generate {question_count} multiple choice quiz questions based on the following topic and explanation.
+
+Topic: {topic}
+
+Explanation:
+{explanation}
+
+Requirements:
+- Create {question_count} questions that test understanding of the key concepts
+- Each question should have 4 options (A, B, C, D)
+- Only one option should be correct
+- {difficulty_requirement}
+- Include an explanation for the correct answer
+- Focus on practical understanding, not just memorization{avoid_requirement}
+
+Format the response as a JSON array with this structure:
+[
+  {{
+    "question": "Question text here?",
+    "options": ["Option A", "Option B", "Option C", "Option D"],
+    "correct_answer": 0,
+    "explanation": "Explanation of why this is correct",
+    "difficulty": "easy|medium|hard"
+  }}
+]
+
+Only return the JSON array, no other text.
+"""
+
+def format_generated_question(raw: dict, topic: str, difficulty: Optional[str] = None) -> Optional[dict]:
+	"""Convert one parsed AI question to the quiz_questions document shape, or None if it is invalid"""
+	if not all(key in raw for key in ['question', 'options', 'correct_answer']):
+		return None
+	if not isinstance(raw['options'], list):
+		return None
+	
+	formatted_question = {
+		"topic": topic,
+		"question": raw['question'],
+		"options": raw['options'][:4],  # Ensure only 4 options
+		"correctAnswer": raw['correct_answer'],
+		"explanation": raw.get('explanation', ''),
+		"difficulty": difficulty or raw.get('difficulty', 'medium')
+	}
+	checked = _checked_generated_question(formatted_question)
+	if checked is None:
+		return None
+	# Store the coerced index, so a string answer such as "1" never reaches quiz_questions
+	formatted_question["correctAnswer"] = checked.correct_answer
+	return formatted_question
+
+async def _completion_deltas(messages: List[dict], model: str, on_usage) -> AsyncIterator[str]:
+	"""A non-streaming completion as a single delta; complete() coalesces identical calls and applies retries and hedging"""
+	resp_json = await llm_client.complete(messages, model=model, temperature=0.7, max_tokens=2000)
+	if resp_json.get("usage"):
+		on_usage(resp_json["usage"])
+	yield llm_client.extract_content(resp_json)
+
+async def stream_quiz_questions_ai(topic: str, explanation: str, question_count: int = 5, difficulty: Optional[str] = None, user_key: Optional[str] = None, stream: bool = True) -> AsyncIterator[dict]:
+	"""Yield validated AI quiz questions as soon as each one is complete in the model output.
+
+	Malformed or invalid questions are dropped and only the missing count is requested again,
+	for up to QUIZ_GENERATION_MAX_ROUNDS upstream calls. With stream=False each round is one
+	complete() call whose output goes through the same parser.
+	"""
+	produced = 0
+	seen = set()
+	accepted: List[str] = []
+	last_error: Optional[Exception] = None
+	
+	for round_number in range(1, QUIZ_GENERATION_MAX_ROUNDS + 1):
+		missing = question_count - produced
+		if missing <= 0:
+			break
+		if round_number > 1:
+			logger.info(f"Requesting {missing} replacement questions for {topic} (round {round_number})")
+		messages = [{"role": "user", "content": _quiz_prompt(topic, explanation, missing, difficulty, accepted)}]
+		
+		try:
+			reserved = reserve_llm_tokens(user_key, messages) if user_key else 0
+		except HTTPException as e:
+			# Out of quota: keep what we already have rather than failing the whole request
+			last_error = e
+			break
+		usage_state = {"recorded": False, "received": False}
+		
+		def on_usage(usage: dict) -> None:
+			usage_state["recorded"] = True
+			if user_key:
+				record_llm_usage(user_key, reserved, usage)
+		
+		parser = QuizStreamParser()
+		rejected = 0
+		if stream:
+			deltas = llm_client.stream(
+				messages, model=model_router.select("quiz"), on_usage=on_usage, temperature=0.7, max_tokens=2000
+			)
+		else:
+			deltas = _completion_deltas(messages, model_router.select("quiz"), on_usage)
+		try:
+			async for delta in deltas:
+				usage_state["received"] = True
+				for raw in parser.feed(delta):
+					question = format_generated_question(raw, topic, difficulty)
+					key = " ".join(question["question"].lower().split()) if question else None
+					if question is None or key in seen:
+						rejected += 1
+						continue
+					seen.add(key)
+					accepted.append(question["question"])
+					produced += 1
+					yield question
+					if produced >= question_count:
+						break
+				if produced >= question_count:
+					break
+		except Exception as e:
+			last_error = e
+			logger.warning(f"Quiz generation round {round_number} for {topic} failed after {produced} questions: {e}")
+		finally:
+			await deltas.aclose()
+			if user_key and not usage_state["recorded"]:
+				# No usage report (stream stopped early or failed): charge the reservation only if output was received
+				if usage_state["received"]:
+					record_llm_usage(user_key, reserved, None)
+				else:
+					release_llm_tokens(user_key, reserved)
+		
+		if parser.malformed or rejected:
+			logger.warning(f"Dropped {parser.malformed} malformed and {rejected} invalid or duplicate questions for {topic}")
+	
+	if produced == 0 and last_error is not None:
+		raise last_error
+	if produced < question_count:
+		logger.warning(f"Generated {produced} of {question_count} questions for {topic}")
+
+async def generate_quiz_questions_ai(topic: str, explanation: str, question_count: int = 5, difficulty: Optional[str] = None, user_key: Optional[str] = None) -> List[dict]:
+	"""Generate quiz questions using AI based on topic and explanation; token usage is charged to user_key when given.
+
+	Uses non-streaming completions, so identical concurrent requests share one upstream call and
+	transient upstream errors are retried.
+	"""
+	try:
+		return [
+			question
+			async for question in stream_quiz_questions_ai(
+				topic, explanation, question_count, difficulty, user_key, stream=False
+			)
+		]
+	except HTTPException as e:
+		# Quota errors propagate as-is so the caller can return 429
+		if e.status_code == 429:
+			raise
+		raise Exception(f"Failed to generate quiz questions: {e.detail}")
+	except Exception as e:
+		raise Exception(f"Failed to generate quiz questions: {str(e)}")
+
+def _checked_generated_question(question: dict) -> Optional[QuizQuestion]:
+	"""The question as the response model, with its fields coerced (e.g. "1" -> 1), or None if it is invalid"""
+	try:
+		checked = QuizQuestion(
+			id="",
+			topic=question["topic"],
+			question=question["question"],
+			options=question["options"],
+			correct_answer=question["correctAnswer"],
+			explanation=question.get("explanation", ""),
+			difficulty=question.get("difficulty", "medium")
+		)
+	except Exception:
+		return None
+	# The range check runs on the coerced index, never on the raw model output
+	if not checked.question.strip() or len(checked.options) != 4 or not 0 <= checked.correct_answer < 4:
+		return None
+	return checked
+
+def is_valid_generated_question(question: dict) -> bool:
+	"""Check that a formatted AI question has four options, an in-range answer and a known difficulty"""
+	return _checked_generated_question(question) is not None
+
+def generated_to_quiz_question(question: dict) -> QuizQuestion:
+	"""Convert a stored AI question document to the QuizQuestion response model"""
+	return QuizQuestion(
+		id=question["_id"],
+		topic=question["topic"],
+		question=question["question"],
+		options=question["options"],
+		correct_answer=question["correctAnswer"],
+		explanation=question["explanation"],
+		difficulty=question["difficulty"]
+	)
+
+async def store_generated_questions(questions: List[dict]) -> List[QuizQuestion]:
+	"""Bulk insert AI-generated questions into quiz_questions and return them as QuizQuestion objects"""
+	for question in questions:
+		question.setdefault("_id", str(uuid.uuid4()))
+	
+	questions_col = get_collection("quiz_questions")
+	if questions_col is not None and questions:
+		await questions_col.insert_many(questions, ordered=False)
+		await response_cache.invalidate("quiz_topics")
+		logger.info(f"Stored {len(questions)} generated questions")
+	
+	# Convert to QuizQuestion format for response
+	return [generated_to_quiz_question(q) for q in questions]
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Repair drift in the denormalized user_stats counters.
+
+Recomputes topics_completed, quizzes_taken, quizzes_passed and badges_earned
+from the progress bitsets, quiz_results and user_badges, and rewrites only the
+counters that differ. Each repair is a compare-and-set on the values read before
+the counts, so an increment that lands during the run is not overwritten; an
+increment still queued for a write the counts already include can be counted
+twice until the next run.
+Run it once after deploying the counters, then periodically (cron) or enable
+USER_STATS_RECONCILE_INTERVAL_SECONDS in the API.
+
+Usage:
+    python reconcile_user_stats.py
+    python reconcile_user_stats.py --user <user_id>   # repair specific users
+"""
+
+import argparse
+import asyncio
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_database, close_database
+from stats_counters import stats_counters
+
+
+async def reconcile(args) -> dict:
+    await init_database()
+    try:
+        started = time.perf_counter()
+        stats_counters.batch_size = args.batch_size
+        stats = await stats_counters.reconcile(user_ids=args.user)
+        stats["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+        return stats
+    finally:
+        await close_database()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile user_stats counters with their source collections")
+    parser.add_argument("--batch-size", type=int, default=500, help="Repairs written per bulk_write")
+    parser.add_argument("--user", action="append", help="Only reconcile this user id (repeatable)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("🧮 User Stats Reconciliation")
+    print("=" * 50)
+    stats = asyncio.run(reconcile(args))
+    print(f"✅ Repaired {stats['repaired']} of {stats['checked']} stats documents ({stats['elapsed_seconds']}s)")
@@ -0,0 +1,150 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import Request, Response
+
+from catalog_versions import bump_version, read_version
+from compression import ETAG_SUFFIXES, accepted_encodings, encoded_etag
+from fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker serves a versioned entry before re-checking the shared version
+RESPONSE_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("RESPONSE_CACHE_VERSION_CHECK_SECONDS", "2"))
+# Bodies at least this large are also stored gzip-compressed (0 disables pre-compression)
+RESPONSE_CACHE_GZIP_MIN_BYTES = int(os.getenv("RESPONSE_CACHE_GZIP_MIN_BYTES", "1024"))
+
+
+class CachedResponse:
+    """Serialized JSON body (plus optional gzip variant) and the strong ETags of both representations"""
+
+    __slots__ = ("body", "gzipped", "etag", "gzip_etag", "version", "checked_at")
+
+    def __init__(self, body: bytes, gzipped: Optional[bytes], version: Optional[int]):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body = body
+        self.gzipped = gzipped
+        self.etag = f'"{digest}"'
+        # A strong ETag identifies exact bytes, so the compressed representation gets its own
+        self.gzip_etag = encoded_etag(self.etag, "gzip")
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+def _matches(if_none_match: Optional[str], entry: CachedResponse) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    # Any encoding of the entry, including ones the compression middleware applied, is current
+    return entry.etag in tags or any(encoded_etag(entry.etag, encoding) in tags for encoding in ETAG_SUFFIXES)
+
+
+class ResponseCache:
+    """Caches fully serialized responses of rarely changing catalog endpoints.
+
+    Local entries live until forgotten in-process; shared entries are invalidated across workers
+    through the catalog_versions document named after the key, checked at most every
+    check_interval seconds. Conditional requests are answered from the cached ETag without
+    running the loader or re-serializing.
+    """
+
+    def __init__(
+        self,
+        check_interval: float = RESPONSE_CACHE_VERSION_CHECK_SECONDS,
+        gzip_min_bytes: int = RESPONSE_CACHE_GZIP_MIN_BYTES,
+    ):
+        self.check_interval = check_interval
+        self.gzip_min_bytes = gzip_min_bytes
+        self._entries: Dict[str, CachedResponse] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _serialize(self, data: Any, version: Optional[int]) -> CachedResponse:
+        # Same encoding as the app's default FastJSONResponse
+        body = dumps(data)
+        gzipped = None
+        if self.gzip_min_bytes and len(body) >= self.gzip_min_bytes:
+            gzipped = gzip.compress(body, compresslevel=9)
+        return CachedResponse(body, gzipped, version)
+
+    def _fresh(self, entry: Optional[CachedResponse], shared: bool) -> bool:
+        if entry is None:
+            return False
+        return not shared or time.monotonic() - entry.checked_at < self.check_interval
+
+    async def _entry(self, key: str, loader: Callable[[], Awaitable[Any]], shared: bool) -> CachedResponse:
+        entry = self._entries.get(key)
+        if self._fresh(entry, shared):
+            self.hits += 1
+            return entry
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if self._fresh(entry, shared):
+                self.hits += 1
+                return entry
+            version = await read_version(key) if shared else None
+            if entry is not None and entry.version == version:
+                entry.checked_at = time.monotonic()
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = self._serialize(await loader(), version)
+            self._entries[key] = entry
+            logger.info(f"Response cache filled for {key} ({len(entry.body)} bytes)")
+            return entry
+
+    async def respond(
+        self,
+        request: Request,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        shared: bool = False,
+        cache_control: str = "no-cache",
+    ) -> Response:
+        """Serve the cached bytes for key, a 304 when the client's ETag matches, or fill the entry via loader"""
+        entry = await self._entry(key, loader, shared)
+        use_gzip = entry.gzipped is not None and "gzip" in accepted_encodings(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": entry.gzip_etag if use_gzip else entry.etag,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if _matches(request.headers.get("if-none-match"), entry):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=entry.gzipped, media_type="application/json", headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def forget(self, key: str) -> None:
+        """Drop an entry in this worker only"""
+        self._entries.pop(key, None)
+
+    async def invalidate(self, key: str) -> None:
+        """Drop an entry here and bump its shared version so other workers reload it too"""
+        self.forget(key)
+        await bump_version(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": {key: {"bytes": len(e.body), "gzip_bytes": len(e.gzipped) if e.gzipped else None, "etag": e.etag}
+                        for key, e in self._entries.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+# Global instance
+response_cache = ResponseCache()
@@ -1,11 +1,21 @@
 from fastapi import APIRouter, HTTPException, Header, Depends
 from typing import Optional
+from datetime import datetime
 from auth import get_current_user, hash_password
 from database import get_collection
 from models import AdminUserCreate, AdminUserUpdate, SectionDoc
+from explanation_cache import explanation_cache
+from llm_client import llm_client
+from llm_router import model_router
+from fast_json import FastJSONResponse
+from response_cache import response_cache
+from section_catalog import section_catalog
+from token_usage import llm_quota, usage_recorder
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+LLM_USAGE_MAX_LIMIT = 500
+
 def require_admin(authorization: Optional[str] = Header(None, alias="Authorization")) -> dict:
 	claims = get_current_user(authorization)
 	if not claims.get("is_admin"):
@@ -36,8 +46,8 @@ async def list_users(_: dict = Depends(require_admin)):
 		raise HTTPException(status_code=500, detail="Database not initialized")
 	users = await users_col.find({}, {"password_hash": 0}).to_list(length=None)
 	for u in users:
-		u["id"] = str(u.pop("_id"))
-	return {"users": users}
+		u["id"] = u.pop("_id")
+	return FastJSONResponse({"users": users})
 
 @router.post("/users")
 async def create_user(req: AdminUserCreate, _: dict = Depends(require_admin)):
@@ -49,7 +59,7 @@ async def create_user(req: AdminUserCreate, _: dict = Depends(require_admin)):
 		"password_hash": hash_password(req.password),
 		"username": req.username.lower(),
 		"name": (req.name or "").strip() or None,
-		"created_at": __import__("datetime").datetime.utcnow().isoformat(),
+		"created_at": datetime.utcnow().isoformat(),
 		"is_admin": bool(req.is_admin),
 	}
 	res = await users_col.insert_one(user_doc)
@@ -100,6 +110,8 @@ async def create_section(section: SectionDoc, _: dict = Depends(require_admin)):
 	if sections_col is None:
 		raise HTTPException(status_code=500, detail="Database not initialized")
 	await sections_col.insert_one(section.model_dump())
+	await section_catalog.invalidate()
+	response_cache.forget("sections")
 	return {"created": True}
 
 @router.put("/sections/{section_id}")
@@ -108,6 +120,8 @@ async def update_section(section_id: str, section: SectionDoc, _: dict = Depends
 	if sections_col is None:
 		raise HTTPException(status_code=500, detail="Database not initialized")
 	await sections_col.update_one({"id": section_id}, {"$set": section.model_dump()})
+	await section_catalog.invalidate()
+	response_cache.forget("sections")
 	return {"updated": True}
 
 @router.delete("/sections/{section_id}")
@@ -116,6 +130,8 @@ async def delete_section(section_id: str, _: dict = Depends(require_admin)):
 	if sections_col is None:
 		raise HTTPException(status_code=500, detail="Database not initialized")
 	await sections_col.delete_one({"id": section_id})
+	await section_catalog.invalidate()
+	response_cache.forget("sections")
 	return {"deleted": True}
 
 # Quiz Questions CRUD
@@ -168,11 +184,12 @@ async def create_quiz_question(question_data: dict, _: dict = Depends(require_ad
 			"difficulty": question_data.get("difficulty", "medium"),
 			"topic": question_data["topic"],
 			"section": question_data["section"],
-			"created_at": __import__("datetime").datetime.utcnow().isoformat(),
-			"updated_at": __import__("datetime").datetime.utcnow().isoformat()
+			"created_at": datetime.utcnow().isoformat(),
+			"updated_at": datetime.utcnow().isoformat()
 		}
 		
 		res = await questions_col.insert_one(question_doc)
+		await response_cache.invalidate("quiz_topics")
 		return {"id": str(res.inserted_id)}
 	except HTTPException:
 		raise
@@ -211,13 +228,14 @@ async def update_quiz_question(question_id: str, question_data: dict, _: dict =
 			"difficulty": question_data.get("difficulty", "medium"),
 			"topic": question_data["topic"],
 			"section": question_data["section"],
-			"updated_at": __import__("datetime").datetime.utcnow().isoformat()
+			"updated_at": datetime.utcnow().isoformat()
 		}
 		
 		result = await questions_col.update_one({"_id": ObjectId(question_id)}, {"$set": updates})
 		if result.matched_count == 0:
 			raise HTTPException(status_code=404, detail="Question not found")
 		
+		await response_cache.invalidate("quiz_topics")
 		return {"updated": True}
 	except HTTPException:
 		raise
@@ -234,6 +252,7 @@ async def delete_quiz_question(question_id: str, _: dict = Depends(require_admin
 		if result.deleted_count == 0:
 			raise HTTPException(status_code=404, detail="Question not found")
 		
+		await response_cache.invalidate("quiz_topics")
 		return {"deleted": True}
 	except HTTPException:
 		raise
@@ -335,9 +354,50 @@ async def seed_default_sections(_: dict = Depends(require_admin)):
 		raise HTTPException(status_code=500, detail="Database not initialized")
 	await sections_col.delete_many({})
 	await sections_col.insert_many(_default_sections())
+	await section_catalog.invalidate()
+	response_cache.forget("sections")
 	docs = await sections_col.find({}).to_list(length=None)
 	for d in docs:
 		d.pop("_id", None)
 	return {"sections": docs}
 
+# Explanation cache management
+@router.get("/explanations/cache")
+async def get_explanation_cache_stats(_: dict = Depends(require_admin)):
+	return explanation_cache.stats()
+
+@router.delete("/explanations/cache")
+async def invalidate_explanation_cache(topic: Optional[str] = None, _: dict = Depends(require_admin)):
+	try:
+		removed = await explanation_cache.invalidate(topic)
+		return {"invalidated": True, "removed": removed}
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=f"Failed to invalidate explanation cache: {str(e)}")
+
+# LLM client metrics
+@router.get("/llm/stats")
+async def get_llm_stats(_: dict = Depends(require_admin)):
+	return {**llm_client.stats(), "quota_rejections": llm_quota.rejections}
+
+@router.get("/llm/routing")
+async def get_llm_routing(_: dict = Depends(require_admin)):
+	"""Configured routes, per-model EWMA latency/error rate and the most recent routing decisions"""
+	return model_router.stats()
 
+@router.get("/llm/usage")
+async def get_llm_usage(day: Optional[str] = None, limit: int = 50, _: dict = Depends(require_admin)):
+	usage_col = get_collection("llm_usage")
+	if usage_col is None:
+		raise HTTPException(status_code=500, detail="Database not initialized")
+	# Make sure recently buffered usage is visible
+	await usage_recorder.flush()
+	day = day or datetime.utcnow().date().isoformat()
+	pipeline = [
+		{"$match": {"day": day}},
+		{"$addFields": {"total_tokens": {"$add": ["$prompt_tokens", "$completion_tokens"]}}},
+		{"$sort": {"total_tokens": -1}},
+		{"$limit": max(1, min(limit, LLM_USAGE_MAX_LIMIT))},
+		{"$project": {"_id": 0}}
+	]
+	usage = await usage_col.aggregate(pipeline).to_list(length=None)
+	return {"day": day, "usage": usage}
@@ -1,29 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Any, Dict
 from datetime import datetime
-from bson import ObjectId
 from auth import get_current_user
 from gamification_service import gamification_service
+from response_cache import response_cache
+from gamification_buffer import gamification_write_buffer
+from gamification_events import gamification_event_bus, action_points, event_to_dict, FINISHED_STATUSES
+from fast_json import FastJSONResponse
 from models import *
+import json
+import time
 
 router = APIRouter(prefix="/gamification", tags=["gamification"])
 
-def serialize_mongo_document(doc: Any) -> Any:
-    """Recursively serialize MongoDB documents, converting ObjectId to string"""
-    if isinstance(doc, dict):
-        serialized = {}
-        for key, value in doc.items():
-            if key == "_id" and isinstance(value, ObjectId):
-                serialized[key] = str(value)
-            else:
-                serialized[key] = serialize_mongo_document(value)
-        return serialized
-    elif isinstance(doc, list):
-        return [serialize_mongo_document(item) for item in doc]
-    elif isinstance(doc, ObjectId):
-        return str(doc)
-    else:
-        return doc
+LEADERBOARD_MAX_PAGE_SIZE = 100
+EVENTS_MAX_PAGE_SIZE = 100
+EVENTS_MAX_WAIT_SECONDS = 30
 
 async def get_current_user_id(authorization: Optional[str] = Header(None, alias="Authorization")):
     """Get current user ID from JWT token"""
@@ -40,7 +33,7 @@ async def get_user_gamification_stats(user_id: str = Depends(get_current_user_id
     try:
         gamification_data = await gamification_service.get_user_gamification_data(user_id)
         if gamification_data:
-            return gamification_data
+            return FastJSONResponse(gamification_data)
         else:
             raise HTTPException(status_code=500, detail="Failed to get gamification data")
     except Exception as e:
@@ -52,7 +45,7 @@ async def get_user_badges(user_id: str = Depends(get_current_user_id)):
     try:
         gamification_data = await gamification_service.get_user_gamification_data(user_id)
         if gamification_data:
-            return {"badges": gamification_data.badges}
+            return FastJSONResponse({"badges": gamification_data.badges})
         else:
             return {"badges": []}
     except Exception as e:
@@ -64,7 +57,7 @@ async def get_badge_progress(user_id: str = Depends(get_current_user_id)):
     try:
         gamification_data = await gamification_service.get_user_gamification_data(user_id)
         if gamification_data:
-            return {"progress": gamification_data.badge_progress}
+            return FastJSONResponse({"progress": gamification_data.badge_progress})
         else:
             return {"progress": []}
     except Exception as e:
@@ -76,53 +69,65 @@ async def record_user_action(
     data: dict,
     user_id: str = Depends(get_current_user_id)
 ):
-    """Record a user action and trigger gamification checks"""
+    """Record a user action; streak, points and badge checks are applied in the background"""
     try:
-        # Update study streak
-        await gamification_service.update_study_streak(user_id)
-        
-        # Add points based on action
-        points_to_add = 0
-        reason = ""
-        
-        if action == "topic_completed":
-            points_to_add = 10
-            reason = "Topic completed"
-        elif action == "quiz_completed":
-            score = data.get("score", 0)
-            total = data.get("total_questions", 1)
-            percentage = (score / total) * 100
-            
-            if percentage >= 90:
-                points_to_add = 25
-                reason = "Excellent quiz performance"
-            elif percentage >= 70:
-                points_to_add = 15
-                reason = "Good quiz performance"
-            else:
-                points_to_add = 5
-                reason = "Quiz completed"
-        elif action == "chat_message":
-            points_to_add = 1
-            reason = "Engaged with AI tutor"
-        
-        # Add points if any
-        points_result = None
-        if points_to_add > 0:
-            points_result = await gamification_service.add_points(user_id, points_to_add, reason)
-        
-        # Check for badges
-        newly_earned_badges = await gamification_service.check_badges(user_id, action, data)
+        points_to_add, reason = action_points(action, data)
+        event_id = await gamification_event_bus.publish(
+            user_id, action, data, points=points_to_add, reason=reason, update_streak=True
+        )
         
         return {
             "points_gained": points_to_add,
-            "points_result": points_result,
-            "newly_earned_badges": newly_earned_badges,
+            "event_id": event_id,
             "message": "Action recorded successfully"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to record action: {str(e)}")
 
+@router.get("/events")
+async def get_gamification_events(
+    since: Optional[str] = None,
+    limit: int = 50,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Poll for processed gamification events; pass the last processed_at seen as since"""
+    events = await gamification_event_bus.processed_since(user_id, since, max(1, min(limit, EVENTS_MAX_PAGE_SIZE)))
+    return FastJSONResponse({"events": [event_to_dict(event) for event in events]})
+
+@router.get("/events/stream")
+async def stream_gamification_events(
+    since: Optional[str] = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Push processed gamification events as Server-Sent Events"""
+    async def events():
+        cursor = since or datetime.utcnow().isoformat()
+        while True:
+            for event in await gamification_event_bus.processed_since(user_id, cursor, EVENTS_MAX_PAGE_SIZE):
+                cursor = event["processed_at"]
+                yield f"data: {json.dumps(event_to_dict(event))}\n\n"
+            # Events finished by another worker process show up on the next timeout
+            await gamification_event_bus.wait_for_user(user_id, timeout=15)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/events/{event_id}")
+async def get_gamification_event(
+    event_id: str,
+    wait: float = 0,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Status and result of one event; wait (seconds) long-polls until it is processed"""
+    deadline = time.monotonic() + max(0.0, min(wait, EVENTS_MAX_WAIT_SECONDS))
+    while True:
+        event = await gamification_event_bus.get(user_id, event_id)
+        if event is None:
+            raise HTTPException(status_code=404, detail="Event not found")
+        remaining = deadline - time.monotonic()
+        if event["status"] in FINISHED_STATUSES or remaining <= 0:
+            return FastJSONResponse(event_to_dict(event))
+        await gamification_event_bus.wait_for_user(user_id, timeout=min(remaining, 1.0))
+
 @router.post("/initialize")
 async def initialize_user_gamification(user_id: str = Depends(get_current_user_id)):
     """Initialize gamification data for a user"""
@@ -151,19 +156,20 @@ async def seed_default_badges(current_user: dict = Depends(get_current_user_full
         raise HTTPException(status_code=500, detail=f"Failed to seed badges: {str(e)}")
 
 @router.get("/admin/badges")
-async def get_all_badges(current_user: dict = Depends(get_current_user_full)):
+async def get_all_badges(request: Request, current_user: dict = Depends(get_current_user_full)):
     """Get all badges (admin only)"""
     try:
         # Check if user is admin
         if not current_user.get("is_admin", False):
             raise HTTPException(status_code=403, detail="Admin access required")
         
-        badges = await gamification_service.badges_col.find({}).to_list(length=None)
+        async def load():
+            badges = await gamification_service.badges_col.find({}).to_list(length=None)
+            return {"badges": badges}
         
-        # Serialize MongoDB documents
-        serialized_badges = serialize_mongo_document(badges)
-        
-        return {"badges": serialized_badges}
+        return await response_cache.respond(request, "badges", load, shared=True, cache_control="private, no-cache")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_all_badges: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get badges: {str(e)}")
@@ -178,28 +184,45 @@ async def get_user_stats_admin(user_id: str, current_user: dict = Depends(get_cu
         
         gamification_data = await gamification_service.get_user_gamification_data(user_id)
         if gamification_data:
-            # Convert to dict and handle ObjectId serialization
-            return gamification_data.dict()
+            return FastJSONResponse(gamification_data)
         else:
             raise HTTPException(status_code=404, detail="User not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get user stats: {str(e)}")
 
+@router.get("/admin/write-buffer")
+async def get_write_buffer_stats(current_user: dict = Depends(get_current_user_full)):
+    """Flush latency, batch size and staleness metrics of the write-behind buffer (admin only)"""
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return gamification_write_buffer.stats()
+
 @router.get("/admin/leaderboard")
-async def get_leaderboard(limit: int = 10, current_user: dict = Depends(get_current_user_full)):
-    """Get leaderboard of top users (admin only)"""
+async def get_leaderboard(
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user_full)
+):
+    """Get leaderboard of top users, one page at a time (admin only)"""
     try:
         # Check if user is admin
         if not current_user.get("is_admin", False):
             raise HTTPException(status_code=403, detail="Admin access required")
         
-        # Use the service method instead of direct collection access
-        leaderboard = await gamification_service.get_leaderboard(limit)
-        
-        # Serialize MongoDB documents
-        serialized_leaderboard = serialize_mongo_document(leaderboard)
-        
-        return {"leaderboard": serialized_leaderboard}
+        page = await gamification_service.get_leaderboard_page(max(1, min(limit, LEADERBOARD_MAX_PAGE_SIZE)), cursor)
+        return FastJSONResponse(page)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error in get_leaderboard: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get leaderboard: {str(e)}")
+
+@router.get("/leaderboard/me")
+async def get_my_rank(user_id: str = Depends(get_current_user_id)):
+    """Get the current user's leaderboard position"""
+    try:
+        return await gamification_service.get_user_rank(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get rank: {str(e)}")
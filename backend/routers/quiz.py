@@ -1,129 +1,34 @@
-from fastapi import APIRouter, HTTPException, Header, Depends
+from fastapi import APIRouter, HTTPException, Header, Depends, Request
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from models import QuizRequest, QuizResponse, QuizSubmission, QuizResult
-from quiz_service import get_quiz_questions, get_available_quiz_topics, get_quiz_statistics
+from quiz_service import (
+    get_quiz_questions, get_available_quiz_topics, get_quiz_statistics,
+    generate_quiz_questions_ai, store_generated_questions,
+    stream_quiz_questions_ai, generated_to_quiz_question, QUIZ_GENERATION_MAX_QUESTIONS
+)
 from auth import get_current_user
 from database import get_collection
 from datetime import datetime
+from quiz_jobs import quiz_job_manager, QUIZ_JOB_MAX_ITEMS
+from token_usage import llm_user_key
+from response_cache import response_cache
+from fast_json import FastJSONResponse
+from stats_counters import QUIZ_PASS_SCORE
+from gamification_events import gamification_event_bus
 import uuid
 import json
-import urllib.request
-import urllib.error
-import os
 
 router = APIRouter(prefix="/quiz", tags=["quiz"])
 
-# AI Quiz Generation
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-DEFAULT_MODEL = "deepseek/deepseek-chat"
-
 class GenerateQuizRequest(BaseModel):
     topic: str
     explanation: str
-    question_count: int = 5
-
-async def generate_quiz_questions_ai(topic: str, explanation: str, question_count: int = 5) -> List[dict]:
-    """Generate quiz questions using AI based on topic and explanation"""
-    try:
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
-            raise Exception("OpenRouter API key not configured")
-        
-        prompt = f"""
-Generate {question_count} multiple choice quiz questions based on the following topic and explanation.
-
-Topic: {topic}
-
-Explanation:
-{explanation}
-
-Requirements:
-- Create {question_count} questions that test understanding of the key concepts
-- Each question should have 4 options (A, B, C, D)
-- Only one option should be correct
-- Questions should vary in difficulty (easy, medium, hard)
-- Include an explanation for the correct answer
-- Focus on practical understanding, not just memorization
-
-Format the response as a JSON array with this structure:
-[
-  {{
-    "question": "Question text here?",
-    "options": ["Option A", "Option B", "Option C", "Option D"],
-    "correct_answer": 0,
-    "explanation": "Explanation of why this is correct",
-    "difficulty": "easy|medium|hard"
-  }}
-]
-
-Only return the JSON array, no other text.
-"""
+    question_count: int = Field(5, ge=1, le=QUIZ_GENERATION_MAX_QUESTIONS)
 
-        data = {
-            "model": DEFAULT_MODEL,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "max_tokens": 2000
-        }
-
-        req = urllib.request.Request(
-            OPENROUTER_API_URL,
-            data=json.dumps(data).encode('utf-8'),
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {api_key}',
-                'HTTP-Referer': 'https://quantitative-chatbot.com',
-                'X-Title': 'Quantitative Chatbot'
-            }
-        )
-
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            
-        if 'choices' not in result or not result['choices']:
-            raise Exception("Invalid response from AI service")
-            
-        content = result['choices'][0]['message']['content']
-        
-        # Try to extract JSON from the response
-        try:
-            # Find JSON array in the response
-            start = content.find('[')
-            end = content.rfind(']') + 1
-            if start != -1 and end != 0:
-                json_str = content[start:end]
-                questions = json.loads(json_str)
-            else:
-                raise Exception("No JSON array found in response")
-        except json.JSONDecodeError:
-            raise Exception("Failed to parse AI response as JSON")
-        
-        # Validate and format questions
-        formatted_questions = []
-        for i, q in enumerate(questions):
-            if not all(key in q for key in ['question', 'options', 'correct_answer']):
-                continue
-                
-            formatted_question = {
-                "topic": topic,
-                "question": q['question'],
-                "options": q['options'][:4],  # Ensure only 4 options
-                "correctAnswer": q['correct_answer'],
-                "explanation": q.get('explanation', ''),
-                "difficulty": q.get('difficulty', 'medium')
-            }
-            formatted_questions.append(formatted_question)
-        
-        return formatted_questions
-        
-    except Exception as e:
-        raise Exception(f"Failed to generate quiz questions: {str(e)}")
+class GenerateQuizJobRequest(BaseModel):
+    items: List[GenerateQuizRequest] = Field(..., max_length=QUIZ_JOB_MAX_ITEMS)
 
 async def get_current_user_id(authorization: Optional[str] = Header(None, alias="Authorization")):
     """Get current user ID from JWT token"""
@@ -131,11 +36,13 @@ async def get_current_user_id(authorization: Optional[str] = Header(None, alias=
     return claims.get("sub")
 
 @router.get("/topics")
-async def get_quiz_topics():
-    """Get list of topics that have quizzes available"""
+async def get_quiz_topics(request: Request):
+    """Get list of topics that have quizzes available (cached until questions change)"""
+    async def load():
+        return {"topics": await get_available_quiz_topics()}
+
     try:
-        topics = await get_available_quiz_topics()
-        return {"topics": topics}
+        return await response_cache.respond(request, "quiz_topics", load, shared=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -157,32 +64,19 @@ async def get_quiz(req: QuizRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/generate", response_model=QuizResponse)
-async def generate_quiz_ai(req: GenerateQuizRequest):
+async def generate_quiz_ai(
+    req: GenerateQuizRequest,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+):
     """Generate quiz questions using AI based on topic and explanation"""
     try:
-        questions = await generate_quiz_questions_ai(req.topic, req.explanation, req.question_count)
+        questions = await generate_quiz_questions_ai(
+            req.topic, req.explanation, req.question_count, user_key=llm_user_key(authorization, request)
+        )
         
         # Store the generated questions in the database
-        questions_col = get_collection("quiz_questions")
-        if questions_col is not None:
-            for question in questions:
-                question["_id"] = str(uuid.uuid4())
-                await questions_col.insert_one(question)
-        
-        # Convert to QuizQuestion format for response
-        from models import QuizQuestion
-        quiz_questions = []
-        for q in questions:
-            question_data = {
-                "id": q["_id"],
-                "topic": q["topic"],
-                "question": q["question"],
-                "options": q["options"],
-                "correct_answer": q["correctAnswer"],
-                "explanation": q["explanation"],
-                "difficulty": q["difficulty"]
-            }
-            quiz_questions.append(QuizQuestion(**question_data))
+        quiz_questions = await store_generated_questions(questions)
         
         response = QuizResponse(
             questions=quiz_questions,
@@ -191,9 +85,90 @@ async def generate_quiz_ai(req: GenerateQuizRequest):
         
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/generate/stream")
+async def generate_quiz_ai_stream(
+    req: GenerateQuizRequest,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+):
+    """Stream AI-generated questions as Server-Sent Events, one event per question as soon as it is parsed"""
+    user_key = llm_user_key(authorization, request)
+
+    async def events():
+        questions = []
+        try:
+            async for question in stream_quiz_questions_ai(
+                req.topic, req.explanation, req.question_count, user_key=user_key
+            ):
+                question["_id"] = str(uuid.uuid4())
+                questions.append(question)
+                yield f"data: {json.dumps({'question': generated_to_quiz_question(question).model_dump()})}\n\n"
+        except HTTPException as e:
+            yield f"event: error\ndata: {json.dumps({'status_code': e.status_code, 'detail': e.detail})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'status_code': 500, 'detail': str(e)})}\n\n"
+        # Questions streamed before an error are still kept
+        if questions:
+            await store_generated_questions(questions)
+        yield f"data: {json.dumps({'total_questions': len(questions)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/generate/jobs", status_code=202)
+async def submit_quiz_generation_job(
+    req: GenerateQuizJobRequest,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+):
+    """Queue AI quiz generation for one or more topics and return a job id immediately"""
+    if not req.items:
+        raise HTTPException(status_code=400, detail="At least one topic is required")
+    job = await quiz_job_manager.submit(
+        [item.model_dump() for item in req.items], user_key=llm_user_key(authorization, request)
+    )
+    return job.to_dict(include_questions=False)
+
+@router.get("/generate/jobs/{job_id}")
+async def get_quiz_generation_job(
+    job_id: str,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+):
+    """Get the status of a generation job, including generated questions once available"""
+    job = quiz_job_manager.get(job_id, llm_user_key(authorization, request))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.get("/generate/jobs/{job_id}/events")
+async def stream_quiz_generation_job(
+    job_id: str,
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization")
+):
+    """Stream job status changes as Server-Sent Events until the job finishes"""
+    job = quiz_job_manager.get(job_id, llm_user_key(authorization, request))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        while True:
+            finished = job.finished
+            yield f"data: {json.dumps(job.to_dict(include_questions=finished))}\n\n"
+            if finished:
+                return
+            await job.wait_for_update(timeout=15)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @router.post("/submit")
 async def submit_quiz(
     submission: QuizSubmission,
@@ -223,25 +198,25 @@ async def submit_quiz(
         # Store quiz result
         quiz_results_col = get_collection("quiz_results")
         if quiz_results_col is not None:
-            await quiz_results_col.insert_one(quiz_result.model_dump())
+            await quiz_results_col.insert_one({**quiz_result.model_dump(), "user_id": user_id})
         
-        # Trigger gamification for quiz completion
-        from gamification_service import gamification_service
+        # Counters and badge checks for the quiz run in the background; clients follow the event id
         gamification_data = {
             "score": quiz_result.score,
             "total_questions": quiz_result.total_questions,
             "time_taken": quiz_result.time_taken,
             "quiz_id": submission.quiz_id
         }
-        newly_earned_badges = await gamification_service.check_badges(
-            user_id, "quiz_completed", gamification_data
+        event_id = await gamification_event_bus.publish(
+            user_id, "quiz_completed", gamification_data,
+            counters={"quizzes_taken": 1, "quizzes_passed": int(quiz_result.score >= QUIZ_PASS_SCORE)}
         )
         
         return {
             "message": "Quiz submitted successfully",
             "result": quiz_result,
             "gamification": {
-                "newly_earned_badges": newly_earned_badges
+                "event_id": event_id
             }
         }
         
@@ -260,7 +235,8 @@ async def get_user_quiz_results(user_id: str = Depends(get_current_user_id)):
             return {"results": []}
         
         results = await quiz_results_col.find({"user_id": user_id}).sort("completed_at", -1).to_list(length=None)
-        return {"results": results}
+        # Raw documents go straight to orjson, which stringifies ObjectIds
+        return FastJSONResponse({"results": results})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,50 @@
+import os
+from typing import List
+
+from catalog_versions import VersionedCatalog
+from database import get_collection
+
+# How long a worker trusts its cached catalog before re-checking the shared version (0 checks on every read)
+SECTION_CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("SECTION_CATALOG_VERSION_CHECK_SECONDS", "2"))
+
+
+class SectionCatalog(VersionedCatalog):
+    """In-process cache of the sections collection and their deduplicated topics"""
+
+    version_id = "sections"
+    collection = "sections"
+
+    def __init__(self, check_interval: float = SECTION_CATALOG_VERSION_CHECK_SECONDS):
+        super().__init__(check_interval)
+        self._sections: List[dict] = []
+        self._topics: List[str] = []
+
+    async def _load(self) -> None:
+        sections_col = get_collection("sections")
+        docs = await sections_col.find({}, {"_id": 0}).to_list(length=None)
+        topics = []
+        for section in docs:
+            topics.extend(section.get("topics", []))
+        self._sections = docs
+        # Deduplicate topics so ones listed in several sections count once
+        self._topics = list(dict.fromkeys(topics))
+
+    async def sections(self) -> List[dict]:
+        await self._refresh()
+        return self._sections
+
+    async def topics(self) -> List[str]:
+        await self._refresh()
+        return self._topics
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "sections": len(self._sections),
+            "topics": len(self._topics),
+            "reloads": self.reloads,
+        }
+
+
+# Global instance
+section_catalog = SectionCatalog()
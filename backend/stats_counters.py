@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background reconciliation runs in each API worker (0 disables; run reconcile_user_stats.py instead)
+USER_STATS_RECONCILE_INTERVAL_SECONDS = float(os.getenv("USER_STATS_RECONCILE_INTERVAL_SECONDS", "0"))
+USER_STATS_RECONCILE_BATCH = int(os.getenv("USER_STATS_RECONCILE_BATCH", "500"))
+
+# Minimum quiz score (percent) that counts as passed
+QUIZ_PASS_SCORE = 70
+
+# Denormalized counters kept on user_stats with $inc at their write sites
+COUNTER_FIELDS = ("topics_completed", "quizzes_taken", "quizzes_passed", "badges_earned")
+
+
+def default_user_stats(user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "total_points": 0,
+        "level": 1,
+        "experience": 0,
+        "experience_to_next_level": 100,
+        "badges_earned": 0,
+        "total_badges": 0,
+        "current_streak": 0,
+        "longest_streak": 0,
+        "topics_completed": 0,
+        "quizzes_taken": 0,
+        "quizzes_passed": 0,
+        "last_activity": datetime.utcnow().isoformat()
+    }
+
+
+class StatsCounters:
+    """Atomic maintenance of the per-user counters in user_stats, plus a reconciliation job for drift.
+
+    Increments can drift from the source collections (a crash between the write and the $inc,
+    users that predate the counters), so reconcile() recomputes them from quiz_results,
+    user_badges and the progress bitsets and repairs only the documents that differ.
+
+    Repairs are compare-and-set on the stored values read before the counts, so an increment that
+    lands during a run is never overwritten. An increment still pending for a source write the
+    counts already include (e.g. a queued gamification event) is applied on top of the repair and
+    counted twice until the next run.
+    """
+
+    def __init__(self, interval: float = USER_STATS_RECONCILE_INTERVAL_SECONDS, batch_size: int = USER_STATS_RECONCILE_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def increment(self, user_id: str, **deltas: int) -> None:
+        """Atomically add deltas to counters, creating the stats document if needed"""
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        user_stats_col = get_collection("user_stats")
+        if user_stats_col is None or not deltas:
+            return
+        # $setOnInsert may not touch the fields being incremented
+        defaults = {k: v for k, v in default_user_stats(user_id).items() if k not in deltas}
+        await user_stats_col.update_one(
+            {"user_id": user_id},
+            {"$inc": deltas, "$setOnInsert": defaults},
+            upsert=True,
+        )
+
+    async def _actual_counts(self, user_ids: Optional[Iterable[str]]) -> Dict[str, Dict[str, int]]:
+        """Counters recomputed from the source collections, per user"""
+        match = {"user_id": {"$in": list(user_ids)}} if user_ids else {}
+        counts: Dict[str, Dict[str, int]] = {}
+
+        def entry(user_id: str) -> Dict[str, int]:
+            return counts.setdefault(user_id, {field: 0 for field in COUNTER_FIELDS})
+
+        quiz_results_col = get_collection("quiz_results")
+        async for group in quiz_results_col.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": "$user_id",
+                "taken": {"$sum": 1},
+                "passed": {"$sum": {"$cond": [{"$gte": ["$score", QUIZ_PASS_SCORE]}, 1, 0]}},
+            }},
+        ]):
+            if group["_id"] is not None:
+                entry(group["_id"]).update(quizzes_taken=group["taken"], quizzes_passed=group["passed"])
+
+        user_badges_col = get_collection("user_badges")
+        async for group in user_badges_col.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$user_id", "badges": {"$sum": 1}}},
+        ]):
+            entry(group["_id"])["badges_earned"] = group["badges"]
+
+        # Users not migrated to bitsets yet still count their legacy user_progress rows
+        progress_col = get_collection("progress")
+        if progress_col is not None:
+            async for group in progress_col.aggregate([
+                {"$match": {**match, "completed": True}},
+                {"$group": {"_id": "$user_id", "topics": {"$sum": 1}}},
+            ]):
+                entry(group["_id"])["topics_completed"] = group["topics"]
+
+        # Imported here because progress_snapshots maintains topics_completed through this module
+        from progress_snapshots import progress_snapshots
+        snapshots_col = get_collection("progress_snapshots")
+        snapshot_filter = {"bits": {"$exists": True}}
+        if match:
+            snapshot_filter["_id"] = match["user_id"]
+        async for snapshot in snapshots_col.find(snapshot_filter, {"bits": 1}):
+            entry(snapshot["_id"])["topics_completed"] = progress_snapshots.count(snapshot)
+        return counts
+
+    async def reconcile(self, user_ids: Optional[Iterable[str]] = None) -> dict:
+        """Repair counters that drifted from the source collections; returns run statistics"""
+        user_stats_col = get_collection("user_stats")
+        if user_stats_col is None:
+            return {"checked": 0, "repaired": 0}
+        user_ids = list(user_ids) if user_ids else None
+        stats = {"checked": 0, "repaired": 0}
+        operations = []
+
+        async def flush():
+            if operations:
+                result = await user_stats_col.bulk_write(operations, ordered=False)
+                stats["repaired"] += result.modified_count + result.upserted_count
+                operations.clear()
+
+        async def repair(docs: List[dict]) -> None:
+            # The stored values are read before the counts are taken, so a change landing in between
+            # shows up in the compare-and-set filter instead of being overwritten
+            actual = await self._actual_counts([doc["user_id"] for doc in docs])
+            for doc in docs:
+                expected = actual.get(doc["user_id"]) or {field: 0 for field in COUNTER_FIELDS}
+                stored = {field: doc.get(field) for field in COUNTER_FIELDS}
+                if {field: value or 0 for field, value in stored.items()} != expected:
+                    # A None in the filter also matches a counter that was never written
+                    operations.append(UpdateOne({"user_id": doc["user_id"], **stored}, {"$set": expected}))
+            await flush()
+
+        seen = set()
+        batch: List[dict] = []
+        query = {"user_id": {"$in": user_ids}} if user_ids else {}
+        async for doc in user_stats_col.find(query, {"user_id": 1, **{field: 1 for field in COUNTER_FIELDS}}):
+            stats["checked"] += 1
+            seen.add(doc["user_id"])
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                await repair(batch)
+                batch = []
+        if batch:
+            await repair(batch)
+
+        # Users with activity but no stats document yet; $setOnInsert leaves documents created meanwhile alone
+        for user_id, expected in (await self._actual_counts(user_ids)).items():
+            if user_id in seen:
+                continue
+            defaults = {k: v for k, v in default_user_stats(user_id).items() if k not in expected}
+            operations.append(UpdateOne(
+                {"user_id": user_id}, {"$setOnInsert": {**defaults, **expected}}, upsert=True
+            ))
+            if len(operations) >= self.batch_size:
+                await flush()
+        await flush()
+        logger.info(f"Reconciled user_stats counters: {stats['repaired']} of {stats['checked']} documents repaired")
+        return stats
+
+    async def _reconcile_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"User stats reconciliation failed: {e}")
+
+    async def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._reconcile_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Global instance
+stats_counters = StatsCounters()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Resilience tests for the LLM client against a local fake OpenRouter server
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
+
+import llm_client as llm_client_module
+import llm_router
+from fastapi import HTTPException
+from llm_client import LLMClient
+from llm_router import ModelRouter
+
+llm_client_module.LLM_RETRY_BACKOFF = 0.01
+
+
+class FakeOpenRouter:
+    """Serves chat completions; `plan` maps a model to a queue of behaviours ("ok", "500", "400", "slow:<seconds>", "gzip", "quiz")"""
+
+    def __init__(self):
+        self.plan = {}
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                model = body["model"]
+                fake.requests.append(model)
+                queue = fake.plan.get(model, [])
+                action = queue.pop(0) if len(queue) > 1 else (queue[0] if queue else "ok")
+                if action.startswith("slow:"):
+                    time.sleep(float(action.split(":")[1]))
+                    action = "ok"
+                encoding = None
+                if action == "gzip":
+                    # Compressed regardless of Accept-Encoding, like a misbehaving proxy
+                    encoding = "gzip"
+                    action = "ok"
+                if action == "quiz":
+                    time.sleep(0.1)
+                    payload = {"choices": [{"message": {"content": json.dumps(QUIZ_QUESTIONS)}}]}
+                    status = 200
+                elif action == "ok":
+                    payload = {"choices": [{"message": {"content": f"answer from {model}"}}]}
+                    status = 200
+                else:
+                    payload = {"error": {"message": f"fake failure {action}"}}
+                    status = int(action)
+                data = json.dumps(payload).encode("utf-8")
+                if encoding:
+                    data = gzip.compress(data)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_with_fake(test):
+    fake = FakeOpenRouter()
+    try:
+        asyncio.run(test(fake))
+    finally:
+        fake.close()
+
+
+MESSAGES = [{"role": "user", "content": "What is 2 + 2?"}]
+QUIZ_QUESTIONS = [
+    {"question": f"Question {i}?", "options": ["A", "B", "C", "D"], "correct_answer": 1, "explanation": "", "difficulty": "easy"}
+    for i in range(3)
+]
+
+
+def test_retries_transient_errors():
+    async def scenario(fake):
+        fake.plan["primary"] = ["500", "502", "ok"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], max_retries=2)
+        content = await client.chat(MESSAGES, model="primary")
+        await client.close()
+        assert content == "answer from primary"
+        assert client.retries == 2
+        assert fake.requests == ["primary"] * 3
+    run_with_fake(scenario)
+
+
+def test_does_not_retry_client_errors():
+    async def scenario(fake):
+        fake.plan["primary"] = ["400"]
+        client = LLMClient(api_url=fake.url, fallback_models=["backup"], max_retries=2)
+        try:
+            await client.chat(MESSAGES, model="primary")
+            raise AssertionError("expected HTTPException")
+        except HTTPException as e:
+            assert e.status_code == 400
+        await client.close()
+        assert fake.requests == ["primary"]
+    run_with_fake(scenario)
+
+
+def test_falls_back_to_next_model():
+    async def scenario(fake):
+        fake.plan["primary"] = ["503"]
+        client = LLMClient(api_url=fake.url, fallback_models=["backup"], max_retries=1)
+        content = await client.chat(MESSAGES, model="primary")
+        await client.close()
+        assert content == "answer from backup"
+        assert client.fallback_calls == 1
+    run_with_fake(scenario)
+
+
+def test_circuit_breaker_fails_fast():
+    async def scenario(fake):
+        fake.plan["primary"] = ["500"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], max_retries=0, coalesce=False)
+        for _ in range(5):
+            try:
+                await client.chat(MESSAGES, model="primary")
+            except HTTPException:
+                pass
+        assert client.stats()["circuit_breakers"]["primary"]["state"] == "open"
+        calls_before = len(fake.requests)
+        try:
+            await client.chat(MESSAGES, model="primary")
+            raise AssertionError("expected HTTPException")
+        except HTTPException as e:
+            assert e.status_code == 503
+        await client.close()
+        assert len(fake.requests) == calls_before
+    run_with_fake(scenario)
+
+
+def test_breaker_recovers_after_cooldown():
+    async def scenario(fake):
+        fake.plan["primary"] = ["500", "500", "500", "500", "500", "ok"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], max_retries=0, coalesce=False, breaker_cooldown=0.05)
+        for _ in range(5):
+            try:
+                await client.chat(MESSAGES, model="primary")
+            except HTTPException:
+                pass
+        await asyncio.sleep(0.1)
+        content = await client.chat(MESSAGES, model="primary")
+        await client.close()
+        assert content == "answer from primary"
+        assert client.stats()["circuit_breakers"]["primary"]["state"] == "closed"
+    run_with_fake(scenario)
+
+
+def test_hedges_slow_requests():
+    async def scenario(fake):
+        fake.plan["primary"] = ["slow:2", "ok"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], hedge_percentile=0.95)
+        for _ in range(20):
+            client._latency("primary").record(0.05)
+        started = time.monotonic()
+        content = await client.chat(MESSAGES, model="primary")
+        elapsed = time.monotonic() - started
+        await client.close()
+        assert content == "answer from primary"
+        assert client.hedged_calls == 1
+        assert elapsed < 1.5
+    run_with_fake(scenario)
+
+
+def test_records_and_replays_cassette():
+    cassette = os.path.join(tempfile.mkdtemp(), "cassette.jsonl")
+
+    async def record(fake):
+        client = LLMClient(api_url=fake.url, fallback_models=[], transport_mode="record", cassette_path=cassette)
+        content = await client.chat(MESSAGES, model="primary")
+        await client.close()
+        assert content == "answer from primary"
+    run_with_fake(record)
+
+    async def replay():
+        # The fake server is gone; replay must be served entirely from the cassette
+        client = LLMClient(api_url="http://127.0.0.1:9/api/v1/chat/completions", fallback_models=[],
+                           transport_mode="replay", cassette_path=cassette)
+        content = await client.chat(MESSAGES, model="primary")
+        try:
+            await client.chat([{"role": "user", "content": "never recorded"}], model="primary")
+            raise AssertionError("expected HTTPException")
+        except HTTPException as e:
+            assert e.status_code == 404
+        await client.close()
+        assert content == "answer from primary"
+    asyncio.run(replay())
+
+
+def test_records_compressed_responses():
+    cassette = os.path.join(tempfile.mkdtemp(), "cassette.jsonl")
+
+    async def record(fake):
+        fake.plan["primary"] = ["gzip"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], transport_mode="record", cassette_path=cassette)
+        content = await client.chat(MESSAGES, model="primary")
+        await client.close()
+        assert content == "answer from primary"
+    run_with_fake(record)
+
+    with open(cassette, "r", encoding="utf-8") as f:
+        record_line = json.loads(f.readline())
+    assert json.loads(record_line["body"])["choices"][0]["message"]["content"] == "answer from primary"
+
+
+def test_quiz_generation_coalesces_and_retries():
+    import quiz_service
+
+    async def scenario(fake):
+        fake.plan["primary"] = ["500", "quiz"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], max_retries=1)
+        original = quiz_service.llm_client, quiz_service.model_router
+        quiz_service.llm_client = client
+        quiz_service.model_router = ModelRouter(routes={"quiz": [["primary"]]}, explore_rate=0)
+        try:
+            results = await asyncio.gather(*[
+                quiz_service.generate_quiz_questions_ai("Topic", "Explanation", 3) for _ in range(3)
+            ])
+        finally:
+            quiz_service.llm_client, quiz_service.model_router = original
+            await client.close()
+        assert all(len(questions) == 3 for questions in results)
+        # One retried upstream call serves all three identical requests
+        assert fake.requests == ["primary"] * 2
+        assert client.coalesced_calls == 2
+    run_with_fake(scenario)
+
+
+def test_router_prefers_fastest_healthy_model():
+    async def scenario(fake):
+        fake.plan["slow"] = ["slow:0.2"]
+        fake.plan["fast"] = ["500"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], max_retries=0, coalesce=False)
+        router = ModelRouter(routes={"quiz": [["slow", "fast"]]}, explore_rate=0)
+        client.add_observer(router.observe)
+        for i in range(4):
+            try:
+                await client.chat(MESSAGES, model=router.select("quiz"))
+            except HTTPException:
+                pass
+        # "fast" keeps failing, so traffic settles on the slower healthy model
+        assert router.select("quiz") == "slow"
+        fake.plan["fast"] = ["ok"]
+        router._model_stats("quiz", "fast").error_rate = 0.0
+        await client.chat(MESSAGES, model="fast")
+        await client.close()
+        assert router.select("quiz") == "fast"
+        assert router.stats()["recent_decisions"][0]["reason"] == "fastest"
+    run_with_fake(scenario)
+
+
+def test_router_readmits_model_after_breaker_cooldown():
+    async def scenario(fake):
+        fake.plan["primary"] = ["500", "500", "500", "500", "500", "ok"]
+        client = LLMClient(api_url=fake.url, fallback_models=[], max_retries=0, coalesce=False, breaker_cooldown=0.1)
+        router = ModelRouter(routes={"chat": [["primary", "backup"]]}, explore_rate=0)
+        global_client, llm_router.llm_client = llm_router.llm_client, client
+        try:
+            for _ in range(5):
+                try:
+                    await client.chat(MESSAGES, model="primary")
+                except HTTPException:
+                    pass
+            assert router.select("chat") == "backup"
+            assert client.breaker_state("primary") == "open"
+            # Nothing calls the open breaker while it is not routed to, yet it is eligible after the cooldown
+            await asyncio.sleep(0.15)
+            assert router.select("chat") == "primary"
+            assert router.stats()["models"]["chat"]["primary"]["circuit_breaker"] == "half_open"
+            assert await client.chat(MESSAGES, model="primary") == "answer from primary"
+            assert client.breaker_state("primary") == "closed"
+        finally:
+            llm_router.llm_client = global_client
+            await client.close()
+    run_with_fake(scenario)
+
+
+if __name__ == "__main__":
+    print("LLM Client Resilience Test")
+    print("=" * 50)
+    tests = [
+        test_retries_transient_errors,
+        test_does_not_retry_client_errors,
+        test_falls_back_to_next_model,
+        test_circuit_breaker_fails_fast,
+        test_breaker_recovers_after_cooldown,
+        test_hedges_slow_requests,
+        test_records_and_replays_cassette,
+        test_records_compressed_responses,
+        test_quiz_generation_coalesces_and_retries,
+        test_router_prefers_fastest_healthy_model,
+        test_router_readmits_model_after_breaker_cooldown,
+    ]
+    failed = False
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except Exception as e:
+            failed = True
+            print(f"❌ {test.__name__}: {e!r}")
+    print("=" * 50)
+    if failed:
+        sys.exit(1)
+    print("✅ All LLM client tests passed!")
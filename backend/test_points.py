@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for level computation and atomic point awards
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import database
+from database import MONGO_URI, init_database, close_database, get_collection
+from gamification_service import gamification_service
+from leveling import LEVEL_THRESHOLDS, level_state
+
+PARALLEL_AWARDS = 1000
+# The database tests run against their own database, never the application's
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI", MONGO_URI)
+TEST_MONGO_DB = os.getenv("TEST_MONGO_DB", "Quantitative-chatbot-test")
+
+
+def legacy_level_state(total_points: int) -> dict:
+    """The step-by-step level loop add_points used before the closed form"""
+    level, experience, to_next = 1, total_points, 100
+    while experience >= to_next:
+        level += 1
+        experience -= to_next
+        to_next = int(to_next * 1.5)
+    return {"level": level, "experience": experience, "experience_to_next_level": to_next}
+
+
+def mongo_available() -> bool:
+    try:
+        MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+def test_closed_form_matches_progression_loop():
+    for total in range(0, 20000):
+        assert level_state(total) == legacy_level_state(total), total
+    # Around every level boundary, far beyond realistic totals
+    for threshold in LEVEL_THRESHOLDS[:60]:
+        for total in (threshold - 1, threshold, threshold + 1):
+            if total >= 0:
+                assert level_state(total) == legacy_level_state(total), total
+
+
+def test_parallel_awards_lose_no_points():
+    if not mongo_available():
+        pytest.skip(f"MongoDB not reachable at {TEST_MONGO_URI} (set TEST_MONGO_URI)")
+
+    async def scenario():
+        configured = database.MONGO_URI, database.MONGO_DB
+        database.MONGO_URI, database.MONGO_DB = TEST_MONGO_URI, TEST_MONGO_DB
+        await init_database()
+        database.MONGO_URI, database.MONGO_DB = configured
+        user_id = f"test_points_{uuid.uuid4().hex}"
+        try:
+            results = await asyncio.gather(*[
+                gamification_service.add_points(user_id, 1, "Stress test") for _ in range(PARALLEL_AWARDS)
+            ])
+            stats = await get_collection("user_stats").find_one({"user_id": user_id})
+            assert all(result is not None for result in results)
+            assert stats["total_points"] == PARALLEL_AWARDS
+            for field, value in level_state(PARALLEL_AWARDS).items():
+                assert stats[field] == value, field
+            # Every award saw a distinct pre-image, so exactly one reports each level-up
+            assert sum(result["level_up"] for result in results) == stats["level"] - 1
+        finally:
+            await get_collection("user_stats").delete_one({"user_id": user_id})
+            await close_database()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    print("Points and Levels Test")
+    print("=" * 50)
+    tests = [
+        test_closed_form_matches_progression_loop,
+        test_parallel_awards_lose_no_points,
+    ]
+    failed = False
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except pytest.skip.Exception as e:
+            print(f"- {test.__name__} skipped: {e.msg}")
+        except Exception as e:
+            failed = True
+            print(f"❌ {test.__name__}: {e!r}")
+    print("=" * 50)
+    if failed:
+        sys.exit(1)
+    print("✅ All points tests passed!")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the packing of topic completion into progress bitsets
+"""
+
+import os
+import random
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bson.int64 import Int64
+
+from progress_snapshots import (
+    WORD_BITS,
+    _bit,
+    _word,
+    build_snapshot,
+    completed_at,
+    completed_count,
+    completed_ids,
+    is_completed,
+)
+
+INT64_MAX = 2 ** 63 - 1
+
+
+def test_word_boundaries():
+    assert (_word(0), _bit(0)) == ("w0", 1)
+    # Ids 62 and 63 sit on either side of the first word boundary, 63 and 64 in the second word
+    assert (_word(62), _bit(62)) == ("w0", 1 << 62)
+    assert (_word(63), _bit(63)) == ("w1", 1)
+    assert (_word(64), _bit(64)) == ("w1", 2)
+    assert (_word(125), _bit(125)) == ("w1", 1 << 62)
+    assert (_word(126), _bit(126)) == ("w2", 1)
+
+
+def test_words_stay_positive_int64():
+    # Every bit of a word set is the largest word value and must still be a positive Int64
+    snapshot = build_snapshot({topic_id: None for topic_id in range(2 * WORD_BITS)})
+    for value in snapshot["bits"].values():
+        assert isinstance(value, Int64)
+        assert value == INT64_MAX
+    # The $bit "and" mask that clears the top bit stays positive as well
+    clear_top = ~_bit(62) & (2 ** WORD_BITS - 1)
+    assert 0 < clear_top <= INT64_MAX
+    assert clear_top == INT64_MAX - (1 << 62)
+
+
+def test_top_bits_round_trip():
+    ids = {62, 63, 64, 125, 126}
+    snapshot = build_snapshot({topic_id: None for topic_id in ids})
+    assert completed_ids(snapshot) == ids
+    assert completed_count(snapshot) == len(ids)
+    for topic_id in range(130):
+        assert is_completed(snapshot, topic_id) == (topic_id in ids), topic_id
+
+
+def test_random_round_trip():
+    rng = random.Random(14)
+    for _ in range(200):
+        topic_times = {topic_id: f"2026-01-{topic_id % 28 + 1:02d}T00:00:00" for topic_id in rng.sample(range(500), rng.randint(0, 60))}
+        snapshot = build_snapshot(topic_times)
+        assert completed_ids(snapshot) == set(topic_times)
+        assert completed_count(snapshot) == len(topic_times)
+        for topic_id, at in topic_times.items():
+            assert completed_at(snapshot, topic_id) == at
+
+
+def test_empty_snapshot():
+    snapshot = build_snapshot({})
+    assert snapshot["bits"] == {}
+    assert completed_ids(snapshot) == set()
+    assert completed_count(snapshot) == 0
+    assert not is_completed({}, 0)
+    assert completed_at({}, 0) is None
+
+
+if __name__ == "__main__":
+    print("Progress Bitset Test")
+    print("=" * 50)
+    tests = [
+        test_word_boundaries,
+        test_words_stay_positive_int64,
+        test_top_bits_round_trip,
+        test_random_round_trip,
+        test_empty_snapshot,
+    ]
+    failed = False
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except Exception as e:
+            failed = True
+            print(f"❌ {test.__name__}: {e!r}")
+    print("=" * 50)
+    if failed:
+        sys.exit(1)
+    print("✅ All progress bitset tests passed!")
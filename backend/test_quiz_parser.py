@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental parser used on streamed AI quiz output
+"""
+
+import json
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from quiz_parser import QuizStreamParser, parse_quiz_objects
+from quiz_service import format_generated_question
+
+
+def question(i):
+    return {"question": f"Question {i}?", "options": ["A", "B", "C", "D"], "correct_answer": 0}
+
+
+def test_yields_each_object_as_soon_as_it_closes():
+    text = "[" + json.dumps(question(1)) + ", " + json.dumps(question(2)) + "]"
+    parser = QuizStreamParser()
+    completed = []
+    for i in range(0, len(text), 5):
+        completed.append(len(parser.feed(text[i:i + 5])))
+    # The first question is available before the second one has been streamed
+    first_ready = next(i for i, n in enumerate(completed) if n)
+    assert first_ready * 5 < len(json.dumps(question(1))) + 6
+    assert sum(completed) == 2
+
+
+def test_ignores_prose_and_code_fences():
+    text = "Here are your questions:\n```json\n[" + json.dumps(question(1)) + "]\n```"
+    assert parse_quiz_objects(text) == [question(1)]
+
+
+def test_braces_inside_strings_do_not_split_objects():
+    q = {**question(1), "explanation": "Use the set {1, 2} and \"quotes\" }"}
+    assert parse_quiz_objects(json.dumps([q])) == [q]
+
+
+def test_salvages_valid_questions_around_a_malformed_one():
+    text = "[" + json.dumps(question(1)) + ', {"question": "broken", "options": [}, ' + json.dumps(question(2)) + "]"
+    parser = QuizStreamParser()
+    assert parser.feed(text) == [question(1), question(2)]
+    assert parser.malformed == 1
+
+
+def test_repairs_trailing_commas():
+    assert parse_quiz_objects('[{"question": "Q?", "options": ["A", "B", "C", "D",], "correct_answer": 1,}]') == [
+        {"question": "Q?", "options": ["A", "B", "C", "D"], "correct_answer": 1}
+    ]
+
+
+def test_string_answer_index_is_coerced_and_range_checked():
+    text = json.dumps([
+        {**question(1), "correct_answer": "1"},
+        {**question(2), "correct_answer": "7"},
+        {**question(3), "correct_answer": "one"},
+        question(4),
+    ])
+    formatted = [format_generated_question(raw, "Topic") for raw in QuizStreamParser().feed(text)]
+    # A bad index drops only its own question, not the ones after it
+    assert [q and q["correctAnswer"] for q in formatted] == [1, None, None, 0]
+    assert isinstance(formatted[0]["correctAnswer"], int)
+
+
+if __name__ == "__main__":
+    print("Quiz Parser Test")
+    print("=" * 50)
+    tests = [
+        test_yields_each_object_as_soon_as_it_closes,
+        test_ignores_prose_and_code_fences,
+        test_braces_inside_strings_do_not_split_objects,
+        test_salvages_valid_questions_around_a_malformed_one,
+        test_repairs_trailing_commas,
+        test_string_answer_index_is_coerced_and_range_checked,
+    ]
+    failed = False
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except Exception as e:
+            failed = True
+            print(f"❌ {test.__name__}: {e!r}")
+    print("=" * 50)
+    if failed:
+        sys.exit(1)
+    print("✅ All quiz parser tests passed!")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the server-side study streak update used by buffered gamification writes
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gamification_buffer import streak_update_pipeline
+
+DAY = date(2026, 3, 10)
+
+
+def legacy_streak(stats: dict, today: date) -> dict:
+    """The read-modify-write update_study_streak performs for one action on today"""
+    last_activity = stats.get("last_activity")
+    current_streak = stats.get("current_streak", 0)
+    if last_activity:
+        days_diff = (today - date.fromisoformat(last_activity[:10])).days
+        if days_diff == 1:
+            current_streak += 1
+        elif days_diff != 0:
+            current_streak = 1
+    else:
+        current_streak = 1
+    return {
+        "current_streak": current_streak,
+        "longest_streak": max(stats.get("longest_streak", 0), current_streak),
+    }
+
+
+def evaluate(expression, doc: dict):
+    """Just enough of the aggregation expression language for the streak stages"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return doc.get(expression[1:])
+    if isinstance(expression, list):
+        return [evaluate(item, doc) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    (operator, argument), = expression.items()
+    if operator == "$switch":
+        for branch in argument["branches"]:
+            if evaluate(branch["case"], doc):
+                return evaluate(branch["then"], doc)
+        return evaluate(argument["default"], doc)
+    args = evaluate(argument, doc)
+    if operator == "$ifNull":
+        return args[0] if args[0] is not None else args[1]
+    if operator == "$substrCP":
+        return args[0][args[1]:args[1] + args[2]]
+    if operator == "$add":
+        return sum(args)
+    if operator == "$max":
+        return max(args)
+    if operator == "$gte":
+        return args[0] >= args[1]
+    if operator == "$eq":
+        return args[0] == args[1]
+    raise NotImplementedError(operator)
+
+
+def apply_stages(doc: dict, stages: list) -> dict:
+    for stage in stages:
+        doc = {**doc, **{field: evaluate(value, doc) for field, value in stage["$set"].items()}}
+    return doc
+
+
+def check_one_action(stats: dict, today: date) -> None:
+    at = f"{today.isoformat()}T12:00:00"
+    result = apply_stages(stats, streak_update_pipeline({today.isoformat(): at}))
+    expected = legacy_streak(stats, today)
+    for field, value in expected.items():
+        assert result[field] == value, (field, stats, result)
+    assert result["last_activity"] == max(stats.get("last_activity") or "", at)
+
+
+def test_same_day_keeps_streak():
+    check_one_action({"current_streak": 4, "longest_streak": 6, "last_activity": f"{DAY}T08:00:00"}, DAY)
+
+
+def test_next_day_extends_streak():
+    check_one_action({"current_streak": 4, "longest_streak": 6, "last_activity": f"{DAY - timedelta(days=1)}T23:59:00"}, DAY)
+    # Extending past the longest streak raises it too
+    check_one_action({"current_streak": 6, "longest_streak": 6, "last_activity": f"{DAY - timedelta(days=1)}T08:00:00"}, DAY)
+
+
+def test_gap_resets_streak():
+    for gap in (2, 3, 30):
+        check_one_action({"current_streak": 4, "longest_streak": 6, "last_activity": f"{DAY - timedelta(days=gap)}T08:00:00"}, DAY)
+
+
+def test_first_action_starts_streak():
+    check_one_action({}, DAY)
+
+
+def test_several_days_match_one_update_per_day():
+    stats = {"current_streak": 2, "longest_streak": 3, "last_activity": f"{DAY - timedelta(days=1)}T08:00:00"}
+    days = [DAY, DAY + timedelta(days=1), DAY + timedelta(days=3), DAY + timedelta(days=4)]
+    activity = {day.isoformat(): f"{day.isoformat()}T12:00:00" for day in days}
+    expected = dict(stats)
+    for day in days:
+        expected = {**expected, **legacy_streak(expected, day), "last_activity": activity[day.isoformat()]}
+    result = apply_stages(stats, streak_update_pipeline(activity))
+    for field in ("current_streak", "longest_streak", "last_activity"):
+        assert result[field] == expected[field], field
+
+
+if __name__ == "__main__":
+    print("Study Streak Test")
+    print("=" * 50)
+    tests = [
+        test_same_day_keeps_streak,
+        test_next_day_extends_streak,
+        test_gap_resets_streak,
+        test_first_action_starts_streak,
+        test_several_days_match_one_update_per_day,
+    ]
+    failed = False
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except Exception as e:
+            failed = True
+            print(f"❌ {test.__name__}: {e!r}")
+    print("=" * 50)
+    if failed:
+        sys.exit(1)
+    print("✅ All streak tests passed!")
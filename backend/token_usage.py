@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo import UpdateOne
+
+from auth import get_current_user
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Usage accounting configuration
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "5"))
+LLM_USAGE_FLUSH_BATCH = int(os.getenv("LLM_USAGE_FLUSH_BATCH", "100"))
+
+# Quota configuration (0 disables enforcement)
+LLM_USER_TOKENS_PER_MINUTE = int(os.getenv("LLM_USER_TOKENS_PER_MINUTE", "20000"))
+LLM_USER_TOKEN_BURST = int(os.getenv("LLM_USER_TOKEN_BURST", str(LLM_USER_TOKENS_PER_MINUTE)))
+LLM_ANONYMOUS_TOKENS_PER_MINUTE = int(os.getenv("LLM_ANONYMOUS_TOKENS_PER_MINUTE", "5000"))
+# Completion size assumed when reserving quota before the real usage is known
+LLM_ESTIMATED_COMPLETION_TOKENS = int(os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", "500"))
+
+# Seconds between sweeps that drop buckets which have refilled completely
+QUOTA_SWEEP_INTERVAL = 60
+
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """Rough prompt size estimate (about four characters per token)"""
+    chars = 0
+    for m in messages:
+        content = m.content if hasattr(m, "content") else m.get("content", "")
+        chars += len(content or "")
+    return chars // 4 + 4 * len(messages)
+
+
+class TokenBucketLimiter:
+    """Per-user in-memory token buckets refilled continuously at a tokens-per-minute rate"""
+
+    def __init__(
+        self,
+        tokens_per_minute: int = LLM_USER_TOKENS_PER_MINUTE,
+        burst: int = LLM_USER_TOKEN_BURST,
+        anonymous_tokens_per_minute: int = LLM_ANONYMOUS_TOKENS_PER_MINUTE,
+    ):
+        self.tokens_per_minute = tokens_per_minute
+        self.burst = burst
+        self.anonymous_tokens_per_minute = anonymous_tokens_per_minute
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._swept_at = time.monotonic()
+        self.rejections = 0
+
+    def _limits(self, key: str) -> Tuple[float, float]:
+        if key.startswith("anon:"):
+            return self.anonymous_tokens_per_minute, self.anonymous_tokens_per_minute
+        return self.tokens_per_minute, self.burst
+
+    def _refill(self, key: str) -> float:
+        rate, capacity = self._limits(key)
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate / 60.0)
+        self._buckets[key] = (tokens, now)
+        return tokens
+
+    def _sweep(self, now: float) -> None:
+        """Forget buckets that are full again; a missing bucket starts full, so nothing changes for their users"""
+        self._swept_at = now
+        full = []
+        for key, (tokens, updated) in self._buckets.items():
+            rate, capacity = self._limits(key)
+            if rate <= 0 or tokens + (now - updated) * rate / 60.0 >= capacity:
+                full.append(key)
+        for key in full:
+            del self._buckets[key]
+
+    def reserve(self, key: str, tokens: int) -> int:
+        """Reserve an estimated token cost up front, raising 429 when the user's bucket cannot cover it"""
+        rate, capacity = self._limits(key)
+        if rate <= 0:
+            return 0
+        now = time.monotonic()
+        if now - self._swept_at >= QUOTA_SWEEP_INTERVAL:
+            self._sweep(now)
+        available = self._refill(key)
+        needed = min(tokens, capacity)
+        if available < needed:
+            self.rejections += 1
+            retry_after = int((needed - available) * 60.0 / rate) + 1
+            logger.warning(f"LLM token quota exceeded for {key} (needed {needed}, available {int(available)})")
+            raise HTTPException(
+                status_code=429,
+                detail="AI usage limit reached, please try again shortly",
+                headers={"Retry-After": str(retry_after)},
+            )
+        self._buckets[key] = (available - needed, self._buckets[key][1])
+        return needed
+
+    def settle(self, key: str, reserved: int, actual: int) -> None:
+        """Correct a reservation once the real token usage is known"""
+        rate, _ = self._limits(key)
+        if rate <= 0 or key not in self._buckets:
+            return
+        tokens, updated = self._buckets[key]
+        self._buckets[key] = (tokens + reserved - actual, updated)
+
+
+class UsageRecorder:
+    """Aggregates prompt/completion tokens per user and day in memory and writes them in batches"""
+
+    def __init__(self, flush_interval: float = LLM_USAGE_FLUSH_INTERVAL, flush_batch: int = LLM_USAGE_FLUSH_BATCH):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._pending: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._events_since_flush = 0
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def record(self, user_key: str, usage: Optional[Dict[str, Any]]) -> int:
+        """Add one response's usage to the pending totals and return its total token count"""
+        if not usage:
+            return 0
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        day = datetime.utcnow().date().isoformat()
+        totals = self._pending.setdefault((user_key, day), {"prompt_tokens": 0, "completion_tokens": 0, "requests": 0})
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["requests"] += 1
+        self._events_since_flush += 1
+        if self._events_since_flush >= self.flush_batch:
+            asyncio.ensure_future(self.flush())
+        return prompt_tokens + completion_tokens
+
+    async def flush(self) -> int:
+        """Write pending totals with a single bulk_write of $inc upserts"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._events_since_flush = 0
+            usage_col = get_collection("llm_usage")
+            if usage_col is None:
+                return 0
+            operations = [
+                UpdateOne(
+                    {"user_id": user_key, "day": day},
+                    {"$inc": totals, "$set": {"updated_at": datetime.utcnow().isoformat()}},
+                    upsert=True,
+                )
+                for (user_key, day), totals in pending.items()
+            ]
+            try:
+                await usage_col.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to flush LLM usage, re-queueing {len(operations)} entries: {e}")
+                for key, totals in pending.items():
+                    merged = self._pending.setdefault(key, {"prompt_tokens": 0, "completion_tokens": 0, "requests": 0})
+                    for field, value in totals.items():
+                        merged[field] += value
+                return 0
+            return len(operations)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+# Global instances
+llm_quota = TokenBucketLimiter()
+usage_recorder = UsageRecorder()
+
+
+def llm_user_key(authorization: Optional[str], request: Request) -> str:
+    """Key LLM usage by user id, or by client address for anonymous callers"""
+    if authorization:
+        try:
+            user_id = get_current_user(authorization).get("sub")
+            if user_id:
+                return user_id
+        except HTTPException:
+            pass
+    return f"anon:{request.client.host if request.client else 'unknown'}"
+
+
+def reserve_llm_tokens(user_key: str, messages: List[Any]) -> int:
+    """Check the user's quota before an upstream call; raises 429 when exhausted"""
+    return llm_quota.reserve(user_key, estimate_tokens(messages) + LLM_ESTIMATED_COMPLETION_TOKENS)
+
+
+def record_llm_usage(user_key: str, reserved: int, usage: Optional[Dict[str, Any]]) -> None:
+    """Account a completed call's usage and reconcile the quota reservation with it"""
+    actual = usage_recorder.record(user_key, usage)
+    llm_quota.settle(user_key, reserved, actual if usage else reserved)
+
+
+def release_llm_tokens(user_key: str, reserved: int) -> None:
+    """Return a reservation for a call that failed before producing any tokens"""
+    llm_quota.settle(user_key, reserved, 0)
@@ -0,0 +1,68 @@
+import logging
+from typing import Dict, Iterable, List
+
+from pymongo.errors import DuplicateKeyError
+
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+
+class TopicCatalog:
+    """Stable numeric ids for topic names, stored in topic_catalog as {_id: <int>, topic: <name>}.
+
+    Ids are append-only and never reused, so the in-process maps only ever miss on topics
+    assigned elsewhere since the last load; a miss reloads before assigning a new id.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._topics: Dict[int, str] = {}
+
+    async def load(self) -> None:
+        catalog_col = get_collection("topic_catalog")
+        if catalog_col is None:
+            return
+        docs = await catalog_col.find({}).to_list(length=None)
+        self._ids = {d["topic"]: d["_id"] for d in docs}
+        self._topics = {d["_id"]: d["topic"] for d in docs}
+
+    async def _assign(self, topic: str) -> int:
+        catalog_col = get_collection("topic_catalog")
+        while True:
+            await self.load()
+            if topic in self._ids:
+                return self._ids[topic]
+            next_id = max(self._topics, default=-1) + 1
+            try:
+                # Unique indexes on _id and topic make concurrent assignments safe: the loser reloads and retries
+                await catalog_col.insert_one({"_id": next_id, "topic": topic})
+            except DuplicateKeyError:
+                continue
+            logger.info(f"Assigned topic id {next_id} to {topic}")
+            self._ids[topic] = next_id
+            self._topics[next_id] = topic
+            return next_id
+
+    async def ids_for(self, topics: Iterable[str]) -> Dict[str, int]:
+        """Map topic names to ids, assigning ids to topics seen for the first time"""
+        result = {}
+        for topic in topics:
+            if topic not in self._ids:
+                await self._assign(topic)
+            result[topic] = self._ids[topic]
+        return result
+
+    async def id_for(self, topic: str) -> int:
+        return (await self.ids_for([topic]))[topic]
+
+    async def topics_for(self, topic_ids: Iterable[int]) -> List[str]:
+        """Names for ids, in id order; unknown ids (not expected) are skipped"""
+        topic_ids = sorted(topic_ids)
+        if any(i not in self._topics for i in topic_ids):
+            await self.load()
+        return [self._topics[i] for i in topic_ids if i in self._topics]
+
+
+# Global instance
+topic_catalog = TopicCatalog()